@@ -24,6 +24,10 @@ def create_app(config_class=Config):
     migrate.init_app(app, db)
     login.init_app(app)
 
+    # Write listeners: daily rollups (CloserDailyStats), booking slot index, calendar outbox,
+    # closer portfolios, balances of repriced programs; lead search index DDL for create_all
+    from app import stats, slots, calendar_sync, portfolio, search, balances
+
     # Register Blueprints
     from app.routes import main
     app.register_blueprint(main)
@@ -46,4 +50,12 @@ def create_app(config_class=Config):
     from app.google_auth import bp as google_auth_bp
     app.register_blueprint(google_auth_bp, url_prefix='/google')
 
+    # Periodic jobs (lead status transitions), one thread per web process
+    from app import scheduler
+    scheduler.init_app(app)
+
+    # Opt-in SQL profiler (query counts, DB time, N+1 suspects per request)
+    from app import profiler
+    profiler.init_app(app)
+
     return app
@@ -0,0 +1,13 @@
+from flask import render_template, current_app
+from app.admin import bp
+from app.admin.routes import admin_required
+from app.profiler import endpoint_summary
+
+@bp.route('/sql-profile')
+@admin_required
+def sql_profile():
+    window = current_app.config.get('SQL_PROFILER_WINDOW', 3600)
+    endpoints = endpoint_summary(window)
+    return render_template('admin/sql_profile.html', endpoints=endpoints, window_minutes=window // 60,
+                           enabled=current_app.config.get('SQL_PROFILER'),
+                           threshold=current_app.config.get('SQL_PROFILER_N_PLUS_ONE', 5))
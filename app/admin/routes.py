@@ -5,11 +5,11 @@ from app.admin import bp
 from app.admin.forms import UserForm, SurveyQuestionForm, EventForm, ProgramForm, PaymentMethodForm, ClientEditForm, PaymentForm, ExpenseForm, RecurringExpenseForm, EventGroupForm, ManualAddForm, AdminSaleForm
 from app.closer.forms import SaleForm, LeadForm
 from app.closer.utils import send_sales_webhook
-from app.models import User, CloserDailyStats, SurveyQuestion, Event, Program, PaymentMethod, db, Enrollment, Payment, Appointment, LeadProfile, Expense, RecurringExpense, EventGroup, UserViewSetting, Integration, DailyReportQuestion
+from app.models import User, CloserDailyStats, SurveyQuestion, Event, Program, PaymentMethod, Enrollment, Payment, Appointment, LeadProfile, Expense, RecurringExpense, EventGroup, UserViewSetting, Integration, DailyReportQuestion
 from datetime import datetime, date, time, timedelta
 from sqlalchemy import or_
 from app.decorators import role_required
-import json
+from app.tiles import get_tiles_data
 
 from functools import wraps
 
@@ -87,9 +87,6 @@ def closer_stats():
 @bp.route('/dashboard')
 @admin_required
 def dashboard():
-    with open('tiles_config.json') as f:
-        tiles_config = json.load(f)
-
     # --- Date Filtering Logic ---
     today = date.today()
     period = request.args.get('period', 'this_month')
@@ -117,15 +114,8 @@ def dashboard():
     start_dt = datetime.combine(start_date, time.min)
     end_dt = datetime.combine(end_date, time.max)
 
-    tiles_data = []
-    for tile in tiles_config:
-        # Execute query
-        result = db.engine.execute(tile['query'].replace("DATE('now', 'start of month')", f"'{start_date}'"))
-        value = result.fetchone()[0]
-        tiles_data.append({
-            "title": tile["title"],
-            "value": value
-        })
+    # Tiles are compiled once and cached per period window (see app/tiles.py)
+    tiles_data = get_tiles_data(start_dt, end_dt)
 
     return render_template('admin/dashboard.html', tiles_data=tiles_data)
 
@@ -0,0 +1,22 @@
+from flask import render_template, redirect, url_for, flash, request
+from app.admin import bp
+from app.admin.routes import admin_required
+from app import db
+from app.models import SalesWebhookEvent
+from app.sales_webhooks import retry_dead_events
+
+@bp.route('/webhooks/sales')
+@admin_required
+def sales_webhook_queue():
+    status = request.args.get('status', 'dead')
+    events = SalesWebhookEvent.query.filter_by(status=status).order_by(SalesWebhookEvent.id.desc()).limit(200).all()
+    counts = dict(db.session.query(SalesWebhookEvent.status, db.func.count(SalesWebhookEvent.id)).group_by(SalesWebhookEvent.status).all())
+    return render_template('admin/sales_webhook_queue.html', events=events, counts=counts, status=status)
+
+@bp.route('/webhooks/sales/retry', methods=['POST'])
+@admin_required
+def retry_sales_webhooks():
+    event_id = request.form.get('event_id', type=int)
+    count = retry_dead_events([event_id] if event_id else None)
+    flash(f'{count} webhooks reenviados a la cola.')
+    return redirect(url_for('admin.sales_webhook_queue'))
@@ -0,0 +1,102 @@
+from sqlalchemy import event, inspect, update
+from app import db
+from app.models import Enrollment, Payment, Program
+
+# Tolerance when comparing stored vs recomputed amounts (float columns)
+DRIFT_TOLERANCE = 0.005
+
+def rebuild_balances(dry_run=False):
+    """
+    Recomputes every enrollment balance from scratch (one grouped query over payments)
+    and compares it with the stored columns.
+
+    Returns a list of drift dicts: {'enrollment_id', 'field', 'stored', 'computed'}.
+    Unless dry_run is True, the drifted rows are fixed and committed.
+    """
+    paid_sq = db.session.query(
+        Payment.enrollment_id.label('enrollment_id'),
+        db.func.sum(Payment.amount).label('paid')
+    ).filter(Payment.status == 'completed').group_by(Payment.enrollment_id).subquery()
+
+    rows = db.session.query(
+        Enrollment,
+        db.func.coalesce(paid_sq.c.paid, 0.0),
+        db.func.coalesce(Enrollment.total_agreed, Program.price, 0.0)
+    ).outerjoin(paid_sq, paid_sq.c.enrollment_id == Enrollment.id).outerjoin(
+        Program, Enrollment.program_id == Program.id
+    ).all()
+
+    drift = []
+    for enrollment, paid, agreed in rows:
+        computed = {
+            'paid_total': paid,
+            'agreed_total': agreed,
+            'outstanding': max(agreed - paid, 0.0)
+        }
+        for field, value in computed.items():
+            stored = getattr(enrollment, field)
+            if stored is None or abs(stored - value) > DRIFT_TOLERANCE:
+                drift.append({
+                    'enrollment_id': enrollment.id,
+                    'field': field,
+                    'stored': stored,
+                    'computed': value
+                })
+                if not dry_run:
+                    setattr(enrollment, field, value)
+
+    if not dry_run:
+        db.session.commit()
+
+    return drift
+
+def refresh_balances(enrollment_ids):
+    """
+    Recomputes the stored balance of the given enrollments in one grouped query,
+    for payments written with bulk inserts (update_balance is per enrollment).
+    Does not commit.
+    """
+    if not enrollment_ids:
+        return
+    paid = dict(db.session.query(Payment.enrollment_id, db.func.sum(Payment.amount)).filter(
+        Payment.enrollment_id.in_(enrollment_ids),
+        Payment.status == 'completed'
+    ).group_by(Payment.enrollment_id).all())
+
+    rows = db.session.query(
+        Enrollment.id,
+        db.func.coalesce(Enrollment.total_agreed, Program.price, 0.0)
+    ).outerjoin(Program, Enrollment.program_id == Program.id).filter(Enrollment.id.in_(enrollment_ids)).all()
+
+    db.session.execute(update(Enrollment), [{
+        'id': enrollment_id,
+        'paid_total': paid.get(enrollment_id) or 0.0,
+        'agreed_total': agreed,
+        'outstanding': max(agreed - (paid.get(enrollment_id) or 0.0), 0.0)
+    } for enrollment_id, agreed in rows])
+
+# --- Program price changes ---
+# Enrollments without total_agreed are owed their program's price, so a new
+# price changes their stored agreed_total/outstanding.
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_repriced_programs(session, flush_context, instances):
+    pending = session.info.setdefault('repriced_programs', set())
+    for obj in session.dirty:
+        if isinstance(obj, Program) and inspect(obj).attrs.price.history.has_changes():
+            pending.add(obj.id)
+
+@event.listens_for(db.session, 'before_commit')
+def _refresh_repriced_enrollments(session):
+    session.flush()
+    program_ids = session.info.pop('repriced_programs', None)
+    if not program_ids:
+        return
+    refresh_balances([enrollment_id for (enrollment_id,) in session.query(Enrollment.id).filter(
+        Enrollment.program_id.in_(program_ids),
+        Enrollment.total_agreed.is_(None)
+    )])
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_repriced_programs(session):
+    session.info.pop('repriced_programs', None)
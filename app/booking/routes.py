@@ -1,12 +1,12 @@
 from flask import render_template, redirect, url_for, flash, request, session
 from app.booking import bp
 from app import db
-from app.models import User, LeadProfile, Event, Availability, Appointment, SurveyQuestion, SurveyAnswer
-from werkzeug.security import generate_password_hash
-import uuid
-from datetime import datetime, timedelta, date, time
+from app.models import User, LeadProfile, Event, SurveyQuestion, SurveyAnswer, normalize_phone, normalize_instagram
+from datetime import datetime, timedelta
 from sqlalchemy import or_
-from app.closer.utils import send_calendar_webhook
+from app.slots import available_slots, reserve_slot
+from app.statuses import apply_lead_statuses
+from app.queries import match_leads_by_contact, possible_duplicate_note
 
 @bp.route('/booking', methods=['GET'])
 def start_booking():
@@ -131,7 +131,6 @@ def contact_details_view():
                 flash('Error de sesión. Por favor inicie nuevamente.')
                 return redirect(url_for('booking.start_booking'))
                 
-            temp_pass = str(uuid.uuid4())
             base_username = name or email.split('@')[0]
             # ... username uniqueness logic ...
             username = base_username[:60]
@@ -140,11 +139,17 @@ def contact_details_view():
                 username = f"{base_username}_{random.randint(1000,9999)}"[:64]
                 
             user = User(username=username, email=email, role='lead')
-            user.set_password(temp_pass)
+            user.set_unusable_password()
             db.session.add(user)
             db.session.flush()
             
             profile = LeadProfile(user_id=user.id, phone=full_phone, instagram=instagram, utm_source=utm_source, status='new')
+            # Unknown email but a known phone / Instagram: possibly a returning lead. The visitor is not
+            # logged into that lead (a phone number proves nothing); staff get a note to merge them.
+            by_phone, by_handle = match_leads_by_contact([full_phone], [instagram])
+            match_id = by_phone.get(normalize_phone(full_phone)) or by_handle.get(normalize_instagram(instagram))
+            if match_id and match_id != user.id:
+                profile.notes = possible_duplicate_note(match_id)
             db.session.add(profile)
             db.session.commit()
             
@@ -191,38 +196,23 @@ def _flush_session_data(user_id):
     """Saves cached slot/answers to DB for this user."""
     bdata = session.get('booking_data', {})
     
-    # 1. Flush Slot -> Appointment
+    # 1. Flush Slot -> Appointment (needs a lead to book for)
     slot = bdata.get('slot')
-    if slot:
+    if slot and user_id:
         utc_iso = slot.get('utc_iso')
         if utc_iso:
             start_time = datetime.fromisoformat(utc_iso.replace('Z', '+00:00')).replace(tzinfo=None)
             
-            # Check duplicate
-            exists = Appointment.query.filter_by(closer_id=slot['closer_id'], start_time=start_time).filter(Appointment.status!='canceled').first()
-            if not exists:
-                appt = Appointment(
-                    closer_id=slot['closer_id'],
-                    lead_id=user_id,
-                    start_time=start_time,
-                    status='scheduled', # or pending_survey? if survey not done yet
-                    event_id=session.get('booking_event_id')
-                )
-                db.session.add(appt)
-                db.session.commit()
+            # Atomic claim (unique index), falls back to the same time with another closer
+            appt, _ = reserve_slot(slot['closer_id'], user_id, start_time, session.get('booking_event_id'))
+            if appt:
                 session['current_appt_id'] = appt.id
                 
-                # Trigger Webhook
-                send_calendar_webhook(appt, 'created')
-                
                 # Update User Status automatically
-                user = User.query.get(user_id)
-                if user:
-                    user.update_status_based_on_debt()
+                apply_lead_statuses([user_id])
+                db.session.commit()
                 
-                # Clear slot from session
-                bdata['slot'] = None
-                session['booking_data'] = bdata
+            # Clear slot from session
             bdata['slot'] = None
             session['booking_data'] = bdata
 
@@ -251,93 +241,19 @@ def _flush_session_data(user_id):
 
 @bp.route('/booking/calendar')
 def calendar_view():
-    import pytz
-    
-    # 1. Fetch Availability (Stored in Closer's Local Time - assumed per closer)
-    # Optimization: Filter roughly by date range first
-    today = date.today()
-    end_date = today + timedelta(days=14)
-    # Filter by date AND ensure role is 'closer' (exclude admins)
-    availabilities = Availability.query.join(Availability.closer).filter(
-        Availability.date >= today, 
-        Availability.date <= end_date,
-        User.role == 'closer'
-    ).all()
-    
-    # 2. Fetch Appointments (Stored in UTC)
-    # Need to filter effectively in UTC, so convert range to UTC
-    # Since we don't know closer TZ yet, just fetch broad range
-    appointments = Appointment.query.filter(
-        Appointment.start_time >= datetime.utcnow(),
-        Appointment.start_time <= datetime.utcnow() + timedelta(days=15),
-        Appointment.status != 'canceled'
-    ).all()
-    
-    booked_slots = set()
-    for appt in appointments:
-        # appt.start_time is naive but implicitly UTC
-        booked_slots.add((appt.closer_id, appt.start_time))
-        
-    daily_slots_utc = {} # Key: Date (User's perspective? No, keep simple list) -> actually list of objects
-    # We will send a flat list of available slots in UTC to the frontend
+    # Free slots come precomputed in UTC from the slot index (see app/slots.py)
+    # We send a flat list of available slots in UTC to the frontend
     # and let JS handle the Grouping by Day (Client Time)
-    
-    available_slots_utc = []
-    
-    unique_slots = {}
-    preferred_id = session.get('preferred_closer_id')
-
-    for av in availabilities:
-        closer = av.closer
-        if not closer: continue
-        
-        # Get Closer Timezone
-        try:
-            closer_tz = pytz.timezone(closer.timezone or 'America/La_Paz')
-        except pytz.UnknownTimeZoneError:
-            closer_tz = pytz.timezone('America/La_Paz')
-            
-        # Create Local Datetime
-        local_dt = datetime.combine(av.date, av.start_time) # Naive
-        local_dt = closer_tz.localize(local_dt) # Aware (Closer Time)
-        
-        # Convert to UTC
-        utc_dt = local_dt.astimezone(pytz.UTC).replace(tzinfo=None) # Make naive UTC for comparison with DB
-        
-        # Filter Past
-        if utc_dt < datetime.utcnow(): continue
-        
-        # Check Booking (utc_dt)
-        if (av.closer_id, utc_dt) not in booked_slots:
-            ts_key = utc_dt
-            
-            # If not present, add it
-            if ts_key not in unique_slots:
-                unique_slots[ts_key] = {
-                    'utc_iso': utc_dt.isoformat() + 'Z', # Explicit Z for JS
-                    'closer_id': av.closer_id,
-                    'ts': utc_dt.timestamp()
-                }
-            # If present, check if we should swap for preferred closer
-            elif preferred_id and av.closer_id == preferred_id:
-                 unique_slots[ts_key]['closer_id'] = av.closer_id
-            
-    available_slots_utc = list(unique_slots.values())
-    
-    # DEBUG: Print what we are sending
-    print(f"DEBUG SLOTS sending to frontend ({len(available_slots_utc)}):")
-    for s in available_slots_utc:
-        print(f"  -> {s['utc_iso']} (Closer {s['closer_id']})")
-            
-    # Sort by time
-    available_slots_utc.sort(key=lambda x: x['ts'])
+    now = datetime.utcnow()
+    available_slots_utc = available_slots(now, now + timedelta(days=15), session.get('preferred_closer_id'))
     
     # We pass raw slots to frontend, JS will group them
-    return render_template('booking/calendar.html', slots_json=available_slots_utc)
+    # 'suggested' is the next free slot offered when the chosen one was just taken
+    return render_template('booking/calendar.html', slots_json=available_slots_utc,
+                           suggested_slot=request.args.get('suggested'))
 
 @bp.route('/booking/select', methods=['POST'])
 def select_slot():
-    import pytz
     # We expect 'utc_iso' or explicit components. Let's rely on 'utc_iso' from frontend if possible, 
     # OR we can reconstruct if frontend sends localized date/time + offset?
     # Simplest: Frontend sends 'closer_id' AND 'utc_iso' for the chosen slot.
@@ -354,38 +270,24 @@ def select_slot():
     start_time_utc = datetime.fromisoformat(utc_iso.replace('Z', '+00:00')).replace(tzinfo=None) # Naive UTC
     chosen_closer_id = int(closer_id)
 
-    # Double Check Availability (Concurrency)
-    # Since Availability is Local, and Appointment is UTC, we must verify logic carefully.
-    # Actually, we trusted the 'calendar_view' calculation.
-    # Let's check overlap with Appointment (UTC)
-    conflict = Appointment.query.filter_by(closer_id=chosen_closer_id, start_time=start_time_utc).filter(Appointment.status != 'canceled').first()
-    
-    if conflict:
-        flash('Lo sentimos, este horario acaba de ser ocupado.')
-        return redirect(url_for('booking.calendar_view'))
-        
     # Check if User exists
     user_id = session.get('booking_user_id')
     
     if user_id:
-        # Create immediately (in UTC)
-        appt = Appointment(
-            closer_id=chosen_closer_id,
-            lead_id=user_id,
-            start_time=start_time_utc, # Stored as UTC
-            status='scheduled',
-            event_id=session.get('booking_event_id')
-        )
-        db.session.add(appt)
-        db.session.commit()
+        # Atomic claim: the unique index on (closer_id, start_time) rejects double bookings,
+        # so there is no separate conflict check
+        appt, suggested = reserve_slot(chosen_closer_id, user_id, start_time_utc, session.get('booking_event_id'))
+        if not appt:
+            if suggested:
+                flash('Lo sentimos, este horario acaba de ser ocupado. Te marcamos el siguiente horario disponible.')
+                return redirect(url_for('booking.calendar_view', suggested=suggested['utc_iso']))
+            flash('Lo sentimos, este horario acaba de ser ocupado.')
+            return redirect(url_for('booking.calendar_view'))
         session['current_appt_id'] = appt.id
         
         # Update User Status automatically
-        user = User.query.get(user_id)
-        if user:
-            user.update_status_based_on_debt()
-            
-        send_calendar_webhook(appt, 'created')
+        apply_lead_statuses([user_id])
+        db.session.commit()
     else:
         # Save to session (UTC) and redirect
         bdata = session.get('booking_data', {})
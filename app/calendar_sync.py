@@ -0,0 +1,137 @@
+"""
+Google Calendar outbox.
+
+Appointment writes add CalendarOutbox rows in the same flush (so they commit or
+roll back together with the appointment). `flask calendar-worker` drains the
+outbox outside the request: entries of one closer go out in order, repeated
+changes to the same appointment are coalesced into one sync of its current
+state (a new entry supersedes the appointment's pending ones), and failures
+are retried with exponential backoff.
+"""
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, inspect
+from app import db
+from app.models import Appointment, CalendarOutbox
+
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 6 * 60 * 60
+MAX_ATTEMPTS = 8
+
+TRACKED_FIELDS = ('closer_id', 'lead_id', 'start_time', 'status')
+
+def _supersede_pending(session, appointment_id):
+    """Settles an appointment's pending entries, the one being added syncs its current state."""
+    session.query(CalendarOutbox).filter(
+        CalendarOutbox.appointment_id == appointment_id,
+        CalendarOutbox.status == 'pending'
+    ).update({'status': 'superseded', 'processed_at': datetime.utcnow()}, synchronize_session=False)
+
+@event.listens_for(db.session, 'before_flush')
+def _enqueue_calendar_changes(session, flush_context, instances):
+    for obj in list(session.new):
+        if isinstance(obj, Appointment):
+            session.add(CalendarOutbox(appointment=obj, closer_id=obj.closer_id, action='created'))
+
+    for obj in list(session.dirty):
+        if not isinstance(obj, Appointment):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[f].history.has_changes() for f in TRACKED_FIELDS):
+            continue
+
+        # Moved to another closer: the event must leave the old closer's calendar
+        old_closer = state.attrs.closer_id.history.deleted
+        if old_closer and old_closer[0] and old_closer[0] != obj.closer_id and obj.google_event_id:
+            session.add(CalendarOutbox(closer_id=old_closer[0], action='deleted', google_event_id=obj.google_event_id))
+            obj.google_event_id = None
+
+        if state.attrs.status.history.has_changes() and obj.status == 'canceled':
+            action = 'canceled'
+        elif state.attrs.start_time.history.has_changes():
+            action = 'rescheduled'
+        else:
+            action = 'status_changed'
+        _supersede_pending(session, obj.id)
+        session.add(CalendarOutbox(appointment=obj, closer_id=obj.closer_id, action=action))
+
+    for obj in list(session.deleted):
+        if isinstance(obj, Appointment) and obj.google_event_id:
+            session.add(CalendarOutbox(closer_id=obj.closer_id, action='deleted', google_event_id=obj.google_event_id))
+
+def retry_delay(attempts):
+    """Exponential backoff: 30s, 60s, 120s... capped at 6h."""
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+def process_calendar_outbox(batch_size=50):
+    """
+    Sends one batch of pending outbox entries. Returns how many entries were
+    settled (synced, superseded or given up on).
+
+    Upserts go to the appointment's current closer; the closer stored on the
+    entry only orders the queue and names the calendar a delete applies to.
+    """
+    from app.closer.utils import sync_calendar_event
+    from app.google_auth.utils import evict_calendar_service
+
+    now = datetime.utcnow()
+    entries = CalendarOutbox.query.filter_by(status='pending').order_by(CalendarOutbox.id).limit(batch_size).all()
+
+    # Only the newest entry of an appointment is synced, it carries its current state
+    latest = {}
+    for entry in entries:
+        if entry.appointment_id:
+            latest[entry.appointment_id] = entry.id
+
+    settled = 0
+    blocked_closers = set() # A closer waiting on a retry keeps its later entries queued (ordering)
+    for entry in entries:
+        if entry.closer_id in blocked_closers:
+            continue
+        if entry.next_attempt_at and entry.next_attempt_at > now:
+            blocked_closers.add(entry.closer_id)
+            continue
+
+        if entry.appointment_id and latest[entry.appointment_id] != entry.id:
+            entry.status = 'superseded'
+            entry.last_error = None
+            entry.processed_at = now
+            db.session.commit()
+            settled += 1
+            continue
+
+        try:
+            if entry.action == 'deleted' or not entry.appointment_id:
+                sync_calendar_event(None, entry.closer_id, google_event_id=entry.google_event_id)
+            else:
+                sync_calendar_event(entry.appointment, entry.appointment.closer_id)
+            entry.status = 'done'
+            entry.processed_at = datetime.utcnow()
+            settled += 1
+        except Exception as e:
+            db.session.rollback() # Drop half-applied changes, keep the entry
+            evict_calendar_service(entry.closer_id) # Rebuild the client on retry (revoked/stale token)
+            entry.attempts = (entry.attempts or 0) + 1
+            entry.last_error = str(e)[:2000]
+            if entry.attempts >= MAX_ATTEMPTS:
+                entry.status = 'failed'
+                settled += 1
+                current_app.logger.error(f"Calendar sync gave up on outbox {entry.id} after {entry.attempts} attempts: {e}")
+            else:
+                entry.next_attempt_at = now + retry_delay(entry.attempts)
+                blocked_closers.add(entry.closer_id)
+                current_app.logger.warning(f"Calendar sync failed for outbox {entry.id} (attempt {entry.attempts}): {e}")
+        db.session.commit()
+
+    return settled
+
+def run_calendar_worker(interval=5, batch_size=50, once=False):
+    """Drains the outbox forever (or once), sleeping when there is nothing to do."""
+    while True:
+        settled = process_calendar_outbox(batch_size)
+        db.session.remove() # Fresh session per batch, don't keep stale objects around
+        if once:
+            return settled
+        if not settled:
+            time.sleep(interval)
@@ -1,9 +1,13 @@
-from flask import render_template, redirect, url_for, flash, request
+from flask import render_template, redirect, url_for, flash, request, jsonify, make_response
 from flask_login import login_required, current_user
 from app.closer import bp
 from app.models import Availability, Appointment, User, LeadProfile, SurveyAnswer, SurveyQuestion, Event, Program, PaymentMethod, Enrollment, Payment, db
 from app.closer.forms import SaleForm, LeadForm, AppointmentForm, CloserPaymentForm
-from sqlalchemy import or_
+from app.queries import load_lead_rows, debtors, keyset_page
+from app.search import search_users
+from app.portfolio import portfolio_leads
+from app.filters import FilterSpec, LEAD_SORTS, SALE_ORDER, lead_ids_cte, lead_page_query, lead_kpis, payment_ids_cte, sale_page_query, sale_kpis
+from sqlalchemy.exc import IntegrityError
 from functools import wraps
 from datetime import datetime, time, date, timedelta
 
@@ -21,203 +25,42 @@ def closer_required(f):
 @bp.route('/leads')
 @closer_required
 def leads_list():
-    # --- Persistence/Filtering Logic similar to Admin ---
-    search = request.args.get('search', '')
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
-    program_filter = request.args.get('program')
-    status_filter = request.args.get('status')
-    sort_by = request.args.get('sort_by', 'newest')
-
-    # Base Query: Users assigned to this closer
-    # Assigned via Enrollment OR Appointment? 
-    # Usually "My Clients" implies Sales. "My Leads" implies Appointments. 
-    # Let's include both: distinct users who have an enrollment w/ closer OR appointment w/ closer.
-    
-    # Subquery approach or Join?
-    # Users who have an Enrollment with closer_id = current
-    # OR Users who have an Appointment with closer_id = current
-    
-    # Simplify: 
-    # query = User.query.filter(User.role.in_(['lead', 'student']))
-    # query = query.filter(or_(User.enrollments.any(closer_id=current_user.id), User.appointments_as_lead.any(closer_id=current_user.id)))
-    # But `appointments_as_lead` is relationship name.
-    
-    query = User.query.filter(User.role.in_(['lead', 'student']))
-    
-    # Filter by assignment (Enrollment, Appointment, or Direct Assignment)
-    query = query.filter(
-        or_(
-            User.enrollments.any(Enrollment.closer_id == current_user.id),
-            User.appointments_as_lead.any(Appointment.closer_id == current_user.id),
-            User.lead_profile.has(assigned_closer_id=current_user.id)
-        )
+    # Filters parsed once; the page and the KPIs read the same base CTE
+    spec = FilterSpec.from_args(request.args)
+    # The closer's portfolio (enrollment, appointment or direct assignment) passing the filters
+    base = lead_ids_cte(spec, closer_id=current_user.id)
+
+    # Pagination: cursor from the previous "load more", no OFFSET/COUNT
+    users, next_cursor, start_index = keyset_page(
+        lead_page_query(base), LEAD_SORTS[spec.sort_by], per_page=50, cursor=request.args.get('cursor')
     )
-
-    # Joins for filtering attributes
-    if status_filter:
-        query = query.join(LeadProfile).filter(LeadProfile.status == status_filter)
-    
-    if program_filter:
-        query = query.join(Enrollment, Enrollment.student_id == User.id).filter(Enrollment.program_id == program_filter)
-
-    # Date Filter (Created At)
-    if start_date_str:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        query = query.filter(User.created_at >= start_date)
-    
-    if end_date_str:
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1)
-        query = query.filter(User.created_at < end_date)
-
-    # Search (Name or Email)
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter(or_(User.username.ilike(search_term), User.email.ilike(search_term)))
-
-    # Sorting
-    if sort_by == 'oldest':
-        query = query.order_by(User.created_at.asc())
-    elif sort_by == 'a-z':
-        query = query.order_by(User.username.asc())
-    elif sort_by == 'z-a':
-        query = query.order_by(User.username.desc())
-    else: # newest
-        query = query.order_by(User.created_at.desc())
-
-    # Pagination
-    page = request.args.get('page', 1, type=int)
-    per_page = 50
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    leads = pagination.items
-    start_index = (page -1) * per_page
+    # Row data (profile, programs, paid/debt) comes from one set-based loader for the whole page
+    leads = load_lead_rows([u.id for u in users])
     
     is_load_more = request.args.get('load_more')
+    if is_load_more:
+        # Rows only; KPIs and totals were computed with the first page
+        response = make_response(render_template('closer/partials/leads_rows.html', leads=leads, start_index=start_index))
+        response.headers['X-Next-Cursor'] = next_cursor or ''
+        return response
 
-    # --- KPI Calculations (Scoped to Filtered Users) ---
-    # We re-use logic but applied to the 'assigned' subset.
-    
-    # To act efficiently, we might fetch all IDs first or use subqueries.
-    # For now, let's execute separate count queries with same filters.
-    
-    kpi_query = User.query.filter(User.role.in_(['lead', 'student']))
-    kpi_query = kpi_query.filter(or_(User.enrollments.any(Enrollment.closer_id == current_user.id), User.appointments_as_lead.any(Appointment.closer_id == current_user.id)))
-
-    if start_date_str:
-        kpi_query = kpi_query.filter(User.created_at >= datetime.strptime(start_date_str, '%Y-%m-%d'))
-    if end_date_str:
-        kpi_query = kpi_query.filter(User.created_at < datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1))
-    if search:
-        search_term = f"%{search}%"
-        kpi_query = kpi_query.filter(or_(User.username.ilike(search_term), User.email.ilike(search_term)))
-        
-    total_users = kpi_query.count()
-    
-    # Financials (Cash Collect & Debt - My Portfolio)
-    # Cash Collect: Payments on enrollments assigned to ME.
-    # Note: If a user appears in list because of an appointment, but has NO enrollment with me, they contribute 0 to sales.
-    # If they have enrollment with me, we sum payments.
-    
-    fin_query = db.session.query(db.func.sum(Payment.amount)).select_from(User).join(Enrollment, Enrollment.student_id == User.id).join(Payment).filter(
-        Payment.status == 'completed',
-        Enrollment.closer_id == current_user.id # STRICTLY my sales
-    )
-    
-    # Apply User filters to fin_query
-    # We must ensure we filter the USERS similarly (date, search)
-    if start_date_str: fin_query = fin_query.filter(User.created_at >= datetime.strptime(start_date_str, '%Y-%m-%d'))
-    if end_date_str: fin_query = fin_query.filter(User.created_at < datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1))
-    if search: fin_query = fin_query.filter(or_(User.username.ilike(search_term), User.email.ilike(search_term)))
-    if status_filter: fin_query = fin_query.join(LeadProfile).filter(LeadProfile.status == status_filter)
-    if program_filter: fin_query = fin_query.filter(Enrollment.program_id == program_filter)
-    
-    total_revenue_gross = fin_query.scalar() or 0.0
-    
-    # Platform Commission (Expenses) - Needed to calc Net Cash Collect?
-    # User said: "Closer commission is 10% of Cash Collect".
-    # Usually "Cash Collect" for the company is (Gross - Stripe Fees). 
-    # Or is "Cash Collect" just Gross?
-    # In Admin Logic: cash_collected = total_revenue - total_commission (platform fees).
-    # Assuming Closer Commission is based on THAT Net Cash Collect.
-    
-    comm_query = db.session.query(
-        db.func.sum(
-            (Payment.amount * (PaymentMethod.commission_percent / 100.0)) + PaymentMethod.commission_fixed
-        )
-    ).select_from(User).join(Enrollment, Enrollment.student_id == User.id).join(Payment).join(PaymentMethod).filter(
-        Payment.status == 'completed',
-        Enrollment.closer_id == current_user.id
-    )
-    
-    if start_date_str: comm_query = comm_query.filter(User.created_at >= datetime.strptime(start_date_str, '%Y-%m-%d'))
-    if end_date_str: comm_query = comm_query.filter(User.created_at < datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1))
-    if search: comm_query = comm_query.filter(or_(User.username.ilike(search_term), User.email.ilike(search_term)))
-    if status_filter: comm_query = comm_query.join(LeadProfile).filter(LeadProfile.status == status_filter)
-    if program_filter: comm_query = comm_query.filter(Enrollment.program_id == program_filter)
-    
-    platform_fees = comm_query.scalar() or 0.0
-    
-    cash_collect_net = total_revenue_gross - platform_fees
-    
-    # Closer Commission (10% of Cash Collect Net)
-    # Or Gross? Usually commission is on Net. Let's use Net as calculated in Admin.
-    closer_commission = cash_collect_net * 0.10
-    
-    # Debt (My Enrollments)
-    # Using python iteration for simplicity on filtered set, or robust SQL?
-    # Let's use SQL hybrid like Admin
-    enr_query = db.session.query(Enrollment).join(User, Enrollment.student_id == User.id).filter(
-        Enrollment.status == 'active',
-        Enrollment.closer_id == current_user.id
-    )
-    if start_date_str: enr_query = enr_query.filter(User.created_at >= datetime.strptime(start_date_str, '%Y-%m-%d'))
-    if end_date_str: enr_query = enr_query.filter(User.created_at < datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1))
-    if search: enr_query = enr_query.filter(or_(User.username.ilike(search_term), User.email.ilike(search_term)))
-    if status_filter: enr_query = enr_query.join(LeadProfile).filter(LeadProfile.status == status_filter)
-    if program_filter: enr_query = enr_query.filter(Enrollment.program_id == program_filter)
-    
-    active_enrollments = enr_query.all()
-    total_debt = 0.0
-    
-    for enr in active_enrollments:
-        paid = enr.total_paid
-        agreed = enr.total_agreed if enr.total_agreed is not None else (enr.program.price if enr.program else 0.0)
-        debt = agreed - paid
-        if debt > 0:
-            total_debt += debt
-
-    kpis = {
-        'total': total_users,
-        'cash_collected': cash_collect_net,
-        'my_commission': closer_commission,
-        'debt': total_debt
-    }
+    # --- KPIs (one query over the filtered users) ---
+    # Cash collect, commission (10% of net) and debt only count enrollments sold by this closer
+    kpis = lead_kpis(spec, base, closer_id=current_user.id)
     
     # Filters context
     all_programs = Program.query.order_by(Program.name).all()
     all_statuses = db.session.query(LeadProfile.status).distinct().filter(LeadProfile.status != None).all()
     all_statuses = [s[0] for s in all_statuses]
     
-    if is_load_more:
-        # We need a partial template for rows. 
-        # Ideally we share 'admin/partials/leads_rows.html' but it has Admin actions.
-        # We should create 'closer/partials/leads_rows.html' or conditionalize.
-        # Creating new file.
-        return render_template('closer/partials/leads_rows.html', leads=leads, start_index=start_index)
-
     return render_template('closer/leads_list.html', 
                            leads=leads, 
-                           pagination=pagination,
+                           next_cursor=next_cursor,
                            kpis=kpis,
-                           search=search,
-                           start_date=start_date_str,
-                           end_date=end_date_str,
-                           program_filter=program_filter,
-                           status_filter=status_filter,
-                           sort_by=sort_by,
                            all_programs=all_programs,
                            all_statuses=all_statuses,
-                           start_index=start_index)
+                           start_index=start_index,
+                           **spec.template_context())
 
 @bp.route('/lead/<int:id>')
 @closer_required
@@ -286,6 +129,8 @@ from datetime import time
 from app.closer.forms import SaleForm, CloserPaymentForm, LeadForm, CloserStatsForm
 from app.models import CloserDailyStats, DailyReportQuestion, DailyReportAnswer
 from app.decorators import role_required
+from app.stats import refresh_daily_stats
+from app.slots import rebuild_closer_slots
 
 @bp.route('/daily_report', methods=['GET', 'POST'])
 @closer_required
@@ -300,57 +145,18 @@ def daily_report():
     now_local = datetime.now(user_tz)
     today_local = now_local.date()
     
-    # --- Automated KPI Calculation (Live for Today) ---
-    start_local = user_tz.localize(datetime.combine(today_local, time.min))
-    end_local = user_tz.localize(datetime.combine(today_local, time.max))
-    
-    start_utc = start_local.astimezone(pytz.UTC).replace(tzinfo=None)
-    end_utc = end_local.astimezone(pytz.UTC).replace(tzinfo=None)
-    
-    # 1. Calls
-    appointments_today = Appointment.query.filter(
-        Appointment.closer_id == current_user.id,
-        Appointment.start_time >= start_utc,
-        Appointment.start_time <= end_utc
-    ).all()
-    
-    kpi_scheduled = len(appointments_today)
-    kpi_completed = sum(1 for a in appointments_today if a.status == 'completed')
-    kpi_no_show = sum(1 for a in appointments_today if a.status == 'no_show')
-    kpi_canceled = sum(1 for a in appointments_today if a.status == 'canceled')
-    
-    # 2. Sales & Cash
-    # Filter payments made today on enrollments owned by this closer
-    # Need to be careful: Enrollment closer_id vs Payment Date
-    # We want "Cash Collected Today" by this closer. 
-    # Usually strictly payments received today, on enrollments assigned to this closer.
-    
-    payments_today = Payment.query.join(Enrollment).filter(
-        Enrollment.closer_id == current_user.id,
-        Payment.date >= start_utc,
-        Payment.date <= end_utc,
-        Payment.status == 'completed'
-    ).all()
-    
-    kpi_sales_count = 0
-    kpi_sales_amount = 0.0 # Total agreed value of sales made today (Enrollments created today)
-    kpi_cash_collected = 0.0 # Actual money received today
-    
-    # Sales Count = New Enrollments Today
-    new_enrollments = Enrollment.query.filter(
-        Enrollment.closer_id == current_user.id,
-        Enrollment.enrollment_date >= start_utc,
-        Enrollment.enrollment_date <= end_utc,
-        Enrollment.status != 'dropped'
-    ).all()
-    
-    kpi_sales_count = len(new_enrollments)
-    kpi_sales_amount = sum(e.total_agreed for e in new_enrollments)
+    # --- Automated KPIs (read from the daily rollup, see app/stats.py) ---
+    today_stats = CloserDailyStats.query.filter_by(closer_id=current_user.id, date=today_local).first()
     
-    # Cash Collected
-    kpi_cash_collected = sum(p.amount for p in payments_today)
+    kpi_scheduled = today_stats.calls_scheduled if today_stats else 0
+    kpi_completed = today_stats.calls_completed if today_stats else 0
+    kpi_no_show = today_stats.calls_no_show if today_stats else 0
+    kpi_canceled = today_stats.calls_canceled if today_stats else 0
+    kpi_sales_count = today_stats.sales_count if today_stats else 0
+    kpi_sales_amount = today_stats.sales_amount if today_stats else 0.0 # Total agreed value of sales made today
+    kpi_cash_collected = today_stats.cash_collected if today_stats else 0.0 # Actual money received today
     
-    # 3. Calculated Rates (Real-time for Today)
+    # Calculated Rates (Today)
     kpi_show_rate = (kpi_completed / kpi_scheduled * 100) if kpi_scheduled > 0 else 0
     kpi_closing_rate = (kpi_sales_count / kpi_completed * 100) if kpi_completed > 0 else 0
     kpi_avg_ticket = (kpi_sales_amount / kpi_sales_count) if kpi_sales_count > 0 else 0
@@ -358,22 +164,12 @@ def daily_report():
     # --- Questions ---
     questions = DailyReportQuestion.query.filter_by(is_active=True).order_by(DailyReportQuestion.order).all()
     
-    # Check if report exists for today
-    today_stats = CloserDailyStats.query.filter_by(closer_id=current_user.id, date=today_local).first()
-    
     if request.method == 'POST':
         if not today_stats:
-            today_stats = CloserDailyStats(closer_id=current_user.id, date=today_local)
-            db.session.add(today_stats)
-        
-        # Update/Save Automated KPIs (Snapshot)
-        today_stats.calls_scheduled = kpi_scheduled
-        today_stats.calls_completed = kpi_completed
-        today_stats.calls_no_show = kpi_no_show
-        today_stats.calls_canceled = kpi_canceled
-        today_stats.sales_count = kpi_sales_count
-        today_stats.sales_amount = kpi_sales_amount
-        today_stats.cash_collected = kpi_cash_collected
+            today_stats = refresh_daily_stats(current_user.id, today_local, user_tz)
+        
+        # Automated KPIs are maintained by the rollup, only the report itself is saved here
+        today_stats.report_submitted_at = datetime.utcnow()
         
         # Manual Metrics (Legacy) - kept generic if form has them? 
         # For now, user only asked to replace manual with automated and use questions for rest.
@@ -423,9 +219,8 @@ def daily_report():
                            today_stats=today_stats, 
                            today=today_local
                            )
-from app.closer.utils import send_calendar_webhook
-from app.closer.utils import send_sales_webhook
-import uuid
+from app.closer.utils import queue_sales_webhook
+from app.statuses import apply_lead_statuses
 
 # ... (Previous routes leads_list, lead_detail)
 
@@ -440,9 +235,8 @@ def add_lead():
             return render_template('closer/lead_form.html', form=form, title="Nuevo Lead")
             
         # Create User
-        temp_pass = str(uuid.uuid4())
         user = User(username=form.username.data, email=form.email.data, role='lead')
-        user.set_password(temp_pass)
+        user.set_unusable_password()
         db.session.add(user)
         db.session.flush()
         
@@ -551,14 +345,20 @@ def create_appointment():
             status='scheduled' # Created manually => confirmed
         )
         db.session.add(appt)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Unique index: this closer already has a live appointment at that time
+            db.session.rollback()
+            flash('Ya existe una cita en ese horario.')
+            return render_template('closer/appointment_form.html', form=form, title="Nueva Cita")
         
         # Auto-update status
-        if appt.lead:
-            appt.lead.update_status_based_on_debt()
+        if appt.lead_id:
+            apply_lead_statuses([appt.lead_id])
+            db.session.commit()
         
-        # Webhook
-        send_calendar_webhook(appt, 'created')
+        # Google Calendar sync is queued with the appointment (see app/calendar_sync.py)
         
         flash('Cita agendada exitosamente.')
         return redirect(url_for('closer.dashboard'))
@@ -593,9 +393,6 @@ def edit_appointment(id):
         local_dt = user_tz.localize(datetime.combine(form.date.data, form.time.data))
         start_utc = local_dt.astimezone(pytz.UTC).replace(tzinfo=None)
         
-        # Capture old time for webhook if rescheduling
-        old_start_time = appt.start_time if appt.start_time != start_utc else None
-        
         appt.lead_id = form.lead_id.data
         appt.start_time = start_utc
         # If it was canceled, maybe reset to scheduled? 
@@ -603,14 +400,17 @@ def edit_appointment(id):
         if appt.status == 'canceled':
             appt.status = 'scheduled'
             
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Ya existe una cita en ese horario.')
+            return render_template('closer/appointment_form.html', form=form, title="Editar Cita")
         
         # Auto-update status
-        if appt.lead:
-            appt.lead.update_status_based_on_debt()
-        
-        # Webhook
-        send_calendar_webhook(appt, 'rescheduled', old_start_time=old_start_time)
+        if appt.lead_id:
+            apply_lead_statuses([appt.lead_id])
+            db.session.commit()
         
         flash('Cita reagendada.')
         return redirect(url_for('closer.dashboard'))
@@ -633,11 +433,18 @@ def update_appt_status(id, status):
         return redirect(url_for('closer.dashboard'))
         
     appt.status = status
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Re-activating a canceled appointment whose slot was booked again
+        db.session.rollback()
+        flash('Ese horario ya fue ocupado por otra cita.')
+        return redirect(request.referrer or url_for('closer.agendas'))
     
     # Auto-update status based on new appointment state
-    if appt.lead:
-        appt.lead.update_status_based_on_debt()
+    if appt.lead_id:
+        apply_lead_statuses([appt.lead_id])
+        db.session.commit()
     
     msg_map = {
         'completed': 'Cita marcada como Realizada.',
@@ -645,9 +452,6 @@ def update_appt_status(id, status):
         'no_show': 'Cita marcada como No Show.'
     }
     
-    # Webhook
-    send_calendar_webhook(appt, 'canceled' if status == 'canceled' else 'status_changed')
-
     flash(msg_map.get(status, 'Estado actualizado.'))
     
     # If redirecting back to lead detail might be useful too? 
@@ -678,27 +482,14 @@ def dashboard():
     
     # Calculate Commission (Assuming 10% of Net Cash Collected)
     def calculate_commission(start_dt, end_dt):
-        # Gross Cash from my enrollments
-        gross_cash = db.session.query(db.func.sum(Payment.amount)).select_from(Enrollment).join(Payment).filter(
+        # Net Cash (amount - platform fee) from my enrollments, stored on each payment
+        net_cash = db.session.query(db.func.sum(Payment.cash_collect)).select_from(Enrollment).join(Payment).filter(
             Enrollment.closer_id == current_user.id,
             Payment.status == 'completed',
             Payment.date >= start_dt,
             Payment.date <= end_dt
         ).scalar() or 0.0
         
-        # Platform Fees for these payments
-        fees = db.session.query(
-            db.func.sum(
-                (Payment.amount * (PaymentMethod.commission_percent / 100.0)) + PaymentMethod.commission_fixed
-            )
-        ).select_from(Enrollment).join(Payment).join(PaymentMethod).filter(
-             Enrollment.closer_id == current_user.id,
-             Payment.status == 'completed',
-             Payment.date >= start_dt,
-             Payment.date <= end_dt
-        ).scalar() or 0.0
-        
-        net_cash = gross_cash - fees
         return net_cash * 0.10
 
     commission_month = calculate_commission(month_start_utc, end_utc)
@@ -739,7 +530,7 @@ def dashboard():
     
     # Report Status
     today_stats = CloserDailyStats.query.filter_by(closer_id=current_user.id, date=today_local).first()
-    report_done = 1 if today_stats else 0 # Simplified check. Ideally check if answers exist too.
+    report_done = 1 if today_stats and today_stats.report_submitted_at else 0
     
     total_steps = total_agendas_count + 1
     completed_steps = processed_agendas_count + report_done
@@ -763,14 +554,8 @@ def dashboard():
     
     # Col 2: Recent Clients (Assigned or interacted)
     # Broaden to include mapped via Appointment or Enrollment, and allow Students.
-    recent_clients = User.query.filter(
+    recent_clients = portfolio_leads(current_user.id).filter(
         User.role.in_(['lead', 'student'])
-    ).filter(
-        or_(
-            User.enrollments.any(Enrollment.closer_id == current_user.id),
-            User.appointments_as_lead.any(Appointment.closer_id == current_user.id),
-            User.lead_profile.has(assigned_closer_id=current_user.id)
-        )
     ).order_by(User.created_at.desc()).limit(15).all()
 
     # Col 3: Daily Report Questions
@@ -779,8 +564,8 @@ def dashboard():
     # Handle Report POST (if specific save button pressed)
     if request.method == 'POST' and 'save_report' in request.form:
         if not today_stats:
-            today_stats = CloserDailyStats(closer_id=current_user.id, date=today_local)
-            db.session.add(today_stats)
+            today_stats = refresh_daily_stats(current_user.id, today_local, user_tz)
+        today_stats.report_submitted_at = datetime.utcnow()
         
         # Save Answers
         # (Simplified logic from daily_report route)
@@ -877,29 +662,8 @@ def agendas():
     # Active Events for Links
     events = Event.query.filter_by(is_active=True).all()
 
-    # 5. Top 5 Debtors (Same logic as Admin)
-    # Ideally should be a shared service/util
-    active_enrollments = Enrollment.query.filter_by(status='active').all()
-    debtors = []
-    for enr in active_enrollments:
-        # Check if student is assigned to this closer?
-        # Or if enrollment is assigned to this closer?
-        # Let's filter by enrollment.closer_id == current just to be safe/consistent
-        if enr.closer_id == current_user.id:
-            paid = db.session.query(db.func.sum(Payment.amount)).filter(
-                Payment.enrollment_id == enr.id,
-                Payment.status == 'completed'
-            ).scalar() or 0
-            debt = enr.total_agreed - paid
-            if debt > 0:
-                debtors.append({
-                    'student': enr.student,
-                    'program': enr.program,
-                    'total_agreed': enr.total_agreed,
-                    'total_paid': paid,
-                    'debt': debt
-                })
-    top_debtors = sorted(debtors, key=lambda x: x['debt'], reverse=True)[:5]
+    # 5. Top 5 Debtors (shared ranking query, scoped to my sales)
+    top_debtors = debtors(closer_id=current_user.id, limit=5)
     
     # 6. Calculate Monthly Sales (Explicit Assignment)
     # Logic: Sum total_agreed of Enrollments created this month AND assigned to this closer.
@@ -1023,6 +787,9 @@ def update_availability():
                 end_time=end_t
             )
             db.session.add(new_slot)
+        
+        # Re-expand this week in the booking slot index
+        rebuild_closer_slots(current_user.id, week_start, week_end)
             
         db.session.commit()
     except Exception as e:
@@ -1038,18 +805,8 @@ def search_leads():
     if len(query) < 2:
         return {'results': []}
         
-    search = f"%{query}%"
-    # Join with LeadProfile to search phone/instagram
-    # Explicit join condition to avoid ambiguity or SQLAlchemy errors
-    leads = User.query.outerjoin(LeadProfile, User.id == LeadProfile.user_id).filter(
-        User.role == 'lead',
-        or_(
-            User.username.ilike(search),
-            User.email.ilike(search),
-            LeadProfile.phone.ilike(search),
-            LeadProfile.instagram.ilike(search)
-        )
-    ).limit(10).all()
+    # Indexed search (FTS5 / pg_trgm), best match first
+    leads = search_users(query, roles=('lead',), limit=10)
     
     results = []
     for lead in leads:
@@ -1132,6 +889,11 @@ def create_sale():
             payment_type=pay_type, 
             status='completed'
         )
+        if payment.is_duplicate():
+            db.session.rollback() # Drops an enrollment created above
+            flash('Error: Este pago ya fue registrado (mismo monto, tipo y día).')
+            return render_template('sales/new_sale.html', form=form, title="Nueva Venta")
+        payment.snapshot_fees()
         db.session.add(payment)
         
         # Update User Role (Lead -> Student)
@@ -1148,6 +910,9 @@ def create_sale():
         else:
             profile = user.lead_profile
 
+        # Balance including the payment just added (update_balance flushes)
+        enrollment.update_balance()
+
         # Renewal Validation
         if pay_type == 'renewal':
             if profile.status != 'completed':
@@ -1172,18 +937,7 @@ def create_sale():
             # We just added 'payment' to session, it might not be in query result of other payments commit?
             # It is in session.
             # Let's sum all payments for this enrollment.
-            current_total = 0
-            for p in enrollment.payments:
-                current_total += p.amount
-            
-            # Add current payment if not in enrollment.payments list yet (depends on relationship loading)
-            # Since we just created it: payment = Payment(...), db.session.add(payment).
-            # It might not be in enrollment.payments backref until flush/refresh.
-            # But we added it. Let's rely on manual sum + current amount if needed, 
-            # or just flush and query.
-            db.session.flush()
-            
-            total_paid = db.session.query(db.func.sum(Payment.amount)).filter_by(enrollment_id=enrollment.id).scalar() or 0
+            total_paid = enrollment.paid_total
             
             if total_paid >= program.price:
                 profile.status = 'completed'
@@ -1194,11 +948,10 @@ def create_sale():
                 if profile.status != 'completed' and profile.status != 'renewed':
                     profile.status = 'pending'
 
+        # Webhook (queued with the sale, delivered by the worker)
+        queue_sales_webhook(payment, current_user.username)
         db.session.commit()
         
-        # Webhook
-        send_sales_webhook(payment, current_user.username)
-        
         flash('Venta registrada exitosamente.')
         if next_url:
             return redirect(next_url)
@@ -1214,155 +967,55 @@ def create_sale():
 @bp.route('/sales')
 @closer_required
 def sales_list():
-    # Helper for stats
-    # Filter Params
-    search = request.args.get('search', '')
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
-    method_filter = request.args.get('method')
-    type_filter = request.args.get('type')
-    program_filter = request.args.get('program')
-    
-    # Base Query: Payments on enrollments assigned to this closer
-    query = Payment.query.join(
-        Enrollment, Payment.enrollment_id == Enrollment.id
-    ).join(
-        User, Enrollment.student_id == User.id
-    ).filter(Enrollment.closer_id == current_user.id)
-
-    # Date Filter
-    if start_date_str:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        query = query.filter(Payment.date >= start_date)
-    
-    if end_date_str:
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1)
-        query = query.filter(Payment.date < end_date)
-
-    # Search (Name or Email)
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter(or_(User.username.ilike(search_term), User.email.ilike(search_term)))
-        
-    if method_filter:
-        query = query.filter(Payment.payment_method_id == method_filter)
-        
-    if type_filter:
-        query = query.filter(Payment.payment_type == type_filter)
-        
-    if program_filter:
-        query = query.filter(Enrollment.program_id == program_filter)
-
-    # Ordering
-    query = query.order_by(Payment.date.desc())
-    
-    # Pagination
-    page = request.args.get('page', 1, type=int)
-    per_page = 50
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-    payments = pagination.items
-    start_index = (page - 1) * per_page
+    # Filters parsed once; the page and the KPIs read the same base CTE
+    spec = FilterSpec.from_args(request.args)
+    # Payments on enrollments sold by this closer, passing the filters
+    base = payment_ids_cte(spec, closer_id=current_user.id)
+
+    # Pagination: newest first, keyset on (date, id) with the cursor of the previous "load more"
+    payments, next_cursor, start_index = keyset_page(
+        sale_page_query(base), SALE_ORDER, per_page=50, cursor=request.args.get('cursor')
+    )
     
     is_load_more = request.args.get('load_more')
+    is_ajax = request.args.get('ajax')
+    if is_load_more:
+        # Rows only; KPIs were computed with the first page
+        html = render_template('closer/partials/sales_rows.html', payments=payments, start_index=start_index)
+        if is_ajax:
+            return jsonify({'html': html, 'has_next': bool(next_cursor), 'next_cursor': next_cursor})
+        return html
 
-    # --- KPI Stats (Filtered) ---
-    # Need to run aggregation on the filtered set
-    
-    # Clone query for aggregation
-    # We need Sum(Payment.amount)
-    stats_query = db.session.query(
-        db.func.sum(Payment.amount),
-        db.func.count(Payment.id),
-        db.func.sum(
-            (Payment.amount * (PaymentMethod.commission_percent / 100.0)) + PaymentMethod.commission_fixed
-        )
-    ).join(
-        Enrollment, Payment.enrollment_id == Enrollment.id
-    ).join(
-        User, Enrollment.student_id == User.id
-    ).outerjoin( # Outer join in case generic method, but usually inner is fine
-        PaymentMethod, Payment.payment_method_id == PaymentMethod.id
-    ).filter(Enrollment.closer_id == current_user.id)
-    
-    # Re-apply filters
-    if start_date_str: stats_query = stats_query.filter(Payment.date >= datetime.strptime(start_date_str, '%Y-%m-%d'))
-    if end_date_str: stats_query = stats_query.filter(Payment.date < datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1))
-    if search: stats_query = stats_query.filter(or_(User.username.ilike(search_term), User.email.ilike(search_term)))
-    if method_filter: stats_query = stats_query.filter(Payment.payment_method_id == method_filter)
-    if type_filter: stats_query = stats_query.filter(Payment.payment_type == type_filter)
-    if program_filter: stats_query = stats_query.filter(Enrollment.program_id == program_filter)
-    
-    total_gross, count, platform_fees = stats_query.first()
-    total_gross = total_gross or 0.0
-    platform_fees = platform_fees or 0.0
-    count = count or 0
-    
-    cash_collect_net = total_gross - platform_fees
-    my_commission = cash_collect_net * 0.10
-    
-    # Active Debt (Filtered by Same Params? Debt usually is current state, not historical like payments)
-    # But usually context is "Debt of clients in this view".
-    # Admin view shows "Deuda Total" (Global). 
-    # Closer view: "Deuda de Mis Clientes".
-    # Simply sum debt of all enrollments assigned to closer.
-    debt_query = db.session.query(Enrollment).filter(Enrollment.closer_id == current_user.id, Enrollment.status == 'active')
-    # Filter by user/program? Yes to match context.
-    # If search is applied, debt of searched users.
-    if search: debt_query = debt_query.join(User).filter(or_(User.username.ilike(search_term), User.email.ilike(search_term)))
-    if program_filter: debt_query = debt_query.filter(Enrollment.program_id == program_filter)
-    
-    # Sum debt python-side or complex SQL
-    total_debt = 0.0
-    for enr in debt_query.all():
-         paid = enr.total_paid
-         agreed = enr.total_agreed if enr.total_agreed is not None else (enr.program.price if enr.program else 0.0)
-         d = agreed - paid
-         if d > 0: total_debt += d
-
-    kpis = {
-        'revenue': total_gross,
-        'cash_collected': cash_collect_net,
-        'my_commission': my_commission,
-        'count': count,
-        'debt': total_debt
-    }
+    # --- KPI Stats (one query over the filtered payments) ---
+    # Debt is current state ("debt of my clients" matching search/program), not limited to the dates
+    kpis = sale_kpis(spec, base, closer_id=current_user.id)
     
     # Dropdowns
     methods = PaymentMethod.query.filter_by(is_active=True).all()
     programs = Program.query.all()
     
-    is_ajax = request.args.get('ajax')
-    
-    if is_load_more and not is_ajax:
-        return render_template('closer/partials/sales_rows.html', payments=payments, start_index=start_index)
-
     if is_ajax:
          return jsonify({
             'html': render_template('closer/partials/sales_rows.html', payments=payments, start_index=start_index),
             'kpis': {
-                'sales_count': count,
-                'revenue': "{:,.2f}".format(total_gross),
-                'cash_collected': "{:,.2f}".format(cash_collect_net),
-                'my_commission': "{:,.2f}".format(my_commission),
-                'debt': "{:,.2f}".format(total_debt)
+                'sales_count': kpis['count'],
+                'revenue': "{:,.2f}".format(kpis['revenue']),
+                'cash_collected': "{:,.2f}".format(kpis['cash_collected']),
+                'my_commission': "{:,.2f}".format(kpis['my_commission']),
+                'debt': "{:,.2f}".format(kpis['debt'])
             },
-            'has_next': pagination.has_next,
-            'next_page': pagination.next_num
+            'has_next': bool(next_cursor),
+            'next_cursor': next_cursor
          })
 
     return render_template('closer/sales_list.html', 
                            payments=payments, 
-                           pagination=pagination,
+                           next_cursor=next_cursor,
                            kpis=kpis,
-                           start_date=start_date_str, 
-                           end_date=end_date_str,
-                           search=search,
-                           method_filter=method_filter and int(method_filter),
-                           type_filter=type_filter,
-                           program_filter=program_filter,
                            methods=methods,
                            programs=programs,
-                           start_index=start_index)
+                           start_index=start_index,
+                           **spec.template_context())
 
 @bp.route('/sale/edit/<int:id>', methods=['GET', 'POST'])
 @closer_required
@@ -1391,6 +1044,11 @@ def edit_sale(id):
         payment.amount = form.amount.data
         payment.payment_type = form.payment_type.data
         payment.payment_method_id = form.payment_method_id.data
+        if payment.is_duplicate():
+            db.session.rollback()
+            flash('Error: Este pago ya fue registrado (mismo monto, tipo y día).')
+            return render_template('sales/new_sale.html', form=form, title="Editar Venta")
+        payment.snapshot_fees()
         
         # Check validation again? (Full Payment >= Price)
         # Getting program from enrollment, not form (assuming program didn't change in form, or we blocked it)
@@ -1399,7 +1057,14 @@ def edit_sale(id):
              flash(f'Error: El pago completo debe ser al menos ${program_price}.')
              return render_template('sales/new_sale.html', form=form, title="Editar Venta")
 
-        db.session.commit()
+        payment.enrollment.update_balance()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Unique fingerprint index: an identical payment was recorded concurrently
+            db.session.rollback()
+            flash('Error: Este pago ya fue registrado (mismo monto, tipo y día).')
+            return render_template('sales/new_sale.html', form=form, title="Editar Venta")
         flash('Venta actualizada.')
         return redirect(url_for('closer.sales_list'))
         
@@ -1420,13 +1085,14 @@ def delete_sale(id):
     remaining_payments = enrollment.payments.count()
     if remaining_payments == 0:
         db.session.delete(enrollment)
+    else:
+        enrollment.update_balance()
         
     db.session.commit()
     
     # Auto-update status
-    user = User.query.get(student_id)
-    if user:
-        user.update_status_based_on_debt()
+    apply_lead_statuses([student_id])
+    db.session.commit()
         
     flash('Venta eliminada.')
     return redirect(url_for('closer.sales_list'))
@@ -1472,6 +1138,7 @@ def new_sale(id):
             payment_method_id=form.payment_method_id.data,
             status='completed'
         )
+        payment.snapshot_fees()
         db.session.add(payment)
         
         # 3. Update Role
@@ -1500,11 +1167,11 @@ def new_sale(id):
         elif pay_type == 'renewal':
              profile.status = 'renewed'
             
+        enrollment.update_balance()
+        # Webhook (queued with the sale, delivered by the worker)
+        queue_sales_webhook(payment, current_user.username)
         db.session.commit()
         
-        # Webhook
-        send_sales_webhook(payment, current_user.username)
-        
         flash('Venta registrada exitosamente.')
         return redirect(url_for('closer.lead_detail', id=lead.id))
         
@@ -1531,16 +1198,19 @@ def add_payment(id):
             reference_id=form.reference_id.data,
             status=form.status.data
         )
+        if payment.is_duplicate():
+            flash('Error: Este pago ya fue registrado (mismo monto, tipo y día).')
+            return render_template('closer/payment_form.html', form=form, title="Registrar Pago", lead_id=enrollment.student_id)
+        payment.snapshot_fees()
         db.session.add(payment)
+        enrollment.update_balance()
+        # Webhook (queued with the payment, delivered by the worker)
+        queue_sales_webhook(payment, current_user.username)
         db.session.commit()
         
         # Auto-update status
-        user = User.query.get(enrollment.student_id)
-        if user:
-            user.update_status_based_on_debt()
-        
-        # Webhook
-        send_sales_webhook(payment, current_user.username)
+        apply_lead_statuses([enrollment.student_id])
+        db.session.commit()
         
         flash('Pago agregado.')
         return redirect(url_for('closer.lead_detail', id=enrollment.student_id))
@@ -1563,13 +1233,18 @@ def edit_payment(id):
         payment.payment_method_id = form.payment_method_id.data
         payment.reference_id = form.reference_id.data
         payment.status = form.status.data
+        if payment.is_duplicate():
+            db.session.rollback()
+            flash('Error: Este pago ya fue registrado (mismo monto, tipo y día).')
+            return render_template('closer/payment_form.html', form=form, title="Editar Pago")
+        payment.snapshot_fees()
         
+        payment.enrollment.update_balance()
         db.session.commit()
         
         # Auto-update status
-        user = User.query.get(payment.enrollment.student_id)
-        if user:
-            user.update_status_based_on_debt()
+        apply_lead_statuses([payment.enrollment.student_id])
+        db.session.commit()
             
         flash('Pago actualizado.')
         return redirect(url_for('closer.lead_detail', id=payment.enrollment.student_id))
@@ -1589,13 +1264,14 @@ def delete_payment_detail(id):
     # Check orphan enrollment
     if enrollment.payments.count() == 0:
         db.session.delete(enrollment)
+    else:
+        enrollment.update_balance()
         
     db.session.commit()
     
     # Auto-update status
-    user = User.query.get(student_id)
-    if user:
-        user.update_status_based_on_debt()
+    apply_lead_statuses([student_id])
+    db.session.commit()
         
     flash('Pago eliminado.')
     return redirect(url_for('closer.lead_detail', id=student_id))
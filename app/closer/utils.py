@@ -1,175 +1,137 @@
+from googleapiclient.errors import HttpError
 from app.google_auth.utils import get_calendar_service
 from app import db
+from app.models import GoogleCalendarToken
 from datetime import timedelta
+import json
 
-def send_calendar_webhook(appointment, action, old_start_time=None):
+def sync_calendar_event(appointment, closer_id, google_event_id=None):
     """
-    Syncs appointment with Google Calendar (Closer's Account).
-    Replaces old n8n webhook.
+    Pushes one appointment to the closer's Google Calendar (replaces the old
+    n8n webhook). Called by the calendar outbox worker, not inside requests.
     
     Args:
-        appointment: Appointment model instance
-        action: 'created', 'rescheduled', 'canceled', 'status_changed'
-        old_start_time: Not used for direct API update usually, but kept for signature compatibility
-    """
-    service = get_calendar_service(appointment.closer_id)
-    print(f"DEBUG: Starting GCal Sync for Appt {appointment.id} (Closer {appointment.closer_id})", flush=True)
+        appointment: Appointment to mirror, or None when only an event must be
+            removed (appointment deleted or moved to another closer)
+        closer_id: Whose calendar to write to
+        google_event_id: Event to delete when appointment is None
     
+    Raises on Google API errors so the worker can retry. Does not commit.
+    Returns False when the closer has no Google token (nothing to sync).
+    """
+    service = get_calendar_service(closer_id)
     if not service:
-        print(f"Skipping Calendar Sync: No Google Token for Closer {appointment.closer_id}", flush=True)
-        return
+        print(f"Skipping Calendar Sync: No Google Token for Closer {closer_id}", flush=True)
+        return False
+
+    # Get preferred calendar or default to primary
+    token = GoogleCalendarToken.query.filter_by(user_id=closer_id).first()
+    target_calendar_id = token.google_calendar_id if token and token.google_calendar_id else 'primary'
+
+    if appointment is None or appointment.status == 'canceled':
+        event_id = appointment.google_event_id if appointment else google_event_id
+        if event_id:
+            try:
+                service.events().delete(calendarId=target_calendar_id, eventId=event_id).execute()
+            except HttpError as e:
+                if e.resp.status not in (404, 410): # Already gone is fine
+                    raise
+            print(f"GCal Event deleted ({event_id})", flush=True)
+        if appointment:
+            appointment.google_event_id = None
+        return True
 
     # Helper to format time as UTC ISO for Google
     def to_iso(dt):
         return dt.isoformat() + 'Z'
 
-    try:
-        # Determine duration (Default 45 mins per previous guide, or use Event settings if available)
-        duration_minutes = 45 
-        # If we had appointment.end_time we would use it.
-        
-        start_dt = appointment.start_time
-        end_dt = start_dt + timedelta(minutes=duration_minutes)
-        
-        lead = appointment.lead
-        closer = appointment.closer
-        profile = lead.lead_profile
-        
-        summary = f"Cita: {lead.username} con {closer.username}"
-        description = (
-            f"Cliente: {lead.username}\n"
-            f"Email: {lead.email}\n"
-            f"Tel: {profile.phone if profile else 'N/A'}\n"
-            f"Rol: {lead.role}\n"
-            f"Estado: {appointment.status}"
-        )
-        
-        print(f"DEBUG: Adding attendee {lead.email} to event", flush=True)
+    # Determine duration (Default 45 mins per previous guide, or use Event settings if available)
+    duration_minutes = 45 
+    # If we had appointment.end_time we would use it.
+    
+    start_dt = appointment.start_time
+    end_dt = start_dt + timedelta(minutes=duration_minutes)
+    
+    lead = appointment.lead
+    closer = appointment.closer
+    profile = lead.lead_profile
+    
+    summary = f"Cita: {lead.username} con {closer.username}"
+    description = (
+        f"Cliente: {lead.username}\n"
+        f"Email: {lead.email}\n"
+        f"Tel: {profile.phone if profile else 'N/A'}\n"
+        f"Rol: {lead.role}\n"
+        f"Estado: {appointment.status}"
+    )
 
-        event_body = {
-            'summary': summary,
-            'description': description,
-            'start': {
-                'dateTime': to_iso(start_dt),
-                'timeZone': 'UTC', 
-            },
-            'end': {
-                'dateTime': to_iso(end_dt),
-                'timeZone': 'UTC',
-            },
-            'attendees': [
-                {'email': lead.email, 'responseStatus': 'needsAction'},
-                # Closer is organizer, implied attendee usually, or add explicit:
-                # {'email': closer.email, 'responseStatus': 'accepted'} 
+    event_body = {
+        'summary': summary,
+        'description': description,
+        'start': {
+            'dateTime': to_iso(start_dt),
+            'timeZone': 'UTC', 
+        },
+        'end': {
+            'dateTime': to_iso(end_dt),
+            'timeZone': 'UTC',
+        },
+        'attendees': [
+            {'email': lead.email, 'responseStatus': 'needsAction'},
+            # Closer is organizer, implied attendee usually, or add explicit:
+            # {'email': closer.email, 'responseStatus': 'accepted'} 
+        ],
+        'reminders': {
+            'useDefault': False,
+            'overrides': [
+                {'method': 'email', 'minutes': 24 * 60},
+                {'method': 'popup', 'minutes': 30},
             ],
-            'reminders': {
-                'useDefault': False,
-                'overrides': [
-                    {'method': 'email', 'minutes': 24 * 60},
-                    {'method': 'popup', 'minutes': 30},
-                ],
-            },
-        }
-
-        # Handling Actions
-        # Get preferred calendar or default to primary
-        target_calendar_id = 'primary'
-        if appointment.closer.google_token and appointment.closer.google_token.google_calendar_id:
-            target_calendar_id = appointment.closer.google_token.google_calendar_id
-
-        if action == 'canceled' or appointment.status == 'canceled':
-            if appointment.google_event_id:
-                try:
-                    service.events().delete(calendarId=target_calendar_id, eventId=appointment.google_event_id).execute()
-                    appointment.google_event_id = None
-                    db.session.commit()
-                    print(f"GCal Event deleted for Appt {appointment.id}", flush=True)
-                except Exception as e:
-                    print(f"Error deleting GCal event: {e}", flush=True)
-            return
+        },
+    }
 
-        # Create or Update
-        if appointment.google_event_id:
-            try:
-                # Try update
-                service.events().patch(
-                    calendarId=target_calendar_id, 
-                    eventId=appointment.google_event_id, 
-                    body=event_body,
-                    sendUpdates='all'
-                ).execute()
-                print(f"GCal Event updated for Appt {appointment.id}", flush=True)
-            except Exception as e:
-                # If 404/Gone, recreate?
-                print(f"Error updating GCal event (might be deleted), trying recreate: {e}", flush=True)
-                # Fallback to create
-                new_event = service.events().insert(
-                    calendarId=target_calendar_id, 
-                    body=event_body,
-                    sendUpdates='all'
-                ).execute()
-                appointment.google_event_id = new_event.get('id')
-                db.session.commit()
-        else:
-            # Create
-            new_event = service.events().insert(
+    # Create or Update
+    if appointment.google_event_id:
+        try:
+            service.events().patch(
                 calendarId=target_calendar_id, 
+                eventId=appointment.google_event_id, 
                 body=event_body,
                 sendUpdates='all'
             ).execute()
-            appointment.google_event_id = new_event.get('id')
-            db.session.commit()
-            print(f"GCal Event created for Appt {appointment.id}", flush=True)
+            print(f"GCal Event updated for Appt {appointment.id}", flush=True)
+            return True
+        except HttpError as e:
+            if e.resp.status not in (404, 410):
+                raise
+            # Deleted on Google's side, recreate below
+            print(f"GCal event for Appt {appointment.id} is gone, recreating", flush=True)
 
-    except Exception as e:
-        print(f"Critical GCal Sync Error for Appt {appointment.id}: {e}")
+    new_event = service.events().insert(
+        calendarId=target_calendar_id, 
+        body=event_body,
+        sendUpdates='all'
+    ).execute()
+    appointment.google_event_id = new_event.get('id')
+    print(f"GCal Event created for Appt {appointment.id}", flush=True)
+    return True
 
-def send_sales_webhook(payment, closer_name):
+def build_sales_payload(payment, closer_name):
     """
-    Sends sales data to an external webhook (e.g. n8n).
+    Sales data for the external webhook (e.g. n8n).
     
     Data: Client, Closer, Amount, Cash Collect (Net), Payment Type, Program, Method
     """
-    # Fetch dynamic integration
-    from app.models import Integration
-    
-    integration = Integration.query.filter_by(key='sales').first()
-    webhook_url = None
-    
-    if integration:
-        if integration.active_env == 'prod':
-            webhook_url = integration.url_prod
-        else:
-            webhook_url = integration.url_dev
-            
-    # Fallback to Config if DB entry not found or empty (though we create it on admin view)
-    if not webhook_url:
-        webhook_url = current_app.config.get('VENTAS_WEBHOOK')
-
-    if not webhook_url:
-        print("Sales Webhook URL not configured (DB or Config).", flush=True)
-        return
-    
-    print(f"Sales Webhook initiated for {payment.payment_type_label}", flush=True)
-
-    # Calculate Cash Collect (Amount - Commission)
-    # Commission = (Amount * % + Fixed)
-    if payment.method:
-        # Handle potential None from DB
-        pct = payment.method.commission_percent or 0.0
-        fixed = payment.method.commission_fixed or 0.0
-        commission = (payment.amount * (pct / 100)) + fixed
-    else:
-        commission = 0.0
-        
-    cash_collect = payment.amount - commission
+    # Cash Collect (Amount - Commission) as snapshotted on the payment at write time
+    commission = payment.platform_fee or 0.0
+    cash_collect = payment.cash_collect if payment.cash_collect is not None else payment.amount - commission
 
     # Get phone safely
     student = payment.enrollment.student
     phone = student.lead_profile.phone if student.lead_profile else ''
     first_name = student.username.split(' ')[0] if student.username else ''
 
-    payload = {
+    return {
         'cliente': student.username,
         'first_name': first_name,
         'telefono': phone,
@@ -185,14 +147,30 @@ def send_sales_webhook(payment, closer_name):
         'comision': round(commission, 2),
         'valor_programa': payment.enrollment.total_agreed
     }
-    
-    # Debug log
-    # Debug log
-    print(f"Sending Webhook Payload: {payload}", flush=True)
 
-    try:
-        response = requests.post(webhook_url, json=payload, timeout=5)
-        response.raise_for_status()
-        print(f"Sales Webhook sent successfully for Payment {payment.id}", flush=True)
-    except Exception as e:
-        print(f"Failed to send sales webhook for Payment {payment.id}: {e}", flush=True)
+def queue_sales_webhook(payment, closer_name):
+    """
+    Queues the sales webhook for this payment in the current transaction
+    (commit it together with the sale). Delivery happens in
+    `flask sales-webhook-worker`, so saving a sale never waits on the webhook.
+    Queuing the same payment twice is a no-op (idempotency key per payment).
+    """
+    from app.models import SalesWebhookEvent
+
+    db.session.flush() # Payment id / defaults (date) are needed for the payload
+    key = f"payment-{payment.id}"
+    if SalesWebhookEvent.query.filter_by(idempotency_key=key).first():
+        return
+
+    payload = build_sales_payload(payment, closer_name)
+    payload['idempotency_key'] = key
+    db.session.add(SalesWebhookEvent(
+        payment_id=payment.id,
+        idempotency_key=key,
+        payload=json.dumps(payload)
+    ))
+
+def send_sales_webhook(payment, closer_name):
+    """Queues and commits, for callers that already committed the sale."""
+    queue_sales_webhook(payment, closer_name)
+    db.session.commit()
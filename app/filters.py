@@ -0,0 +1,204 @@
+"""
+Declarative filters for the lead and sales list pages and their KPI blocks.
+
+A FilterSpec is parsed once from the request args (or a saved
+UserViewSetting, same keys) and compiled into one base CTE with the ids of
+the rows that pass it. The row page is read by joining the CTE, and every KPI
+of the page comes from one more SELECT over the same CTE, instead of
+re-applying the filters to a separate query per KPI. Pass closer_id to scope
+to a closer (their portfolio / their sales), or None for the whole company
+(admin).
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, true
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import User, LeadProfile, Enrollment, Payment, CloserLead
+from app.queries import outstanding_debt_query
+from app.search import search_filter
+
+COMMISSION_RATE = 0.10 # Closer commission on net cash collect
+
+# Users without created_at (legacy rows) sort as the oldest; keyset keys can't be NULL
+CREATED_AT = db.func.coalesce(User.created_at, datetime(1970, 1, 1))
+
+# Keyset order of each leads sort (see queries.keyset_page)
+LEAD_SORTS = {
+    'newest': [(CREATED_AT, True), (User.id, True)],
+    'oldest': [(CREATED_AT, False), (User.id, False)],
+    'a-z': [(User.username, False), (User.id, False)],
+    'z-a': [(User.username, True), (User.id, True)],
+}
+SALE_ORDER = [(Payment.date, True), (Payment.id, True)]
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+def _int(value):
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+class FilterSpec:
+    """The filters of a list page. Unset filters are None."""
+    def __init__(self, search=None, start_date=None, end_date=None, program_id=None, status=None,
+                 method_id=None, payment_type=None, sort_by='newest'):
+        self.search = search
+        self.start_date = start_date # Inclusive
+        self.end_date = end_date # Inclusive day
+        self.program_id = program_id
+        self.status = status
+        self.method_id = method_id
+        self.payment_type = payment_type
+        self.sort_by = sort_by if sort_by in LEAD_SORTS else 'newest'
+
+    @classmethod
+    def from_args(cls, args):
+        """From request.args or UserViewSetting.settings; bad values are ignored."""
+        return cls(
+            search=(args.get('search') or '').strip() or None,
+            start_date=_date(args.get('start_date')),
+            end_date=_date(args.get('end_date')),
+            program_id=_int(args.get('program')),
+            status=args.get('status') or None,
+            method_id=_int(args.get('method')),
+            payment_type=args.get('type') or None,
+            sort_by=args.get('sort_by') or 'newest'
+        )
+
+    @property
+    def end_before(self):
+        """Exclusive upper bound of the date range."""
+        return self.end_date + timedelta(days=1) if self.end_date else None
+
+    def template_context(self):
+        """Values the filter forms render back."""
+        return {
+            'search': self.search or '',
+            'start_date': self.start_date.strftime('%Y-%m-%d') if self.start_date else None,
+            'end_date': self.end_date.strftime('%Y-%m-%d') if self.end_date else None,
+            'program_filter': str(self.program_id) if self.program_id else None,
+            'status_filter': self.status,
+            'method_filter': self.method_id,
+            'type_filter': self.payment_type,
+            'sort_by': self.sort_by
+        }
+
+# --- Leads ---
+
+def lead_ids_cte(spec, closer_id=None):
+    """CTE (user_id) of the leads and students passing spec."""
+    query = select(User.id.label('user_id')).where(User.role.in_(['lead', 'student']))
+    if closer_id:
+        query = query.join(CloserLead, CloserLead.lead_id == User.id).where(CloserLead.closer_id == closer_id)
+    if spec.status:
+        query = query.join(LeadProfile, LeadProfile.user_id == User.id).where(LeadProfile.status == spec.status)
+    if spec.program_id:
+        query = query.where(User.id.in_(select(Enrollment.student_id).where(Enrollment.program_id == spec.program_id)))
+    if spec.start_date:
+        query = query.where(User.created_at >= spec.start_date)
+    if spec.end_date:
+        query = query.where(User.created_at < spec.end_before)
+    if spec.search:
+        query = query.where(search_filter(spec.search))
+    return query.cte('filtered_leads')
+
+def lead_page_query(base):
+    """Users in the base CTE (for queries.keyset_page with LEAD_SORTS[spec.sort_by])."""
+    return User.query.join(base, base.c.user_id == User.id)
+
+def lead_kpis(spec, base, closer_id=None):
+    """
+    KPIs of the leads list in one SELECT over the base CTE: total, cash
+    collected (net of platform fees), commission and outstanding debt. Money
+    only counts enrollments sold by closer_id (and in the program filter).
+    """
+    enrollment_filters = [Enrollment.student_id.in_(select(base.c.user_id))]
+    if closer_id:
+        enrollment_filters.append(Enrollment.closer_id == closer_id)
+    if spec.program_id:
+        enrollment_filters.append(Enrollment.program_id == spec.program_id)
+
+    total = select(db.func.count().label('total')).select_from(base).subquery()
+    # Gross and platform fees come from the fee snapshot stored on each payment
+    cash = select(
+        db.func.coalesce(db.func.sum(Payment.amount), 0.0).label('gross'),
+        db.func.coalesce(db.func.sum(Payment.platform_fee), 0.0).label('fees')
+    ).join(Enrollment, Payment.enrollment_id == Enrollment.id).where(
+        Payment.status == 'completed', *enrollment_filters
+    ).subquery()
+    debt = outstanding_debt_query(closer_id=closer_id, program_id=spec.program_id, user_ids=select(base.c.user_id)).subquery()
+
+    row = db.session.execute(
+        select(total.c.total, cash.c.gross, cash.c.fees, debt.c.debt)
+        .select_from(total.join(cash, true()).join(debt, true()))
+    ).one()
+    cash_collected = row.gross - row.fees
+    return {
+        'total': row.total,
+        'cash_collected': cash_collected,
+        'my_commission': cash_collected * COMMISSION_RATE,
+        'debt': row.debt
+    }
+
+# --- Sales ---
+
+def payment_ids_cte(spec, closer_id=None):
+    """CTE (payment_id) of the payments passing spec (dates are payment dates)."""
+    query = select(Payment.id.label('payment_id')).join(
+        Enrollment, Payment.enrollment_id == Enrollment.id
+    )
+    if closer_id:
+        query = query.where(Enrollment.closer_id == closer_id)
+    if spec.start_date:
+        query = query.where(Payment.date >= spec.start_date)
+    if spec.end_date:
+        query = query.where(Payment.date < spec.end_before)
+    if spec.search:
+        query = query.where(Enrollment.student_id.in_(select(User.id).where(search_filter(spec.search))))
+    if spec.method_id:
+        query = query.where(Payment.payment_method_id == spec.method_id)
+    if spec.payment_type:
+        query = query.where(Payment.payment_type == spec.payment_type)
+    if spec.program_id:
+        query = query.where(Enrollment.program_id == spec.program_id)
+    return query.cte('filtered_payments')
+
+def sale_page_query(base):
+    """Payments in the base CTE (for queries.keyset_page with SALE_ORDER), with what the rows render."""
+    enrollment = joinedload(Payment.enrollment)
+    return Payment.query.join(base, base.c.payment_id == Payment.id).options(
+        enrollment.joinedload(Enrollment.student).joinedload(User.lead_profile),
+        enrollment.joinedload(Enrollment.program),
+        joinedload(Payment.method)
+    )
+
+def sale_kpis(spec, base, closer_id=None):
+    """
+    KPIs of the sales list in one SELECT: count, revenue, cash collected and
+    commission of the filtered payments, plus the outstanding debt of the
+    clients matching the search/program (current state, so no date range).
+    """
+    totals = select(
+        db.func.count(Payment.id).label('count'),
+        db.func.coalesce(db.func.sum(Payment.amount), 0.0).label('gross'),
+        db.func.coalesce(db.func.sum(Payment.platform_fee), 0.0).label('fees')
+    ).join(base, base.c.payment_id == Payment.id).subquery()
+    debt = outstanding_debt_query(closer_id=closer_id, search=spec.search, program_id=spec.program_id).subquery()
+
+    row = db.session.execute(
+        select(totals.c.count, totals.c.gross, totals.c.fees, debt.c.debt)
+        .select_from(totals.join(debt, true()))
+    ).one()
+    cash_collected = row.gross - row.fees
+    return {
+        'revenue': row.gross,
+        'cash_collected': cash_collected,
+        'my_commission': cash_collected * COMMISSION_RATE,
+        'count': row.count,
+        'debt': row.debt
+    }
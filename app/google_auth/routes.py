@@ -7,6 +7,7 @@ from app import db
 from app.models import GoogleCalendarToken
 
 from app.google_auth import bp
+from app.google_auth.utils import evict_calendar_service
 
 # Scopes required
 # Scopes required
@@ -119,13 +120,15 @@ def callback():
         'token_uri': credentials.token_uri,
         'client_id': credentials.client_id,
         'client_secret': credentials.client_secret,
-        'scopes': credentials.scopes
+        'scopes': credentials.scopes,
+        'expiry': credentials.expiry.isoformat() if credentials.expiry else None
     }
     # Note: refresh_token might be None if user already authorized and prompt!='consent', 
     # but we forced prompt='consent'.
     
     token_entry.token_json = json.dumps(creds_data)
     db.session.commit()
+    evict_calendar_service(current_user.id) # Drop this process' client built from the old token
     
     flash('Google Calendar conectado exitosamente.')
     return redirect(url_for('closer.dashboard')) 
@@ -139,6 +142,7 @@ def select_calendar():
     if not service:
         flash('Primero debes conectar tu cuenta de Google.', 'warning')
         return redirect(url_for('google_auth.authorize'))
+    db.session.commit() # Persist a refreshed token
     
     token = current_user.google_token
 
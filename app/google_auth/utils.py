@@ -1,60 +1,144 @@
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from flask import current_app
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
 import json
 from app import db
 from app.models import GoogleCalendarToken
 
-def get_calendar_service(user_id):
+# Refresh a bit before Google says the token expires, so calls never hit a 401
+REFRESH_MARGIN = timedelta(minutes=5)
+
+# Per-process client cache: user_id -> {'service', 'credentials', 'creds_data', 'version'}
+# (LRU order). version is the token row's updated_at: a client built from an older row
+# (reconnected or refreshed by another process) is rebuilt on the next call.
+# Clients are not shared between threads concurrently (httplib2), which matches our
+# sync gunicorn workers and the single-threaded calendar worker.
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+_calendar_discovery = None
+
+def get_calendar_discovery():
+    """Calendar v3 discovery document shipped with googleapiclient, parsed once."""
+    global _calendar_discovery
+    if _calendar_discovery is None:
+        _calendar_discovery = json.loads(get_static_doc('calendar', 'v3'))
+    return _calendar_discovery
+
+def credentials_to_data(credentials, base=None):
+    """Serializable token dict (same shape stored in GoogleCalendarToken.token_json)."""
+    data = dict(base or {})
+    data.update({
+        'token': credentials.token,
+        'refresh_token': credentials.refresh_token or data.get('refresh_token'),
+        'token_uri': credentials.token_uri,
+        'client_id': credentials.client_id,
+        'client_secret': credentials.client_secret,
+        'scopes': credentials.scopes or data.get('scopes'),
+        'expiry': credentials.expiry.isoformat() if credentials.expiry else None
+    })
+    return data
+
+def evict_calendar_service(user_id):
     """
-    Retrieves an authenticated Google Calendar Service for the given user.
-    Refreshes the token if expired.
-    Returns None if no token or error.
+    Drops this process' cached client (token revoked or failing). Other
+    processes notice a new token by its version (see get_calendar_service).
     """
+    with _clients_lock:
+        _clients.pop(user_id, None)
+
+def _load_client(user_id):
     token_entry = GoogleCalendarToken.query.filter_by(user_id=user_id).first()
     if not token_entry:
         return None
-        
-    try:
-        creds_data = json.loads(token_entry.token_json)
-        
-        credentials = Credentials(
-            token=creds_data.get('token'),
-            refresh_token=creds_data.get('refresh_token'),
-            token_uri=creds_data.get('token_uri'),
-            client_id=creds_data.get('client_id'),
-            client_secret=creds_data.get('client_secret'),
-            scopes=creds_data.get('scopes')
-        )
-        
-        # Check expiry and refresh
-        # Credentials object handles expiry check internally if we use Request?
-        # Actually .valid or .expired properties.
-        # But to refresh we need a Request object.
-        from google.auth.transport.requests import Request
-        
-        if not credentials.valid:
-             if credentials.expired and credentials.refresh_token:
-                 try:
-                     credentials.refresh(Request())
-                     # Update DB with new token
-                     creds_data['token'] = credentials.token
-                     # refresh_token usually stays same, but if changed update it
-                     if credentials.refresh_token:
-                         creds_data['refresh_token'] = credentials.refresh_token
-                         
-                     token_entry.token_json = json.dumps(creds_data)
-                     db.session.commit()
-                 except Exception as e:
-                     print(f"Error refreshing token for user {user_id}: {e}")
-                     return None
-             else:
-                 # Invalid and no refresh?
-                 return None
-                 
-        service = build('calendar', 'v3', credentials=credentials)
-        return service
-        
-    except Exception as e:
-        print(f"Error building calendar service for user {user_id}: {e}")
+
+    creds_data = json.loads(token_entry.token_json)
+    expiry = creds_data.get('expiry')
+    credentials = Credentials(
+        token=creds_data.get('token'),
+        refresh_token=creds_data.get('refresh_token'),
+        token_uri=creds_data.get('token_uri'),
+        client_id=creds_data.get('client_id'),
+        client_secret=creds_data.get('client_secret'),
+        scopes=creds_data.get('scopes'),
+        expiry=datetime.fromisoformat(expiry) if expiry else None # Naive UTC, as google-auth expects
+    )
+    return {
+        'service': build_from_document(get_calendar_discovery(), credentials=credentials),
+        'credentials': credentials,
+        'creds_data': creds_data,
+        'version': token_entry.updated_at
+    }
+
+def _token_version(user_id):
+    return db.session.query(GoogleCalendarToken.updated_at).filter_by(user_id=user_id).scalar()
+
+def _save_if_changed(user_id, client):
+    """
+    Puts the token on its row only when a refresh actually changed it. Does
+    not commit: the caller's commit persists it.
+    """
+    new_data = credentials_to_data(client['credentials'], client['creds_data'])
+    if all(new_data.get(k) == client['creds_data'].get(k) for k in ('token', 'refresh_token', 'expiry')):
+        return
+    token_entry = GoogleCalendarToken.query.filter_by(user_id=user_id).first()
+    if token_entry:
+        token_entry.token_json = json.dumps(new_data)
+        token_entry.updated_at = client['version'] = datetime.utcnow() # Our own write doesn't stale our client
+    client['creds_data'] = new_data
+
+def get_calendar_service(user_id):
+    """
+    Returns an authenticated Google Calendar service for the given user, from
+    the per-process LRU cache (GOOGLE_CLIENT_CACHE_SIZE) while the token row's
+    version still matches. Refreshes the token shortly before expiry and puts
+    it on the row if it changed (the caller commits). Returns None if no token
+    or error.
+    """
+    version = _token_version(user_id)
+    if version is None:
+        evict_calendar_service(user_id)
         return None
+
+    with _clients_lock:
+        client = _clients.get(user_id)
+        if client and client['version'] != version:
+            del _clients[user_id] # Token changed in another process
+            client = None
+        if client:
+            _clients.move_to_end(user_id)
+
+    if client is None:
+        try:
+            client = _load_client(user_id)
+        except Exception as e:
+            current_app.logger.error(f"Error building calendar service for user {user_id}: {e}")
+            return None
+        if client is None:
+            return None
+        with _clients_lock:
+            _clients[user_id] = client
+            while len(_clients) > current_app.config.get('GOOGLE_CLIENT_CACHE_SIZE', 64):
+                _clients.popitem(last=False)
+
+    credentials = client['credentials']
+    expiring = credentials.expiry is not None and credentials.expiry - datetime.utcnow() < REFRESH_MARGIN
+    if credentials.refresh_token and (not credentials.token or expiring):
+        try:
+            credentials.refresh(Request())
+        except Exception as e:
+            current_app.logger.error(f"Error refreshing token for user {user_id}: {e}")
+            evict_calendar_service(user_id)
+            return None
+    elif not credentials.valid:
+        # Invalid and no refresh token
+        evict_calendar_service(user_id)
+        return None
+
+    # Also catches refreshes google-auth did on its own during the last API call
+    _save_if_changed(user_id, client)
+    return client['service']
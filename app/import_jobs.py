@@ -0,0 +1,145 @@
+"""
+Background CSV import jobs.
+
+/admin/import/* stores the upload in an ImportJob and returns right away;
+`flask import-worker` claims queued jobs and runs them with app/importer.py.
+Counters, the resume point (rows_read) and rejected rows are written in the
+same commit as each batch, so when a worker dies its job's heartbeat goes
+stale, another worker claims it and continues after the last committed batch.
+"""
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_, and_
+from app import db, importer
+from app.models import ImportJob, ImportJobError
+
+IMPORTERS = {
+    'agendas': importer.import_agendas,
+    'users': importer.import_users,
+    'payments': importer.import_payments,
+}
+
+def enqueue_import(kind, file, user_id=None):
+    """Queues an uploaded CSV (werkzeug FileStorage) and commits. Returns the job."""
+    job = ImportJob(kind=kind, filename=file.filename, data=file.stream.read(), created_by_id=user_id)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def job_status(job):
+    """JSON-friendly progress of a job (polled by the import dashboard)."""
+    end = job.finished_at or job.heartbeat_at
+    elapsed = (end - job.started_at).total_seconds() if job.started_at and end else 0
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'filename': job.filename,
+        'status': job.status,
+        'rows_read': job.rows_read or 0,
+        'created': job.created or 0,
+        'updated': job.updated or 0,
+        'skipped': job.skipped or 0,
+        'errors': job.errors or 0,
+        'rows_per_sec': round((job.rows_read or 0) / elapsed) if elapsed > 0 else None,
+        'last_error': job.last_error,
+        'created_at': job.created_at.isoformat() + 'Z' if job.created_at else None
+    }
+
+def _claimable(stale_before):
+    return or_(
+        ImportJob.status == 'queued',
+        and_(ImportJob.status == 'running', ImportJob.heartbeat_at < stale_before) # Worker died mid-job
+    )
+
+def claim_job():
+    """Takes the oldest queued (or abandoned) job. Returns it, or None."""
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=current_app.config.get('IMPORT_JOB_STALE_SECONDS', 600))
+    candidates = [job_id for (job_id,) in db.session.query(ImportJob.id).filter(
+        _claimable(stale_before)
+    ).order_by(ImportJob.id).limit(5)]
+
+    for job_id in candidates:
+        # Conditional update: when two workers race for a job only one gets a row back
+        claimed = ImportJob.query.filter(ImportJob.id == job_id, _claimable(stale_before)).update(
+            {'status': 'running', 'heartbeat_at': now}, synchronize_session=False
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(ImportJob, job_id)
+    return None
+
+def run_job(job):
+    """Runs (or resumes) a claimed job until done or failed."""
+    if not job.started_at:
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+    def record(rows_read, counts, rejected):
+        # Runs inside the batch's transaction, right before its commit
+        job.rows_read = (job.rows_read or 0) + rows_read
+        for key in ('created', 'updated', 'skipped', 'errors'):
+            setattr(job, key, (getattr(job, key) or 0) + counts[key])
+        job.heartbeat_at = datetime.utcnow()
+        for row_number, reason, row in rejected:
+            db.session.add(ImportJobError(
+                job_id=job.id,
+                row_number=row_number,
+                reason=reason,
+                row_data=json.dumps(row, ensure_ascii=False, default=str)
+            ))
+
+    try:
+        IMPORTERS[job.kind](io.BytesIO(job.data), start_row=job.rows_read or 0, on_chunk=record)
+    except Exception as e:
+        db.session.rollback() # Keeps every batch committed so far, retry resumes after them
+        job.status = 'failed'
+        job.last_error = str(e)[:2000]
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        current_app.logger.error(f"Import job {job.id} failed after {job.rows_read} rows: {e}")
+        return job
+
+    job.status = 'done'
+    job.last_error = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+def retry_job(job):
+    """Queues a failed job again; it resumes after its last committed batch."""
+    job.status = 'queued'
+    job.finished_at = None
+    db.session.commit()
+
+def error_report(job):
+    """CSV text of the rows a job rejected: row number, reason and the original columns."""
+    errors = job.rejected_rows.order_by(ImportJobError.row_number).all()
+    rows = [(e.row_number, e.reason, json.loads(e.row_data or '{}')) for e in errors]
+    columns = []
+    for _, _, data in rows:
+        for key in data:
+            if key not in columns:
+                columns.append(key)
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['row', 'reason'] + columns)
+    for row_number, reason, data in rows:
+        writer.writerow([row_number, reason] + [data.get(key, '') for key in columns])
+    return output.getvalue()
+
+def run_import_worker(interval=5, once=False):
+    """Runs jobs forever (or the next one), sleeping when the queue is empty."""
+    while True:
+        job = claim_job()
+        status = job_status(run_job(job)) if job else None
+        db.session.remove()
+        if once:
+            return status
+        if not job:
+            time.sleep(interval)
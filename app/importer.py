@@ -0,0 +1,454 @@
+"""
+Streaming CSV import (agendas, users, payments).
+
+The upload is decoded as it is read and processed in chunks of
+IMPORT_BATCH_SIZE rows. For each chunk the existing users, profiles and
+enrollments are prefetched into dicts with a handful of IN queries, new rows
+go in with bulk inserts, changes with bulk updates, and the chunk is
+committed on its own so the database is never locked for the whole file.
+Every chunk reports its counters and rejected rows to on_chunk before that
+commit, so a caller (see app/import_jobs.py) can save progress atomically
+with the data and resume after the last committed row.
+
+Bulk writes skip the ORM events, so the derived data they would maintain
+(enrollment balances, closer daily rollups, lead statuses, profile lookup
+keys) is refreshed here for the rows of each chunk.
+
+Rows are matched to existing users by email only. A row with an unknown
+email whose normalized phone or Instagram handle belongs to an existing lead
+becomes a new lead flagged in its notes as a possible duplicate, as the
+booking form does, so staff can review and merge them.
+"""
+import csv
+import io
+import time
+from datetime import datetime
+from itertools import islice
+from flask import current_app
+from sqlalchemy import insert, update
+from app import db
+from app.models import User, LeadProfile, Program, Enrollment, Payment, PaymentMethod, payment_fingerprint, normalize_phone, normalize_instagram
+from app.queries import match_leads_by_contact, possible_duplicate_note
+from app.balances import refresh_balances
+from app.stats import queue_stat_refresh
+from app.statuses import apply_lead_statuses
+
+def iter_chunks(stream, size, start_row=0):
+    """
+    Yields lists of (row_number, row) read lazily from a binary upload stream.
+    Data rows are numbered from 1; the first start_row rows are skipped (resume).
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    for _ in islice(reader, start_row):
+        pass
+    row_number = start_row
+    while True:
+        chunk = list(islice(reader, size))
+        if not chunk:
+            return
+        yield list(enumerate(chunk, row_number + 1))
+        row_number += len(chunk)
+
+def _batch_size(batch_size):
+    return batch_size or current_app.config.get('IMPORT_BATCH_SIZE', 500)
+
+def _new_counts():
+    return {'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
+
+def _commit_chunk(totals, counts, rows_read, rejected, on_chunk):
+    """Adds a chunk to the totals, lets on_chunk record it in the same transaction, commits."""
+    for key, value in counts.items():
+        totals[key] = totals.get(key, 0) + value
+    totals['rows'] += rows_read
+    if on_chunk:
+        on_chunk(rows_read, counts, rejected)
+    db.session.commit()
+
+def _result(started, totals):
+    elapsed = time.monotonic() - started
+    rows = totals['rows']
+    totals.update({
+        'elapsed': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed > 0 else float(rows)
+    })
+    current_app.logger.info(f"CSV import: {rows} rows in {elapsed:.1f}s ({totals['rows_per_sec']:.0f} rows/s)")
+    return totals
+
+def _with_email(chunk, counts, rejected):
+    """Drops (and rejects) rows without email. Returns [(row_number, row, email)]."""
+    rows = []
+    for row_number, row in chunk:
+        email = (row.get('email') or '').strip().lower()
+        if email:
+            rows.append((row_number, row, email))
+        else:
+            counts['errors'] += 1
+            rejected.append((row_number, 'Falta el email', row))
+    return rows
+
+def _parse_date(value, default):
+    if value:
+        try:
+            return datetime.strptime(value.strip(), '%Y-%m-%d')
+        except ValueError:
+            pass
+    return default
+
+class UsernamePool:
+    """
+    Hands out unique usernames without a query per candidate: the usernames
+    starting with a base are loaded once, then suffixes are picked in memory.
+    """
+    def __init__(self, separator=''):
+        self.separator = separator
+        self.taken = set()
+        self.loaded = set()
+        self.counters = {} # base -> next suffix to try
+
+    def allocate(self, base):
+        if base not in self.loaded:
+            self.taken.update(name for (name,) in db.session.query(User.username).filter(
+                User.username.startswith(base, autoescape=True)
+            ))
+            self.loaded.add(base)
+
+        username = base
+        counter = self.counters.get(base, 1)
+        while username in self.taken:
+            username = f"{base}{self.separator}{counter}"
+            counter += 1
+        self.counters[base] = counter
+        self.taken.add(username)
+        return username
+
+def _insert_users(new_users):
+    """Bulk inserts the new users. Returns {email: id}."""
+    if not new_users:
+        return {}
+    db.session.execute(insert(User), list(new_users.values()))
+    return dict(db.session.query(User.email, User.id).filter(User.email.in_(list(new_users))).all())
+
+def _with_contact_keys(profile):
+    # What LeadProfile.update_contact_keys does on ORM writes
+    if 'phone' in profile:
+        profile['phone_normalized'] = normalize_phone(profile['phone'])
+    if 'instagram' in profile:
+        profile['instagram_normalized'] = normalize_instagram(profile['instagram'])
+    return profile
+
+def _write_profiles(new_profiles, profile_updates, user_ids):
+    """new_profiles is keyed by email; user_ids maps the emails of just-inserted users."""
+    rows = []
+    for email, profile in new_profiles.items():
+        if profile['user_id'] is None:
+            profile['user_id'] = user_ids[email]
+        rows.append(_with_contact_keys(profile))
+    if rows:
+        db.session.execute(insert(LeadProfile), rows)
+    if profile_updates:
+        db.session.execute(update(LeadProfile), [_with_contact_keys(changes) for changes in profile_updates.values()])
+
+def _prefetch_users(emails):
+    """{email: {'id', 'role', 'created_at'}} of the users that already exist."""
+    return {
+        email: {'id': user_id, 'role': role, 'created_at': created_at}
+        for user_id, email, role, created_at in db.session.query(
+            User.id, User.email, User.role, User.created_at
+        ).filter(User.email.in_(emails))
+    }
+
+def _possible_duplicates(rows, existing):
+    """
+    {email: user_id} for rows whose email is unknown but whose phone or
+    Instagram handle belongs to an existing lead (flagged, never merged).
+    """
+    unknown = [(email, row) for _, row, email in rows if email not in existing]
+    if not unknown:
+        return {}
+    by_phone, by_handle = match_leads_by_contact(
+        [row.get('phone') for _, row in unknown], [row.get('instagram') for _, row in unknown]
+    )
+    matched = {}
+    for email, row in unknown:
+        user_id = by_phone.get(normalize_phone(row.get('phone'))) or by_handle.get(normalize_instagram(row.get('instagram')))
+        if user_id:
+            matched[email] = user_id
+    return matched
+
+def _new_profile(email, duplicates, **fields):
+    """Profile row of a new lead, with the possible-duplicate note if its contact matched one."""
+    duplicate_of = duplicates.get(email)
+    return dict(fields, user_id=None, notes=possible_duplicate_note(duplicate_of) if duplicate_of else None)
+
+def _prefetch_profiles(user_ids):
+    """{user_id: {'id', 'phone', 'instagram'}}."""
+    if not user_ids:
+        return {}
+    return {
+        user_id: {'id': profile_id, 'phone': phone, 'instagram': instagram}
+        for profile_id, user_id, phone, instagram in db.session.query(
+            LeadProfile.id, LeadProfile.user_id, LeadProfile.phone, LeadProfile.instagram
+        ).filter(LeadProfile.user_id.in_(user_ids))
+    }
+
+def _fill_contact(profile, profile_updates, phone, instagram):
+    """Fills phone/instagram of an existing profile only where they are missing."""
+    changes = {}
+    if phone and not profile['phone']:
+        changes['phone'] = profile['phone'] = phone
+    if instagram and not profile['instagram']:
+        changes['instagram'] = profile['instagram'] = instagram
+    if changes:
+        profile_updates.setdefault(profile['id'], {'id': profile['id']}).update(changes)
+    return bool(changes)
+
+# --- Agendas ---
+
+def import_agendas(stream, batch_size=None, start_row=0, on_chunk=None):
+    """Leads from an agendas export (email, username, created_at, phone, instagram)."""
+    started = time.monotonic()
+    usernames = UsernamePool()
+    totals = dict(_new_counts(), rows=0)
+
+    for chunk in iter_chunks(stream, _batch_size(batch_size), start_row):
+        counts, rejected = _new_counts(), []
+        rows = _with_email(chunk, counts, rejected)
+        existing = _prefetch_users({email for _, _, email in rows})
+        duplicates = _possible_duplicates(rows, existing)
+        profiles = _prefetch_profiles({user['id'] for user in existing.values()})
+        new_users, new_profiles, user_updates, profile_updates = {}, {}, {}, {}
+
+        for row_number, row, email in rows:
+            phone = row.get('phone') or ''
+            instagram = row.get('instagram') or ''
+            created_at = _parse_date(row.get('created_at'), datetime.utcnow())
+
+            if email in new_users:
+                # Repeated in this chunk: same rules as an existing user
+                user = new_users[email]
+                user['created_at'] = min(user['created_at'], created_at)
+                profile = new_profiles[email]
+                profile['phone'] = profile['phone'] or phone
+                profile['instagram'] = profile['instagram'] or instagram
+                counts['updated'] += 1
+                continue
+
+            user = existing.get(email)
+            if not user:
+                base = (row.get('username') or '').strip() or email.split('@')[0]
+                new_users[email] = {
+                    'username': usernames.allocate(base),
+                    'email': email,
+                    'role': 'lead',
+                    'created_at': created_at,
+                    'password_hash': None # No usable password until given a login
+                }
+                new_profiles[email] = _new_profile(email, duplicates, phone=phone, instagram=instagram, status='new')
+                counts['created'] += 1
+                continue
+
+            # Agendas are the source of truth for the registration date
+            if user['created_at'] is None or created_at < user['created_at']:
+                user['created_at'] = created_at
+                user_updates[user['id']] = {'id': user['id'], 'created_at': created_at}
+            profile = profiles.get(user['id'])
+            if profile:
+                _fill_contact(profile, profile_updates, phone, instagram)
+            elif email not in new_profiles:
+                new_profiles[email] = {'user_id': user['id'], 'phone': phone, 'instagram': instagram, 'status': 'new'}
+            counts['updated'] += 1
+
+        user_ids = _insert_users(new_users)
+        if user_updates:
+            db.session.execute(update(User), list(user_updates.values()))
+        _write_profiles(new_profiles, profile_updates, user_ids)
+        _commit_chunk(totals, counts, len(chunk), rejected, on_chunk)
+
+    return _result(started, totals)
+
+# --- Users ---
+
+def import_users(stream, batch_size=None, start_row=0, on_chunk=None):
+    """Users from a users export (email, username, role, phone, instagram)."""
+    started = time.monotonic()
+    usernames = UsernamePool(separator=' ')
+    totals = dict(_new_counts(), rows=0)
+
+    for chunk in iter_chunks(stream, _batch_size(batch_size), start_row):
+        counts, rejected = _new_counts(), []
+        rows = _with_email(chunk, counts, rejected)
+        existing = _prefetch_users({email for _, _, email in rows})
+        duplicates = _possible_duplicates(rows, existing)
+        profiles = _prefetch_profiles({user['id'] for user in existing.values()})
+        new_users, new_profiles, user_updates, profile_updates = {}, {}, {}, {}
+
+        for row_number, row, email in rows:
+            role = row.get('role') or 'lead'
+            phone = row.get('phone')
+            instagram = row.get('instagram')
+
+            if email in new_users:
+                counts['skipped'] += 1 # First row of a new user wins, as before
+                continue
+
+            user = existing.get(email)
+            if not user:
+                base = (row.get('username') or '').strip() or email.split('@')[0]
+                new_users[email] = {
+                    'username': usernames.allocate(base),
+                    'email': email,
+                    'role': role,
+                    'password_hash': None
+                }
+                new_profiles[email] = _new_profile(
+                    email, duplicates, phone=phone, instagram=instagram, status='new', utm_source='import'
+                )
+                counts['created'] += 1
+                continue
+
+            changed = False
+            # A lead that shows up as student is promoted (status follows payments)
+            if user['role'] != 'student' and role == 'student':
+                user['role'] = 'student'
+                user_updates[user['id']] = {'id': user['id'], 'role': 'student'}
+                changed = True
+            profile = profiles.get(user['id'])
+            if profile:
+                changed = _fill_contact(profile, profile_updates, phone, instagram) or changed
+            counts['updated' if changed else 'skipped'] += 1
+
+        user_ids = _insert_users(new_users)
+        if user_updates:
+            db.session.execute(update(User), list(user_updates.values()))
+        _write_profiles(new_profiles, profile_updates, user_ids)
+        _commit_chunk(totals, counts, len(chunk), rejected, on_chunk)
+
+    return _result(started, totals)
+
+# --- Payments ---
+
+def import_payments(stream, batch_size=None, start_row=0, on_chunk=None):
+    """
+    Payments from a payments export (email, program, amount, date, type).
+    created counts payments, updated the users whose status was refreshed.
+    """
+    started = time.monotonic()
+    totals = dict(_new_counts(), rows=0, enrollments=0)
+
+    method = PaymentMethod.query.filter_by(name='Imported').first()
+    if not method:
+        method = PaymentMethod(name='Imported')
+        db.session.add(method)
+        db.session.commit()
+    pct = method.commission_percent or 0.0
+    fixed = method.commission_fixed or 0.0
+    programs = {name: (program_id, price) for program_id, name, price in db.session.query(Program.id, Program.name, Program.price)}
+
+    for chunk in iter_chunks(stream, _batch_size(batch_size), start_row):
+        counts, rejected = dict(_new_counts(), enrollments=0), []
+        rows = _with_email(chunk, counts, rejected)
+        users = dict(db.session.query(User.email, User.id).filter(
+            User.email.in_({email for _, _, email in rows})
+        ).all())
+
+        # (student_id, program_id) -> {'id', 'closer_id'}; the oldest enrollment wins, as with .first()
+        enrollments = {}
+        for enrollment_id, student_id, program_id, closer_id in db.session.query(
+            Enrollment.id, Enrollment.student_id, Enrollment.program_id, Enrollment.closer_id
+        ).filter(Enrollment.student_id.in_(list(users.values()))).order_by(Enrollment.id.desc()):
+            enrollments[(student_id, program_id)] = {'id': enrollment_id, 'closer_id': closer_id}
+
+        # Rows that can be imported, with any missing enrollment created first
+        valid = []
+        new_enrollments = {}
+        for row_number, row, email in rows:
+            # Users and programs must be imported first
+            user_id = users.get(email)
+            program = programs.get((row.get('program') or '').strip())
+            try:
+                amount = float(row.get('amount') or 0)
+            except ValueError:
+                amount = None
+            if not user_id:
+                reason = 'Usuario no encontrado'
+            elif not program:
+                reason = 'Programa no encontrado'
+            elif amount is None:
+                reason = 'Monto inválido'
+            else:
+                reason = None
+            if reason:
+                counts['errors'] += 1
+                rejected.append((row_number, reason, row))
+                continue
+
+            key = (user_id, program[0])
+            if key not in enrollments and key not in new_enrollments:
+                new_enrollments[key] = {
+                    'student_id': user_id,
+                    'program_id': program[0],
+                    'status': 'active',
+                    'enrollment_date': datetime.now(), # Rough approx if not in CSV users
+                    'total_agreed': program[1]
+                }
+            valid.append((key, amount, row))
+
+        if new_enrollments:
+            db.session.execute(insert(Enrollment), list(new_enrollments.values()))
+            counts['enrollments'] += len(new_enrollments)
+            for enrollment_id, student_id, program_id in db.session.query(
+                Enrollment.id, Enrollment.student_id, Enrollment.program_id
+            ).filter(Enrollment.student_id.in_({key[0] for key in new_enrollments})):
+                key = (student_id, program_id)
+                if key in new_enrollments and key not in enrollments:
+                    enrollments[key] = {'id': enrollment_id, 'closer_id': None}
+
+        # Duplicates (same enrollment, amount, type and day): one lookup on the
+        # unique fingerprint index for the whole chunk
+        candidates = []
+        for key, amount, row in valid:
+            enrollment = enrollments[key]
+            p_type = row.get('type')
+            pay_date = _parse_date(row.get('date'), datetime.now())
+            fingerprint = payment_fingerprint(enrollment['id'], amount, p_type, pay_date)
+            candidates.append((enrollment, amount, p_type, pay_date, fingerprint))
+        seen = {fingerprint for (fingerprint,) in db.session.query(Payment.fingerprint).filter(
+            Payment.fingerprint.in_({c[4] for c in candidates}),
+            Payment.status == 'completed'
+        )}
+
+        new_payments = []
+        touched = set()
+        for enrollment, amount, p_type, pay_date, fingerprint in candidates:
+            if fingerprint in seen:
+                counts['skipped'] += 1 # Already imported
+                continue
+            seen.add(fingerprint)
+
+            fee = amount * (pct / 100.0) + fixed
+            new_payments.append({
+                'enrollment_id': enrollment['id'],
+                'payment_method_id': method.id,
+                'amount': amount,
+                'date': pay_date,
+                'payment_type': p_type,
+                'status': 'completed',
+                'reference_id': 'IMPORT',
+                'platform_fee': fee,
+                'cash_collect': amount - fee,
+                'fingerprint': fingerprint # Bulk inserts skip the mapper event
+            })
+            touched.add(enrollment['id'])
+            queue_stat_refresh(enrollment['closer_id'], pay_date)
+
+        if new_payments:
+            db.session.execute(insert(Payment), new_payments)
+            counts['created'] += len(new_payments)
+        refresh_balances(list(touched | {enrollments[key]['id'] for key in new_enrollments}))
+        affected_users = list({key[0] for key, _, _ in valid})
+        apply_lead_statuses(affected_users)
+        counts['updated'] += len(affected_users)
+        _commit_chunk(totals, counts, len(chunk), rejected, on_chunk)
+
+    return _result(started, totals)
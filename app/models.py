@@ -1,4 +1,7 @@
 from datetime import datetime
+import json
+import re
+from sqlalchemy import event
 from app import db, login
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
@@ -42,7 +45,18 @@ class User(UserMixin, db.Model):
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
+    def set_unusable_password(self):
+        # Leads created by imports/booking/sales never log in until given a password,
+        # so no hash is computed for them (and nothing can match)
+        self.password_hash = None
+
+    @property
+    def has_usable_password(self):
+        return bool(self.password_hash)
+
     def check_password(self, password):
+        if not self.has_usable_password:
+            return False
         return check_password_hash(self.password_hash, password)
 
     def __repr__(self):
@@ -51,92 +65,43 @@ class User(UserMixin, db.Model):
     @property
     def total_lifetime_paid(self):
         """Sum of all payments made by this user across all enrollments."""
-        total = 0
-        # Iterate enrollments (dynamic relationship)
-        for enr in self.enrollments:
-            total += enr.total_paid
-        return total
+        # Read from the stored enrollment balances (see Enrollment.update_balance)
+        return db.session.query(db.func.coalesce(db.func.sum(Enrollment.paid_total), 0.0)).filter(
+            Enrollment.student_id == self.id
+        ).scalar()
 
     @property
     def current_active_debt(self):
         """Sum of outstanding debt on ACTIVE enrollments only."""
-        total_debt = 0
-        # Filter for active only
-        active_enrollments = self.enrollments.filter_by(status='active')
-        for enr in active_enrollments:
-            paid = enr.total_paid
-            # Ensure we don't count negative debt (overpayment) as debt, unless desired? 
-            # Usually debt is max(0, agreed - paid)
-            agreed = enr.total_agreed if enr.total_agreed is not None else (enr.program.price if enr.program else 0.0)
-            debt = agreed - paid
-            if debt > 0:
-                total_debt += debt
-        return total_debt
+        # outstanding is already max(0, agreed - paid), so overpayments don't cancel debt
+        return db.session.query(db.func.coalesce(db.func.sum(Enrollment.outstanding), 0.0)).filter(
+            Enrollment.student_id == self.id,
+            Enrollment.status == 'active'
+        ).scalar()
 
     def update_status_based_on_debt(self):
         """
-        Updates the user's lead profile status based on current debt, enrollments, and appointments.
-        Priority:
-        1. Pending (Debts) - Active enrollments with debt.
-        2. Completed - Active enrollments with NO debt.
-        3. Scheduled - No enrollments/payments, but has future appointments.
-        4. New - No payments, no enrollments, no future appointments. (Or if canceled appt and nothing else)
+        Recomputes this user's lead profile status (see app/statuses.py for the rules)
+        and commits. Callers handling several users should use apply_lead_statuses.
         """
-        if not self.lead_profile:
-            # Create profile if missing
-            profile = LeadProfile(user_id=self.id)
-            db.session.add(profile)
-            self.lead_profile = profile
-        
-        has_enrollments = self.enrollments.count() > 0
-        debt = self.current_active_debt
-        
-        # Check for ANY payments (to distinguish 'new' from others)
-        # Efficiently check if any completed payment exists
-        # self.enrollments is dynamic, so we can iterate or join
-        has_payments = False
-        for enr in self.enrollments:
-            if enr.payments.filter_by(status='completed').count() > 0:
-                has_payments = True
-                break
-        
-        # Check for Future Appointments (Agendado)
-        # Explicit import to avoid circular dependency if placed at top, usually safe inside method or use string
-        # 'Appointment' is defined in this file (models.py), so it's safe.
-        now = datetime.now()
-        has_future_appointment = self.appointments_as_lead.filter(
-            Appointment.start_time > now, 
-            Appointment.status == 'scheduled'
-        ).count() > 0
-
-        new_status = self.lead_profile.status
-        
-        # Logic Hierarchy
-        if debt > 0:
-            # Priority 1: Has debt -> Pending (Pendiente)
-            new_status = 'pending'
-        elif has_enrollments and debt <= 0:
-             # Priority 2: Has enrollments but NO debt -> Completed (Completo)
-            new_status = 'completed'
-        elif has_future_appointment:
-            # Priority 3: No enrollments/debt but has future appointment -> Scheduled (Agendado)
-            new_status = 'agenda'
-        elif not has_payments:
-             # Priority 4: No payments, no enrollments, no future appt -> New (Nuevo)
-             # What if they have past appointments but canceled? -> Nuevo
-             new_status = 'new'
-        else:
-            # Fallback (Has payments but no active enrollment? Dropped?)
-            # Keep as is or default? Let's leave as is if none match, or 'new'.
-            pass
+        from app.statuses import apply_lead_statuses
+        apply_lead_statuses([self.id])
+        db.session.commit()
 
-        if new_status != self.lead_profile.status:
-            self.lead_profile.status = new_status
-            db.session.add(self.lead_profile)
-            # DB Commit should be handled by caller usually, but method name implies action.
-            # Original method had commit. Let's keep it to ensure it saves.
-            db.session.commit()
 
+def normalize_phone(phone):
+    """'+591 7000-1234' -> '59170001234': digits only (E.164 without '+'), international '00' dropped."""
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    return digits[:20] or None
+
+def normalize_instagram(handle):
+    """'@Juan.Perez', 'instagram.com/juan.perez/' -> 'juan.perez'."""
+    handle = (handle or '').strip().lower()
+    if 'instagram.com/' in handle:
+        handle = handle.split('instagram.com/', 1)[1].split('?', 1)[0]
+    return handle.strip('/@ ')[:64] or None
 
 class LeadProfile(db.Model):
     __tablename__ = 'lead_profiles'
@@ -144,7 +109,11 @@ class LeadProfile(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), unique=True, nullable=False)
     phone = db.Column(db.String(20))
     instagram = db.Column(db.String(64))
-    utm_source = db.Column(db.String(64)) # e.g., 'elias', 'vsl', 'workshop'
+    # Lookup keys (normalize_phone / normalize_instagram), kept up to date on every
+    # ORM write (see _set_contact_keys); bulk writes set them explicitly.
+    phone_normalized = db.Column(db.String(20), index=True)
+    instagram_normalized = db.Column(db.String(64), index=True)
+    utm_source = db.Column(db.String(64), index=True) # e.g., 'elias', 'vsl', 'workshop'
     status = db.Column(db.String(20), default='new') 
     notes = db.Column(db.Text)
 
@@ -154,9 +123,22 @@ class LeadProfile(db.Model):
     assigned_closer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     assigned_closer = db.relationship('User', foreign_keys=[assigned_closer_id], backref='assigned_leads')
 
+    __table_args__ = (
+        db.Index('ix_lead_profiles_assigned_closer_status', 'assigned_closer_id', 'status'),
+    )
+
+    def update_contact_keys(self):
+        self.phone_normalized = normalize_phone(self.phone)
+        self.instagram_normalized = normalize_instagram(self.instagram)
+
     def __repr__(self):
         return f'<LeadProfile {self.user_id}>'
 
+@event.listens_for(LeadProfile, 'before_insert')
+@event.listens_for(LeadProfile, 'before_update')
+def _set_contact_keys(mapper, connection, target):
+    target.update_contact_keys()
+
 class EventGroup(db.Model):
     __tablename__ = 'event_groups'
     id = db.Column(db.Integer, primary_key=True)
@@ -200,7 +182,7 @@ class Program(db.Model):
 class Enrollment(db.Model):
     __tablename__ = 'enrollments'
     id = db.Column(db.Integer, primary_key=True)
-    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     program_id = db.Column(db.Integer, db.ForeignKey('programs.id'), nullable=False)
     enrollment_date = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(20), default='active') # active, completed, dropped
@@ -212,11 +194,40 @@ class Enrollment(db.Model):
     closer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     closer = db.relationship('User', foreign_keys=[closer_id], backref='sales_made')
 
+    # Stored balance (kept in sync by update_balance on every payment write)
+    paid_total = db.Column(db.Float, default=0.0) # Sum of completed payments
+    agreed_total = db.Column(db.Float, default=0.0) # total_agreed, or program price if not set
+    outstanding = db.Column(db.Float, default=0.0) # max(0, agreed_total - paid_total)
+
+    __table_args__ = (
+        db.Index('ix_enrollments_closer_status_date', 'closer_id', 'status', 'enrollment_date'),
+    )
+
     @property
     def total_paid(self):
-        # Calculate total paid amount for completed payments
-        completed_payments = self.payments.filter_by(status='completed').all()
-        return sum(p.amount for p in completed_payments)
+        # Completed payments total, read from the stored balance
+        return self.paid_total or 0.0
+
+    def update_balance(self):
+        """
+        Recomputes the stored balance from this enrollment's completed payments.
+        Must be called after any Payment insert/edit/delete, before the commit,
+        so the balance is saved in the same transaction.
+        """
+        db.session.flush()
+        paid = db.session.query(db.func.coalesce(db.func.sum(Payment.amount), 0.0)).filter(
+            Payment.enrollment_id == self.id,
+            Payment.status == 'completed'
+        ).scalar()
+
+        if self.total_agreed is not None:
+            agreed = self.total_agreed
+        else:
+            agreed = self.program.price if self.program else 0.0
+
+        self.paid_total = paid
+        self.agreed_total = agreed
+        self.outstanding = max(agreed - paid, 0.0)
 
 class PaymentMethod(db.Model):
     __tablename__ = 'payment_methods'
@@ -228,6 +239,15 @@ class PaymentMethod(db.Model):
     
     payments = db.relationship('Payment', backref='method', lazy='dynamic')
 
+# Fingerprint prefix of legacy completed payments that duplicated an older one when the
+# fingerprint was introduced (migration d5a1b7e3f926). Kept on later writes so they don't
+# collide with the original; resolve them by deleting the extra payment.
+DUPLICATE_MARKER = 'dup-'
+
+def payment_fingerprint(enrollment_id, amount, payment_type, date):
+    """Dedup key of a payment: enrollment, amount in cents, type and calendar day."""
+    return f"{enrollment_id}:{int(round((amount or 0) * 100))}:{payment_type or ''}:{date:%Y-%m-%d}"
+
 class Payment(db.Model):
     __tablename__ = 'payments'
     id = db.Column(db.Integer, primary_key=True)
@@ -240,6 +260,55 @@ class Payment(db.Model):
     reference_id = db.Column(db.String(100))
     status = db.Column(db.String(20), default='completed') # completed, pending, failed
 
+    # Commission snapshot taken at write time (see snapshot_fees), so later edits
+    # to the PaymentMethod fees don't change historical figures
+    platform_fee = db.Column(db.Float, default=0.0) # amount * pct/100 + fixed
+    cash_collect = db.Column(db.Float, default=0.0) # amount - platform_fee
+
+    # payment_fingerprint(), kept up to date on every ORM write (see _set_payment_fingerprint).
+    # Unique among completed payments, so the same payment can't be recorded twice.
+    fingerprint = db.Column(db.String(64))
+
+    __table_args__ = (
+        db.Index('uq_payments_fingerprint_completed', 'fingerprint', unique=True,
+                 sqlite_where=db.text("status = 'completed'"), postgresql_where=db.text("status = 'completed'")),
+        db.Index('ix_payments_enrollment_status_date', 'enrollment_id', 'status', 'date'),
+    )
+
+    def update_fingerprint(self):
+        if self.fingerprint and self.fingerprint.startswith(DUPLICATE_MARKER):
+            return self.fingerprint # Legacy duplicate, see DUPLICATE_MARKER
+        if self.date is None:
+            self.date = datetime.utcnow() # Same as the column default, needed for the day
+        self.fingerprint = payment_fingerprint(self.enrollment_id, self.amount, self.payment_type, self.date)
+        return self.fingerprint
+
+    def is_duplicate(self):
+        """True if another completed payment has this payment's fingerprint (manual entry check)."""
+        fingerprint = self.update_fingerprint()
+        if self.status != 'completed':
+            return False # Only completed payments are unique
+        with db.session.no_autoflush: # Flushing self first would hit the unique index
+            query = db.session.query(Payment.id).filter(
+                Payment.fingerprint == fingerprint,
+                Payment.status == 'completed'
+            )
+            if self.id:
+                query = query.filter(Payment.id != self.id)
+            return query.first() is not None
+
+    def snapshot_fees(self):
+        """Stores platform fee and net cash collect using the method's current fees."""
+        method = db.session.get(PaymentMethod, self.payment_method_id) if self.payment_method_id else None
+        if method:
+            pct = method.commission_percent or 0.0
+            fixed = method.commission_fixed or 0.0
+            fee = (self.amount * (pct / 100.0)) + fixed
+        else:
+            fee = 0.0
+        self.platform_fee = fee
+        self.cash_collect = self.amount - fee
+
     @property
     def payment_type_label(self):
         labels = {
@@ -251,17 +320,29 @@ class Payment(db.Model):
         }
         return labels.get(self.payment_type, self.payment_type)
 
+@event.listens_for(Payment, 'before_insert')
+@event.listens_for(Payment, 'before_update')
+def _set_payment_fingerprint(mapper, connection, target):
+    target.update_fingerprint()
+
 class Appointment(db.Model):
     __tablename__ = 'appointments'
     id = db.Column(db.Integer, primary_key=True)
     closer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    lead_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    lead_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=True) # Check nullable first to avoid migration issues? Let's say nullable=True for now.
     # Timezone Note: stored in UTC (naive datetime, but logic treats as UTC)
     start_time = db.Column(db.DateTime, index=True)
     status = db.Column(db.String(20), default='scheduled') # scheduled, completed, canceled, no_show
     google_event_id = db.Column(db.String(255), nullable=True) # Store GCal Event ID for updates
 
+    # One live appointment per closer and start time (canceled ones free the slot)
+    __table_args__ = (
+        db.Index('uq_appointments_closer_start_active', 'closer_id', 'start_time', unique=True,
+                 sqlite_where=db.text("status != 'canceled'"), postgresql_where=db.text("status != 'canceled'")),
+        db.Index('ix_appointments_closer_start_status', 'closer_id', 'start_time', 'status'),
+    )
+
 class Availability(db.Model):
     __tablename__ = 'availability'
     id = db.Column(db.Integer, primary_key=True)
@@ -270,9 +351,29 @@ class Availability(db.Model):
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_availability_closer_date', 'closer_id', 'date'),
+    )
+
     def __repr__(self):
         return f'<Availability Date={self.date} {self.start_time}-{self.end_time}>'
 
+class BookingSlot(db.Model):
+    # Availability expanded to UTC start times, kept in sync by app/slots.py
+    __tablename__ = 'booking_slots'
+    id = db.Column(db.Integer, primary_key=True)
+    closer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    utc_start = db.Column(db.DateTime, nullable=False) # Naive UTC, same convention as Appointment.start_time
+    is_booked = db.Column(db.Boolean, default=False, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('closer_id', 'utc_start', name='_closer_slot_uc'),
+        db.Index('ix_booking_slots_booked_start', 'is_booked', 'utc_start'),
+    )
+
+    def __repr__(self):
+        return f'<BookingSlot {self.closer_id} {self.utc_start} booked={self.is_booked}>'
+
 class SurveyQuestion(db.Model):
     __tablename__ = 'survey_questions'
     id = db.Column(db.Integer, primary_key=True)
@@ -298,6 +399,10 @@ class SurveyAnswer(db.Model):
     question_id = db.Column(db.Integer, db.ForeignKey('survey_questions.id'), nullable=False)
     answer = db.Column(db.Text)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointments.id'))
+
+    __table_args__ = (
+        db.Index('ix_survey_answers_lead_question', 'lead_id', 'question_id'),
+    )
     
     question = db.relationship('SurveyQuestion')
     appointment = db.relationship('Appointment', backref='survey_answers')
@@ -376,7 +481,7 @@ class CloserDailyStats(db.Model):
     closer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
     
-    # Automated KPIs (Snapshots)
+    # Automated KPIs (rollups kept current on every write, see app/stats.py)
     calls_scheduled = db.Column(db.Integer, default=0) # Total Scheduled for this day
     calls_completed = db.Column(db.Integer, default=0) # Total Completed
     calls_no_show = db.Column(db.Integer, default=0)
@@ -389,6 +494,9 @@ class CloserDailyStats(db.Model):
     # Legacy / Manual Metrics (Optional, keep if needed for now)
     self_generated_bookings = db.Column(db.Integer, default=0) 
     
+    # Set when the closer submits the daily report (rollup rows exist without it)
+    report_submitted_at = db.Column(db.DateTime, nullable=True)
+    
     # Removed qualitative columns (win_of_day, etc) in favor of DailyReportAnswer
     
     closer = db.relationship('User', backref=db.backref('daily_stats', lazy='dynamic'))
@@ -413,3 +521,105 @@ class GoogleCalendarToken(db.Model):
 
     def __repr__(self):
         return f'<GoogleToken for User {self.user_id}>'
+
+class CalendarOutbox(db.Model):
+    # Pending Google Calendar changes, written in the same transaction as the appointment
+    # change (see app/calendar_sync.py) and drained by `flask calendar-worker`
+    __tablename__ = 'calendar_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointments.id', ondelete='SET NULL'), nullable=True)
+    closer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False) # Whose calendar
+    action = db.Column(db.String(20), nullable=False) # created, rescheduled, canceled, status_changed, deleted
+    google_event_id = db.Column(db.String(255), nullable=True) # For deletes once the appointment is gone/moved
+    status = db.Column(db.String(20), default='pending', index=True) # pending, done, superseded, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    appointment = db.relationship('Appointment')
+
+    def __repr__(self):
+        return f'<CalendarOutbox {self.action} Appt {self.appointment_id} ({self.status})>'
+
+class SalesWebhookEvent(db.Model):
+    # Sales webhook deliveries, queued with the payment and sent by `flask sales-webhook-worker`
+    __tablename__ = 'sales_webhook_events'
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payments.id', ondelete='SET NULL'), nullable=True)
+    idempotency_key = db.Column(db.String(100), unique=True, nullable=False) # Sent as Idempotency-Key
+    payload = db.Column(db.Text, nullable=False) # JSON snapshot taken when the sale was saved
+    status = db.Column(db.String(20), default='pending', index=True) # pending, sent, dead
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    payment = db.relationship('Payment')
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+    def __repr__(self):
+        return f'<SalesWebhookEvent {self.idempotency_key} ({self.status})>'
+
+class ImportJob(db.Model):
+    # CSV imports queued from /admin/import and run by `flask import-worker`
+    __tablename__ = 'import_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False) # agendas, users, payments
+    filename = db.Column(db.String(255))
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False)) # The upload (workers don't share a disk with web)
+    status = db.Column(db.String(20), default='queued', index=True) # queued, running, done, failed
+    rows_read = db.Column(db.Integer, default=0) # Committed rows, the resume point
+    created = db.Column(db.Integer, default=0)
+    updated = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True) # Last committed batch, stale = crashed worker
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    created_by = db.relationship('User')
+    rejected_rows = db.relationship('ImportJobError', backref='job', lazy='dynamic', cascade="all, delete-orphan")
+
+    def __repr__(self):
+        return f'<ImportJob {self.id} {self.kind} ({self.status})>'
+
+class ImportJobError(db.Model):
+    # Rows an import job rejected, for the downloadable error report
+    __tablename__ = 'import_job_errors'
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('import_jobs.id', ondelete='CASCADE'), nullable=False, index=True)
+    row_number = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(255), nullable=False)
+    row_data = db.Column(db.Text) # JSON of the CSV row
+
+class JobWatermark(db.Model):
+    # Progress and lock of incremental scheduled jobs (see app/scheduler.py)
+    __tablename__ = 'job_watermarks'
+    name = db.Column(db.String(50), primary_key=True)
+    watermark_at = db.Column(db.DateTime, nullable=True) # Everything up to here was processed
+    watermark_id = db.Column(db.Integer, nullable=True) # Tie-breaker for rows sharing watermark_at
+    locked_until = db.Column(db.DateTime, nullable=True) # Held by the process running the job
+    last_run_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<JobWatermark {self.name} at {self.watermark_at}>'
+
+class CloserLead(db.Model):
+    # Closer portfolios materialized from enrollments, appointments and assignments (see app/portfolio.py)
+    __tablename__ = 'closer_leads'
+    closer_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    lead_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True, index=True)
+    reason = db.Column(db.String(20), nullable=False) # enrollment, appointment, assigned (strongest one)
+    first_seen = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CloserLead {self.closer_id} -> {self.lead_id} ({self.reason})>'
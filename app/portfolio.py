@@ -0,0 +1,129 @@
+"""
+Closer portfolios (CloserLead).
+
+A lead belongs to a closer's portfolio when it has an enrollment sold by the
+closer, an appointment with the closer, or the closer is its assigned closer.
+closer_leads keeps those pairs materialized so "my leads" is one indexed join
+instead of three correlated EXISTS. The pairs of every lead whose
+enrollments, appointments or assignment changed are recomputed on commit.
+"""
+from datetime import datetime
+from sqlalchemy import event, inspect, insert
+from app import db
+from app.models import User, LeadProfile, Enrollment, Appointment, CloserLead
+
+# Model -> (lead field, closer field)
+TRACKED_FIELDS = {
+    Enrollment: ('student_id', 'closer_id'),
+    Appointment: ('lead_id', 'closer_id'),
+    LeadProfile: ('user_id', 'assigned_closer_id'),
+}
+
+def portfolio_pairs(lead_ids=None):
+    """
+    {(closer_id, lead_id): (reason, first_seen)} from the source tables, for
+    all leads or the given ones. The reason is the strongest source
+    (enrollment > appointment > assigned); first_seen the earliest date.
+    """
+    sources = [
+        ('enrollment', Enrollment.closer_id, Enrollment.student_id, db.func.min(Enrollment.enrollment_date), None),
+        ('appointment', Appointment.closer_id, Appointment.lead_id, db.func.min(Appointment.start_time), None),
+        ('assigned', LeadProfile.assigned_closer_id, LeadProfile.user_id, db.func.min(User.created_at), User),
+    ]
+    pairs = {}
+    for reason, closer_column, lead_column, seen_column, join in sources:
+        query = db.session.query(closer_column, lead_column, seen_column).filter(closer_column.isnot(None))
+        if join is not None:
+            query = query.join(join, User.id == lead_column)
+        if lead_ids is not None:
+            query = query.filter(lead_column.in_(lead_ids))
+        for closer_id, lead_id, seen in query.group_by(closer_column, lead_column):
+            key = (closer_id, lead_id)
+            if key in pairs:
+                first_reason, first_seen = pairs[key]
+                dates = [d for d in (first_seen, seen) if d]
+                pairs[key] = (first_reason, min(dates) if dates else None)
+            else:
+                pairs[key] = (reason, seen)
+    return pairs
+
+def refresh_closer_leads(lead_ids):
+    """Recomputes the portfolio pairs of the given leads. Does not commit. Returns pairs written or removed."""
+    lead_ids = list({lead_id for lead_id in lead_ids if lead_id})
+    if not lead_ids:
+        return 0
+    wanted = portfolio_pairs(lead_ids)
+    current = {
+        (closer_id, lead_id): reason
+        for closer_id, lead_id, reason in db.session.query(
+            CloserLead.closer_id, CloserLead.lead_id, CloserLead.reason
+        ).filter(CloserLead.lead_id.in_(lead_ids))
+    }
+
+    stale = {}
+    for closer_id, lead_id in current.keys() - wanted.keys():
+        stale.setdefault(lead_id, []).append(closer_id)
+    for lead_id, closer_ids in stale.items():
+        CloserLead.query.filter(
+            CloserLead.lead_id == lead_id, CloserLead.closer_id.in_(closer_ids)
+        ).delete(synchronize_session=False)
+
+    now = datetime.utcnow()
+    new = [
+        {'closer_id': closer_id, 'lead_id': lead_id, 'reason': reason, 'first_seen': seen or now}
+        for (closer_id, lead_id), (reason, seen) in wanted.items() if (closer_id, lead_id) not in current
+    ]
+    if new:
+        db.session.execute(insert(CloserLead), new)
+
+    changed = [key for key, (reason, _) in wanted.items() if key in current and current[key] != reason]
+    for closer_id, lead_id in changed:
+        CloserLead.query.filter_by(closer_id=closer_id, lead_id=lead_id).update(
+            {'reason': wanted[(closer_id, lead_id)][0]}, synchronize_session=False
+        )
+    return sum(len(ids) for ids in stale.values()) + len(new) + len(changed)
+
+def rebuild_closer_leads(batch_size=1000):
+    """Rebuilds the whole table from the source tables and commits. Returns the number of pairs."""
+    CloserLead.query.delete(synchronize_session=False)
+    now = datetime.utcnow()
+    rows = [
+        {'closer_id': closer_id, 'lead_id': lead_id, 'reason': reason, 'first_seen': seen or now}
+        for (closer_id, lead_id), (reason, seen) in portfolio_pairs().items()
+    ]
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(insert(CloserLead), rows[i:i + batch_size])
+    db.session.commit()
+    return len(rows)
+
+def portfolio_leads(closer_id, query=None):
+    """query (default User.query) restricted to the closer's portfolio with one indexed join."""
+    query = User.query if query is None else query
+    return query.join(CloserLead, CloserLead.lead_id == User.id).filter(CloserLead.closer_id == closer_id)
+
+# --- Write events ---
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_portfolio_leads(session, flush_context, instances):
+    pending = session.info.setdefault('portfolio_leads', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        fields = TRACKED_FIELDS.get(type(obj))
+        if not fields:
+            continue
+        state = inspect(obj)
+        if obj in session.dirty and not any(state.attrs[f].history.has_changes() for f in fields):
+            continue
+        lead_field = fields[0]
+        pending.add(getattr(obj, lead_field))
+        pending.update(state.attrs[lead_field].history.deleted)
+
+@event.listens_for(db.session, 'before_commit')
+def _refresh_portfolio_leads(session):
+    session.flush()
+    pending = session.info.pop('portfolio_leads', None)
+    if pending:
+        refresh_closer_leads(pending)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_portfolio_leads(session):
+    session.info.pop('portfolio_leads', None)
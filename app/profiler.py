@@ -0,0 +1,167 @@
+"""
+Opt-in per-request SQL profiler (SQL_PROFILER=1).
+
+Hooks before/after_cursor_execute on every engine and records, for each
+request, the number of statements, the total DB time and the slowest
+statements. Statements are grouped by shape (the SQL text with IN-lists
+collapsed, parameters are already out of it); a shape run
+SQL_PROFILER_N_PLUS_ONE times or more in one request is flagged as an N+1
+suspect, with the template or app line that issued its first repeat.
+
+Every profiled response gets an X-SQL-Profile header. Summaries are kept in
+memory for SQL_PROFILER_WINDOW seconds and listed by endpoint in the admin
+page (admin.sql_profile). The window is per process: with several workers
+each one shows its own requests.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(APP_DIR)
+HEADER = 'X-SQL-Profile'
+MAX_ENTRIES = 10000 # Requests kept, whatever the window
+
+# "(?, ?, ?)" / "(%(id_1_1)s, %(id_1_2)s)" -> "(?)", so IN-lists of any length share a shape
+IN_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s)(?:\s*,\s*(?:\?|%s|%\(\w+\)s))+\s*\)')
+
+_window = deque()
+_window_lock = threading.Lock()
+
+def statement_shape(statement):
+    return IN_LIST.sub('(?)', ' '.join(statement.split()))
+
+def _origin():
+    """The innermost template line or app line (outside this module) on the stack."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return f"{template.name}:{template.get_corresponding_lineno(frame.f_lineno)}"
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename != __file__:
+            return f"{os.path.relpath(filename, ROOT_DIR)}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return None
+
+class RequestProfile:
+    """Statements of one request."""
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = {} # shape -> [count, seconds, origin of the first repeat]
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        shape = statement_shape(statement)
+        stats = self.shapes.setdefault(shape, [0, 0.0, None])
+        stats[0] += 1
+        stats[1] += seconds
+        if stats[0] == 2:
+            # Only repeats pay for the stack walk
+            stats[2] = _origin()
+
+    def slowest(self, limit):
+        """[(shape, count, ms)] of the shapes that took the most time."""
+        ranked = sorted(self.shapes.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [(shape, count, seconds * 1000) for shape, (count, seconds, _) in ranked]
+
+    def suspects(self, threshold):
+        """[(shape, count, origin)] of the shapes run threshold times or more."""
+        repeated = [(shape, count, origin) for shape, (count, _, origin) in self.shapes.items() if count >= threshold]
+        return sorted(repeated, key=lambda suspect: suspect[1], reverse=True)
+
+def _current():
+    return g.get('sql_profile') if has_request_context() else None
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        conn.info.setdefault('sql_profile_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current()
+    started = conn.info.get('sql_profile_started')
+    if profile is not None and started:
+        profile.record(statement, time.perf_counter() - started.pop())
+
+def _record(entry, window):
+    with _window_lock:
+        _window.append(entry)
+        cutoff = entry['at'] - window
+        while _window and (_window[0]['at'] < cutoff or len(_window) > MAX_ENTRIES):
+            _window.popleft()
+
+def endpoint_summary(window):
+    """
+    Requests of the last window seconds grouped by endpoint, worst (most DB
+    time) first: requests, avg/max queries, avg/max DB ms, the slowest
+    statement shapes and the N+1 suspects seen.
+    """
+    cutoff = time.time() - window
+    with _window_lock:
+        entries = [entry for entry in _window if entry['at'] >= cutoff]
+
+    endpoints = {}
+    for entry in entries:
+        summary = endpoints.setdefault(entry['endpoint'], {
+            'endpoint': entry['endpoint'], 'requests': 0, 'queries': 0, 'max_queries': 0,
+            'db_ms': 0.0, 'max_db_ms': 0.0, 'slowest': {}, 'suspects': {}
+        })
+        summary['requests'] += 1
+        summary['queries'] += entry['queries']
+        summary['max_queries'] = max(summary['max_queries'], entry['queries'])
+        summary['db_ms'] += entry['db_ms']
+        summary['max_db_ms'] = max(summary['max_db_ms'], entry['db_ms'])
+        for shape, count, ms in entry['slowest']:
+            summary['slowest'][shape] = max(summary['slowest'].get(shape, 0.0), ms)
+        for shape, count, origin in entry['suspects']:
+            key = (shape, origin)
+            summary['suspects'][key] = max(summary['suspects'].get(key, 0), count)
+
+    for summary in endpoints.values():
+        summary['avg_queries'] = summary['queries'] / summary['requests']
+        summary['avg_db_ms'] = summary['db_ms'] / summary['requests']
+        summary['slowest'] = sorted(summary['slowest'].items(), key=lambda item: item[1], reverse=True)[:5]
+        summary['suspects'] = sorted(
+            [(shape, origin, count) for (shape, origin), count in summary['suspects'].items()],
+            key=lambda suspect: suspect[2], reverse=True
+        )
+    return sorted(endpoints.values(), key=lambda summary: summary['db_ms'], reverse=True)
+
+def init_app(app):
+    if not app.config.get('SQL_PROFILER'):
+        return
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def _start_profile():
+        if request.endpoint != 'static':
+            g.sql_profile = RequestProfile()
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = g.pop('sql_profile', None)
+        if profile is None:
+            return response
+
+        suspects = profile.suspects(app.config.get('SQL_PROFILER_N_PLUS_ONE', 5))
+        response.headers[HEADER] = f"queries={profile.count}; db_ms={profile.seconds * 1000:.1f}; n_plus_one={len(suspects)}"
+        _record({
+            'at': time.time(),
+            'endpoint': request.endpoint or request.path,
+            'queries': profile.count,
+            'db_ms': profile.seconds * 1000,
+            'slowest': profile.slowest(app.config.get('SQL_PROFILER_SLOWEST', 5)),
+            'suspects': suspects
+        }, app.config.get('SQL_PROFILER_WINDOW', 3600))
+        return response
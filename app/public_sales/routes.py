@@ -2,9 +2,8 @@ from flask import render_template, redirect, url_for, flash, request, current_ap
 from app.public_sales import bp
 from app.public_sales.forms import EmailLookupForm, NewClientForm, PublicSaleForm, PublicPaymentForm
 from app.models import User, LeadProfile, Enrollment, Program, PaymentMethod, Payment, db
-from app.closer.utils import send_sales_webhook
+from app.closer.utils import queue_sales_webhook
 from datetime import datetime
-import uuid
 
 def get_closer_or_404(username):
     closer = User.query.filter_by(username=username).first()
@@ -69,9 +68,8 @@ def create_client(closer_username):
             return redirect(url_for('public_sales.lookup', closer_username=closer_username))
 
         # Create User
-        temp_pass = str(uuid.uuid4())
         user = User(username=form.username.data, email=form.email.data, role='lead')
-        user.set_password(temp_pass)
+        user.set_unusable_password()
         db.session.add(user)
         db.session.flush()
 
@@ -133,6 +131,7 @@ def new_sale(closer_username, user_id):
             status='completed',
             date=datetime.utcnow()
         )
+        payment.snapshot_fees()
         db.session.add(payment)
         
         # 3. Update User Role & Status
@@ -150,11 +149,11 @@ def new_sale(closer_username, user_id):
         else:
             profile.status = 'pending'
             
+        enrollment.update_balance()
+        # Webhook (queued with the sale, delivered by the worker)
+        queue_sales_webhook(payment, closer.username)
         db.session.commit()
         
-        # Webhook
-        send_sales_webhook(payment, closer.username)
-        
         return render_template('public_sales/success.html', message="Venta registrada correctamente!", closer=closer)
 
     return render_template('public_sales/new_sale.html', form=form, closer=closer, user=user)
@@ -186,19 +185,17 @@ def add_payment(closer_username, user_id):
             status='completed',
             date=datetime.utcnow()
         )
+        if payment.is_duplicate():
+            flash('Este pago ya fue registrado (mismo monto, tipo y día).')
+            return redirect(url_for('public_sales.add_payment', closer_username=closer_username, user_id=user.id))
+        payment.snapshot_fees()
         db.session.add(payment)
         
         # Status Update Logic
-        # Calculate total paid
-        db.session.flush()
-        total_paid = db.session.query(db.func.sum(Payment.amount)).filter(
-            Payment.enrollment_id == active_enrollment.id,
-            Payment.status == 'completed'
-        ).scalar() or 0
+        # Refresh the stored balance (includes the payment just added)
+        active_enrollment.update_balance()
         
-        agreed = active_enrollment.total_agreed or active_enrollment.program.price
-        
-        if total_paid >= agreed:
+        if active_enrollment.outstanding <= 0:
             if user.lead_profile:
                 user.lead_profile.status = 'completed'
                 db.session.add(user.lead_profile)
@@ -208,11 +205,10 @@ def add_payment(closer_username, user_id):
                 user.lead_profile.status = 'renewed'
                 db.session.add(user.lead_profile)
 
+        # Webhook (queued with the payment, delivered by the worker)
+        queue_sales_webhook(payment, closer.username)
         db.session.commit()
         
-        # Webhook
-        send_sales_webhook(payment, closer.username)
-        
         return render_template('public_sales/success.html', message="Pago registrado correctamente!", closer=closer)
         
     # Get payments history for display
@@ -0,0 +1,246 @@
+from datetime import datetime
+from flask import current_app, abort
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.orm import joinedload, contains_eager
+from app import db
+from app.search import search_filter
+from app.models import User, LeadProfile, Enrollment, Program, normalize_phone, normalize_instagram
+
+def load_lead_rows(user_ids):
+    """
+    Loads the data the leads list rows need for a page of users, in two queries
+    (users + profiles, enrollments + programs) regardless of page size.
+
+    Returns a list of dicts in the same order as user_ids.
+    """
+    if not user_ids:
+        return []
+
+    rows = {}
+    users = db.session.query(
+        User.id, User.username, User.email, User.role, User.created_at,
+        LeadProfile.id, LeadProfile.phone, LeadProfile.instagram, LeadProfile.status
+    ).outerjoin(LeadProfile, LeadProfile.user_id == User.id).filter(User.id.in_(user_ids)).all()
+
+    for user_id, username, email, role, created_at, profile_id, phone, instagram, status in users:
+        rows[user_id] = {
+            'id': user_id,
+            'username': username,
+            'email': email,
+            'role': role,
+            'created_at': created_at,
+            'has_profile': profile_id is not None,
+            'phone': phone,
+            'instagram': instagram,
+            'status': status,
+            'programs': [],
+            'total_paid': 0.0,
+            'debt': 0.0
+        }
+
+    enrollments = db.session.query(
+        Enrollment.student_id, Program.name, Enrollment.status, Enrollment.paid_total, Enrollment.outstanding
+    ).join(Program, Enrollment.program_id == Program.id).filter(
+        Enrollment.student_id.in_(user_ids)
+    ).order_by(Enrollment.id).all()
+
+    for student_id, program_name, status, paid_total, outstanding in enrollments:
+        row = rows[student_id]
+        row['programs'].append(program_name)
+        row['total_paid'] += paid_total or 0.0
+        # Debt only counts ACTIVE enrollments (same rule as User.current_active_debt)
+        if status == 'active':
+            row['debt'] += outstanding or 0.0
+
+    return [rows[uid] for uid in user_ids if uid in rows]
+
+# Shorter keys ('0', '123', '@a') are placeholders or typos, not enough to tell two leads are one
+MIN_PHONE_DIGITS = 7
+MIN_HANDLE_LENGTH = 3
+
+def match_leads_by_contact(phones=(), handles=()):
+    """
+    Existing users with any of the given phones / Instagram handles (raw
+    values, normalized here), in at most two index lookups. Returns
+    ({phone key: user_id}, {handle key: user_id}); the oldest profile wins.
+    Keys shorter than MIN_PHONE_DIGITS / MIN_HANDLE_LENGTH never match.
+    """
+    phone_keys = {key for key in map(normalize_phone, phones) if key and len(key) >= MIN_PHONE_DIGITS}
+    handle_keys = {key for key in map(normalize_instagram, handles) if key and len(key) >= MIN_HANDLE_LENGTH}
+    by_phone, by_handle = {}, {}
+    if phone_keys:
+        for key, user_id in db.session.query(LeadProfile.phone_normalized, LeadProfile.user_id).filter(
+            LeadProfile.phone_normalized.in_(phone_keys)
+        ).order_by(LeadProfile.id.desc()):
+            by_phone[key] = user_id
+    if handle_keys:
+        for key, user_id in db.session.query(LeadProfile.instagram_normalized, LeadProfile.user_id).filter(
+            LeadProfile.instagram_normalized.in_(handle_keys)
+        ).order_by(LeadProfile.id.desc()):
+            by_handle[key] = user_id
+    return by_phone, by_handle
+
+def possible_duplicate_note(user_id):
+    """LeadProfile.notes of a new lead whose phone or Instagram belongs to lead user_id."""
+    return f"Posible duplicado del lead #{user_id} (mismo teléfono o Instagram)."
+
+def enrollment_debt_columns():
+    """
+    SQL expressions for an enrollment's agreed amount, paid amount and debt.
+    Agreed falls back to Program.price when total_agreed is NULL, and debt is
+    max(agreed - paid, 0) written as CASE so it runs on SQLite and PostgreSQL.
+    Requires Program to be joined.
+    """
+    agreed = db.func.coalesce(Enrollment.total_agreed, Program.price, 0.0)
+    paid = db.func.coalesce(Enrollment.paid_total, 0.0)
+    debt = db.case((agreed > paid, agreed - paid), else_=0.0)
+    return agreed, paid, debt
+
+def outstanding_debt_query(closer_id=None, search=None, program_id=None, status=None, start_date=None, end_date=None, user_ids=None):
+    """
+    The aggregate query of outstanding_debt (columns debt, debt_agreed,
+    debt_paid), to run or embed as a subquery. user_ids (a SELECT of user
+    ids, e.g. a filter CTE) restricts it to those students.
+    """
+    agreed, paid, debt = enrollment_debt_columns()
+    has_debt = agreed > paid
+
+    query = db.session.query(
+        db.func.coalesce(db.func.sum(debt), 0.0).label('debt'),
+        db.func.coalesce(db.func.sum(db.case((has_debt, agreed), else_=0.0)), 0.0).label('debt_agreed'),
+        db.func.coalesce(db.func.sum(db.case((has_debt, paid), else_=0.0)), 0.0).label('debt_paid')
+    ).select_from(Enrollment).join(
+        Program, Enrollment.program_id == Program.id
+    ).join(
+        User, Enrollment.student_id == User.id
+    ).filter(Enrollment.status == 'active')
+
+    if closer_id:
+        query = query.filter(Enrollment.closer_id == closer_id)
+    if program_id:
+        query = query.filter(Enrollment.program_id == program_id)
+    if status:
+        query = query.join(LeadProfile, LeadProfile.user_id == User.id).filter(LeadProfile.status == status)
+    if start_date:
+        query = query.filter(User.created_at >= start_date)
+    if end_date:
+        query = query.filter(User.created_at < end_date)
+    if search:
+        query = query.filter(search_filter(search))
+    if user_ids is not None:
+        query = query.filter(Enrollment.student_id.in_(user_ids))
+    return query
+
+def outstanding_debt(closer_id=None, search=None, program_id=None, status=None, start_date=None, end_date=None):
+    """
+    Aggregates outstanding debt of ACTIVE enrollments in one query.
+
+    Filters mirror the list pages: closer (Enrollment.closer_id), search (see
+    app/search.py), program, LeadProfile.status and User.created_at range
+    (start_date inclusive, end_date exclusive; both datetimes).
+
+    Returns {'debt', 'debt_agreed', 'debt_paid'}, where agreed/paid only count
+    enrollments that still have debt.
+    """
+    total_debt, debt_agreed, debt_paid = outstanding_debt_query(
+        closer_id=closer_id, search=search, program_id=program_id, status=status,
+        start_date=start_date, end_date=end_date
+    ).one()
+    return {
+        'debt': total_debt,
+        'debt_agreed': debt_agreed,
+        'debt_paid': debt_paid
+    }
+
+def debtors(closer_id=None, limit=5, offset=0):
+    """
+    Active enrollments that still owe money, largest debt first, in one
+    ordered/limited query. Pass closer_id to scope to a closer's sales, or
+    None for the whole company (admin). Use offset to page through the full
+    receivables list.
+
+    Returns a list of dicts: student, program, total_agreed, total_paid, debt.
+    """
+    agreed, paid, debt = enrollment_debt_columns()
+
+    query = db.session.query(Enrollment, agreed, paid, debt).join(
+        Program, Enrollment.program_id == Program.id
+    ).options(
+        joinedload(Enrollment.student), contains_eager(Enrollment.program)
+    ).filter(
+        Enrollment.status == 'active',
+        agreed > paid
+    )
+
+    if closer_id:
+        query = query.filter(Enrollment.closer_id == closer_id)
+
+    rows = query.order_by(debt.desc(), Enrollment.id).offset(offset).limit(limit).all()
+
+    return [{
+        'enrollment': enrollment,
+        'student': enrollment.student,
+        'program': enrollment.program,
+        'total_agreed': total_agreed,
+        'total_paid': total_paid,
+        'debt': enrollment_debt
+    } for enrollment, total_agreed, total_paid, enrollment_debt in rows]
+
+def _cursor_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='list-cursor')
+
+def _after(order, values):
+    """Rows strictly after values in the given order."""
+    directions = {descending for _, descending in order}
+    if len(directions) == 1:
+        # Row-value comparison, which PostgreSQL (and SQLite) can answer from a composite index
+        columns = tuple_(*[column for column, _ in order])
+        return columns < tuple_(*values) if directions.pop() else columns > tuple_(*values)
+    conditions = []
+    for i, (column, descending) in enumerate(order):
+        ties = [order[j][0] == values[j] for j in range(i)]
+        conditions.append(and_(*ties, column < values[i] if descending else column > values[i]))
+    return or_(*conditions)
+
+def keyset_page(query, order, per_page, cursor=None):
+    """
+    One page of query in keyset order: no OFFSET (deep pages cost the same as
+    the first) and no COUNT.
+
+    order is a list of (column or expression, descending) ending in a unique
+    column (the id) so every row has a distinct position; sort keys must not
+    be NULL (coalesce nullable columns). The keys are read back from the
+    query, so expressions work as well as plain columns.
+    cursor is the opaque token returned for the previous page (None gives the
+    first page); one that doesn't verify or decode aborts with 400 rather
+    than silently starting over.
+
+    Returns (rows, next_cursor, start_index): next_cursor is None on the last
+    page and start_index is the number of rows on previous pages.
+    """
+    start_index = 0
+    if cursor:
+        try:
+            state = _cursor_serializer().loads(cursor)
+            values = [
+                datetime.fromisoformat(value) if column.type.python_type is datetime else value
+                for (column, _), value in zip(order, state['v'], strict=True)
+            ]
+            start_index = state['n']
+        except (BadSignature, KeyError, TypeError, ValueError):
+            abort(400, 'Cursor de paginación inválido')
+        query = query.filter(_after(order, values))
+
+    rows = query.add_columns(*[column for column, _ in order]).order_by(
+        *[column.desc() if descending else column.asc() for column, descending in order]
+    ).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        values = rows[per_page - 1][1:]
+        next_cursor = _cursor_serializer().dumps({
+            'v': [value.isoformat() if isinstance(value, datetime) else value for value in values],
+            'n': start_index + per_page
+        })
+    return [row[0] for row in rows[:per_page]], next_cursor, start_index
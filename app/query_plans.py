@@ -0,0 +1,188 @@
+"""
+Query-plan regression checks for the hot queries of the closer and booking
+pages (run with `flask check-query-plans`, e.g. in CI after migrating).
+
+Each query in HOT_QUERIES lists the tables it must reach through an index.
+The check runs EXPLAIN QUERY PLAN (SQLite) or EXPLAIN with sequential scans
+disabled (PostgreSQL, so a Seq Scan means no usable index rather than a small
+table) and reports every full scan of one of those tables. Queries are built
+with the same helpers the views use where they exist, so a change to a helper
+that loses its index shows up here too. Nothing is executed besides EXPLAIN.
+"""
+import re
+from datetime import datetime, timedelta
+from sqlalchemy import event, select
+from app import db
+from app.models import User, LeadProfile, Enrollment, Payment, Appointment, Availability, SurveyAnswer
+from app.filters import FilterSpec, LEAD_SORTS, SALE_ORDER, lead_ids_cte, lead_page_query, payment_ids_cte, sale_page_query
+from app.queries import outstanding_debt_query
+from app.portfolio import portfolio_leads
+
+CLOSER_ID = 1 # Sample values; plans don't depend on them
+LEAD_ID = 1
+
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+ALIAS_SUFFIX = re.compile(r'_\d+$') # ORM aliases (enrollments_1) are reported by alias
+
+def _closer_appointments():
+    # Dashboard / calendar: a closer's appointments in a time range
+    now = datetime.utcnow()
+    return select(db.func.count(Appointment.id)).where(
+        Appointment.closer_id == CLOSER_ID,
+        Appointment.start_time >= now - timedelta(days=30),
+        Appointment.start_time <= now,
+        Appointment.status == 'completed'
+    )
+
+def _upcoming_appointments():
+    return select(Appointment).where(
+        Appointment.closer_id == CLOSER_ID,
+        Appointment.start_time >= datetime.utcnow(),
+        Appointment.status == 'scheduled'
+    ).order_by(Appointment.start_time).limit(20)
+
+def _lead_appointments():
+    # Lead detail
+    return select(Appointment).where(Appointment.lead_id == LEAD_ID).order_by(Appointment.start_time.desc())
+
+def _closer_enrollments():
+    # Dashboard: sales of the month
+    now = datetime.utcnow()
+    return select(Enrollment).where(
+        Enrollment.closer_id == CLOSER_ID,
+        Enrollment.enrollment_date >= now - timedelta(days=30),
+        Enrollment.enrollment_date <= now,
+        Enrollment.status != 'dropped'
+    )
+
+def _student_payments():
+    # Enrollment.update_balance and the lead rows loader
+    return select(db.func.sum(Payment.amount)).join(Enrollment, Payment.enrollment_id == Enrollment.id).where(
+        Enrollment.student_id == LEAD_ID,
+        Payment.status == 'completed'
+    )
+
+def _closer_availability():
+    # Calendar week
+    today = datetime.utcnow().date()
+    return select(Availability).where(
+        Availability.closer_id == CLOSER_ID,
+        Availability.date >= today,
+        Availability.date <= today + timedelta(days=6)
+    )
+
+def _survey_answer():
+    # Booking survey: the lead's previous answer to a question
+    return select(SurveyAnswer).where(SurveyAnswer.lead_id == LEAD_ID, SurveyAnswer.question_id == 1).limit(1)
+
+def _assigned_pending():
+    # Dashboard: pending follow-ups
+    return select(db.func.count(LeadProfile.id)).where(
+        LeadProfile.assigned_closer_id == CLOSER_ID,
+        LeadProfile.status == 'pending'
+    )
+
+def _leads_by_source():
+    return select(LeadProfile.user_id).where(LeadProfile.utm_source == 'workshop')
+
+def _leads_page():
+    base = lead_ids_cte(FilterSpec(status='pending'), closer_id=CLOSER_ID)
+    return _ordered(lead_page_query(base), LEAD_SORTS['newest'])
+
+def _sales_page():
+    base = payment_ids_cte(FilterSpec(), closer_id=CLOSER_ID)
+    return _ordered(sale_page_query(base), SALE_ORDER)
+
+def _closer_debt():
+    return outstanding_debt_query(closer_id=CLOSER_ID)
+
+def _recent_clients():
+    return portfolio_leads(CLOSER_ID).order_by(User.created_at.desc()).limit(15)
+
+def _ordered(query, order):
+    return query.order_by(*[column.desc() if descending else column for column, descending in order]).limit(50)
+
+# name -> (statement builder, tables that must not be fully scanned)
+HOT_QUERIES = {
+    'closer_appointments_range': (_closer_appointments, ['appointments']),
+    'closer_upcoming_appointments': (_upcoming_appointments, ['appointments']),
+    'lead_appointments': (_lead_appointments, ['appointments']),
+    'closer_enrollments_range': (_closer_enrollments, ['enrollments']),
+    'student_completed_payments': (_student_payments, ['enrollments', 'payments']),
+    'closer_availability_week': (_closer_availability, ['availability']),
+    'lead_survey_answer': (_survey_answer, ['survey_answers']),
+    'assigned_pending_leads': (_assigned_pending, ['lead_profiles']),
+    'leads_by_utm_source': (_leads_by_source, ['lead_profiles']),
+    'closer_leads_page': (_leads_page, ['closer_leads', 'lead_profiles']),
+    'closer_sales_page': (_sales_page, ['enrollments', 'payments']),
+    'closer_outstanding_debt': (_closer_debt, ['enrollments']),
+    'closer_recent_clients': (_recent_clients, ['closer_leads']),
+}
+
+def _statement(query):
+    return query.statement if hasattr(query, 'statement') else query
+
+def explain(statement):
+    """
+    Plan rows of statement on the current database. Only EXPLAIN is run (the
+    statement itself is not); ends the current transaction.
+    """
+    dialect = db.session.get_bind().dialect.name
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN (FORMAT JSON) '
+    conn = db.session.connection()
+    plan = []
+
+    def _explain(conn, cursor, sql, parameters, context, executemany):
+        return prefix + sql, parameters
+
+    def _capture(conn, cursor, sql, parameters, context, executemany):
+        # Read the plan straight from the cursor, before the result maps it to the statement's columns
+        plan.extend(cursor.fetchall())
+
+    if dialect == 'postgresql':
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    event.listen(conn, 'before_cursor_execute', _explain, retval=True)
+    event.listen(conn, 'after_cursor_execute', _capture)
+    try:
+        conn.execute(_statement(statement))
+    finally:
+        event.remove(conn, 'before_cursor_execute', _explain)
+        event.remove(conn, 'after_cursor_execute', _capture)
+        db.session.rollback()
+    return plan
+
+def _pg_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _pg_nodes(child)
+
+def full_scans(plan, dialect):
+    """(table, plan line) of every full table scan in plan."""
+    scans = []
+    if dialect == 'sqlite':
+        for row in plan:
+            detail = row[-1]
+            match = SQLITE_SCAN.match(detail)
+            if match:
+                scans.append((ALIAS_SUFFIX.sub('', match.group(1)), detail))
+    else:
+        for (document,) in plan:
+            for node in _pg_nodes(document[0]['Plan']):
+                if node['Node Type'] == 'Seq Scan':
+                    scans.append((node['Relation Name'], f"Seq Scan on {node['Relation Name']}"))
+    return scans
+
+def check_query_plans():
+    """
+    EXPLAINs every hot query. Returns a list of (name, plan lines, regressions),
+    where regressions are the full scans of tables the query must search by index.
+    """
+    dialect = db.session.get_bind().dialect.name
+    results = []
+    for name, (build, indexed_tables) in HOT_QUERIES.items():
+        plan = explain(build())
+        scans = full_scans(plan, dialect)
+        lines = [row[-1] for row in plan] if dialect == 'sqlite' else [line for _, line in scans]
+        regressions = [line for table, line in scans if table in indexed_tables]
+        results.append((name, lines, regressions))
+    return results
@@ -0,0 +1,121 @@
+"""
+Sales webhook delivery.
+
+Sales are queued in sales_webhook_events with the payment (see
+queue_sales_webhook in app/closer/utils.py). `flask sales-webhook-worker`
+delivers them over a pooled HTTP session, optionally several per POST
+(SALES_WEBHOOK_BATCH_SIZE), retries with exponential backoff and parks
+events that keep failing as 'dead' for the admin dead-letter view.
+"""
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models import SalesWebhookEvent, Integration
+
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 60 * 60
+MAX_ATTEMPTS = 10
+
+_http = None
+
+def get_http_session():
+    """One keep-alive connection pool per process."""
+    global _http
+    if _http is None:
+        _http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0) # Retries are ours
+        _http.mount('http://', adapter)
+        _http.mount('https://', adapter)
+    return _http
+
+def get_sales_webhook_url():
+    """Active URL from the 'sales' Integration, falling back to VENTAS_WEBHOOK."""
+    integration = Integration.query.filter_by(key='sales').first()
+    webhook_url = None
+    if integration:
+        webhook_url = integration.url_prod if integration.active_env == 'prod' else integration.url_dev
+    return webhook_url or current_app.config.get('VENTAS_WEBHOOK')
+
+def retry_delay(attempts):
+    """Exponential backoff: 30s, 60s, 120s... capped at 1h."""
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+def _post(webhook_url, events, timeout):
+    if len(events) == 1:
+        body = json.loads(events[0].payload) # Same body n8n always received
+        key = events[0].idempotency_key
+    else:
+        body = {'events': [json.loads(e.payload) for e in events]}
+        key = 'batch-' + '-'.join(str(e.id) for e in events)
+    response = get_http_session().post(webhook_url, json=body, headers={'Idempotency-Key': key}, timeout=timeout)
+    response.raise_for_status()
+
+def deliver_sales_webhooks(limit=100):
+    """
+    Delivers due pending events (up to limit). Returns (sent, failed).
+    Without a configured URL nothing is sent and events stay queued.
+    """
+    webhook_url = get_sales_webhook_url()
+    if not webhook_url:
+        current_app.logger.warning("Sales Webhook URL not configured (DB or Config).")
+        return 0, 0
+
+    batch_size = max(1, current_app.config.get('SALES_WEBHOOK_BATCH_SIZE', 1))
+    timeout = current_app.config.get('SALES_WEBHOOK_TIMEOUT', 5)
+    now = datetime.utcnow()
+    events = SalesWebhookEvent.query.filter(
+        SalesWebhookEvent.status == 'pending',
+        SalesWebhookEvent.next_attempt_at <= now
+    ).order_by(SalesWebhookEvent.id).limit(limit).all()
+
+    sent = failed = 0
+    for i in range(0, len(events), batch_size):
+        chunk = events[i:i + batch_size]
+        try:
+            _post(webhook_url, chunk, timeout)
+        except Exception as e:
+            failed += len(chunk)
+            for event in chunk:
+                event.attempts = (event.attempts or 0) + 1
+                event.last_error = str(e)[:2000]
+                if event.attempts >= MAX_ATTEMPTS:
+                    event.status = 'dead'
+                else:
+                    event.next_attempt_at = now + retry_delay(event.attempts)
+            current_app.logger.error(f"Sales webhook failed for {len(chunk)} event(s): {e}")
+        else:
+            sent += len(chunk)
+            for event in chunk:
+                event.status = 'sent'
+                event.sent_at = datetime.utcnow()
+                event.last_error = None
+        db.session.commit()
+
+    return sent, failed
+
+def retry_dead_events(event_ids=None):
+    """Puts dead events (all, or the given ids) back in the queue. Returns how many."""
+    query = SalesWebhookEvent.query.filter_by(status='dead')
+    if event_ids:
+        query = query.filter(SalesWebhookEvent.id.in_(event_ids))
+    count = query.update({
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+def run_sales_webhook_worker(interval=5, once=False):
+    """Delivers forever (or once), sleeping when nothing was due."""
+    while True:
+        sent, failed = deliver_sales_webhooks()
+        db.session.remove()
+        if once:
+            return sent, failed
+        if not sent:
+            time.sleep(interval)
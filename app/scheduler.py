@@ -0,0 +1,108 @@
+"""
+In-process scheduler for short periodic jobs.
+
+Each web process starts one daemon thread on its first request (CLI commands
+and the workers never serve requests, so they don't run it). Every
+SCHEDULER_TICK seconds the thread looks at the jobs below; a job runs when its
+interval has passed since the last run of ANY process, under a lock held in
+its job_watermarks row, so several gunicorn workers never run it twice. Jobs
+are bounded in time so they never hold a connection for long.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import JobWatermark
+
+def _status_transitions(app):
+    from app.statuses import run_status_transitions
+    return run_status_transitions(
+        max_seconds=app.config.get('STATUS_TRANSITIONS_MAX_SECONDS', 5),
+        batch_size=app.config.get('STATUS_TRANSITIONS_BATCH_SIZE', 200)
+    )
+
+# name -> (interval config key, job); an interval of 0 disables the job
+JOBS = {
+    'lead_status_transitions': ('STATUS_TRANSITIONS_INTERVAL', _status_transitions),
+}
+
+LOCK_SECONDS = 300 # A crashed run frees the job after this long
+
+_thread = None
+_thread_lock = threading.Lock()
+
+def acquire_job(name, interval, ttl):
+    """
+    Takes the job's lock if it is due (not run in the last interval seconds)
+    and nobody holds it. Commits. Returns True if this process should run it.
+    """
+    if not db.session.get(JobWatermark, name):
+        db.session.add(JobWatermark(name=name))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback() # Another process created it first
+
+    now = datetime.utcnow()
+    claimed = JobWatermark.query.filter(
+        JobWatermark.name == name,
+        or_(JobWatermark.locked_until.is_(None), JobWatermark.locked_until < now),
+        or_(JobWatermark.last_run_at.is_(None), JobWatermark.last_run_at <= now - timedelta(seconds=interval))
+    ).update({'locked_until': now + timedelta(seconds=ttl)}, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+def release_job(name):
+    JobWatermark.query.filter_by(name=name).update(
+        {'locked_until': None, 'last_run_at': datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+
+def run_due_jobs(app, force=False):
+    """Runs every enabled job that is due (or all of them with force). Returns {name: result}."""
+    results = {}
+    for name, (interval_key, job) in JOBS.items():
+        interval = app.config.get(interval_key, 0)
+        if not interval and not force:
+            continue
+        if not acquire_job(name, 0 if force else interval, LOCK_SECONDS):
+            continue
+        try:
+            results[name] = job(app)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Scheduled job {name} failed: {e}")
+        finally:
+            release_job(name)
+    return results
+
+def _loop(app):
+    while True:
+        time.sleep(app.config.get('SCHEDULER_TICK', 30))
+        with app.app_context():
+            try:
+                run_due_jobs(app)
+            except Exception as e:
+                app.logger.error(f"Scheduler tick failed: {e}")
+            finally:
+                db.session.remove()
+
+def start_scheduler(app):
+    """Starts this process's scheduler thread once (no-op when every job is disabled)."""
+    global _thread
+    if _thread is not None or not any(app.config.get(key, 0) for key, _ in JOBS.values()):
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_loop, args=(app,), name='scheduler', daemon=True)
+            _thread.start()
+
+def init_app(app):
+    if app.testing:
+        return
+
+    @app.before_request
+    def _start_scheduler():
+        start_scheduler(app)
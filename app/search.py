@@ -0,0 +1,152 @@
+"""
+Lead search across username, email, phone and Instagram.
+
+One API for the lead lists and the sale-form autocomplete, backed by an
+index on each database:
+- SQLite: FTS5 table lead_search (rowid = users.id) with the trigram
+  tokenizer, kept in sync by triggers on users and lead_profiles, so bulk
+  writes (imports) are covered too.
+- PostgreSQL: pg_trgm GIN indexes on the four columns, which ILIKE '%term%'
+  uses; Postgres maintains them itself. Results are ranked by similarity().
+Terms shorter than 3 characters have no trigrams and fall back to a plain
+ILIKE scan. Phone-like terms and @handles also probe the normalized lookup
+keys (LeadProfile.phone_normalized / instagram_normalized) by prefix, so
+"591-7000-1234" finds "+591 70001234".
+
+The migration creates the same objects; create_all (local/dev databases)
+gets them from the after_create listener below.
+"""
+import re
+from sqlalchemy import event, select, union, and_, or_, literal_column, text
+from app import db
+from app.models import User, LeadProfile, normalize_phone, normalize_instagram
+
+MIN_INDEXED_LENGTH = 3 # One trigram
+PHONE_TERM = re.compile(r'[\d\s+().-]+')
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS lead_search USING fts5(username, email, phone, instagram, tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_user_insert AFTER INSERT ON users BEGIN
+        INSERT INTO lead_search (rowid, username, email) VALUES (new.id, new.username, new.email);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_user_update AFTER UPDATE OF username, email ON users BEGIN
+        UPDATE lead_search SET username = new.username, email = new.email WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_user_delete AFTER DELETE ON users BEGIN
+        DELETE FROM lead_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_profile_insert AFTER INSERT ON lead_profiles BEGIN
+        UPDATE lead_search SET phone = new.phone, instagram = new.instagram WHERE rowid = new.user_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_profile_update AFTER UPDATE OF phone, instagram ON lead_profiles BEGIN
+        UPDATE lead_search SET phone = new.phone, instagram = new.instagram WHERE rowid = new.user_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_profile_delete AFTER DELETE ON lead_profiles BEGIN
+        UPDATE lead_search SET phone = NULL, instagram = NULL WHERE rowid = old.user_id;
+    END""",
+]
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_email_trgm ON users USING gin (email gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_lead_profiles_phone_trgm ON lead_profiles USING gin (phone gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_lead_profiles_instagram_trgm ON lead_profiles USING gin (instagram gin_trgm_ops)",
+]
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_index(target, connection, **kw):
+    ddl = {'sqlite': SQLITE_DDL, 'postgresql': POSTGRES_DDL}.get(connection.dialect.name, [])
+    for statement in ddl:
+        connection.exec_driver_sql(statement)
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+def _uses_fts(term):
+    return _dialect() == 'sqlite' and len(term) >= MIN_INDEXED_LENGTH
+
+def _fts_match(term):
+    # Quoted: matched as a literal substring (trigram), case-insensitive
+    return literal_column('lead_search').op('MATCH')('"' + term.replace('"', '""') + '"')
+
+def _like(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def _prefix(column, prefix):
+    # A range instead of LIKE 'x%', so the index is used on SQLite and on any PostgreSQL collation
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+def _key_selects(term):
+    """Prefix probes on the normalized phone / handle keys, for terms that look like one."""
+    selects = []
+    phone = normalize_phone(term) if PHONE_TERM.fullmatch(term) else None
+    if phone and len(phone) >= MIN_INDEXED_LENGTH:
+        selects.append(select(LeadProfile.user_id).where(_prefix(LeadProfile.phone_normalized, phone)))
+    handle = normalize_instagram(term) if term.startswith('@') else None
+    if handle:
+        selects.append(select(LeadProfile.user_id).where(_prefix(LeadProfile.instagram_normalized, handle)))
+    return selects
+
+def matching_user_ids(term):
+    """SELECT of the ids of users whose username, email, phone or Instagram contains term."""
+    term = term.strip()
+    if _uses_fts(term):
+        selects = [select(literal_column('rowid')).select_from(text('lead_search')).where(_fts_match(term))]
+    else:
+        # One SELECT per indexed column, so each can use its trigram index
+        like = _like(term)
+        selects = [
+            select(User.id).where(User.username.ilike(like, escape='\\')),
+            select(User.id).where(User.email.ilike(like, escape='\\')),
+            select(LeadProfile.user_id).where(LeadProfile.phone.ilike(like, escape='\\')),
+            select(LeadProfile.user_id).where(LeadProfile.instagram.ilike(like, escape='\\'))
+        ]
+    selects += _key_selects(term)
+    return union(*selects) if len(selects) > 1 else selects[0]
+
+def search_filter(term):
+    """Filter for queries over User: users matching term (see matching_user_ids)."""
+    return User.id.in_(matching_user_ids(term))
+
+def _exact_match(term, profile):
+    """0 for users whose username, email, phone or handle is exactly term, else 1."""
+    conditions = [db.func.lower(User.username) == term.lower(), User.email == term.lower()]
+    phone = normalize_phone(term) if PHONE_TERM.fullmatch(term) else None
+    if phone:
+        conditions.append(profile.c.phone_normalized == phone)
+    handle = normalize_instagram(term)
+    if handle:
+        conditions.append(profile.c.instagram_normalized == handle)
+    return db.case((or_(*conditions), 0), else_=1)
+
+def search_users(term, roles=('lead',), limit=10):
+    """Users matching term, exact matches first, then by match quality (e.g. the sale-form autocomplete)."""
+    term = term.strip()
+    if not term:
+        return []
+
+    profile = LeadProfile.__table__
+    query = User.query.outerjoin(profile, profile.c.user_id == User.id).filter(User.role.in_(roles), search_filter(term))
+    order = [_exact_match(term, profile)]
+    if _uses_fts(term):
+        # bm25 weights: username > email > phone/instagram; lower is better
+        matches = select(
+            literal_column('rowid').label('user_id'),
+            literal_column('bm25(lead_search, 3.0, 2.0, 1.0, 1.0)').label('score')
+        ).select_from(text('lead_search')).where(_fts_match(term)).subquery()
+        query = query.outerjoin(matches, matches.c.user_id == User.id)
+        # Users found only by a normalized key (other formatting) before the text matches
+        order += [matches.c.score.isnot(None), matches.c.score]
+    elif _dialect() == 'postgresql':
+        order.append(db.func.greatest(
+            db.func.similarity(User.username, term),
+            db.func.similarity(User.email, term),
+            db.func.coalesce(db.func.similarity(profile.c.phone, term), 0),
+            db.func.coalesce(db.func.similarity(profile.c.instagram, term), 0)
+        ).desc())
+    else:
+        # Short term: prefix matches on the username first
+        order += [db.case((User.username.ilike(_like(term)[1:], escape='\\'), 0), else_=1), User.username]
+    return query.order_by(*order, User.id).limit(limit).all()
@@ -0,0 +1,220 @@
+"""
+Booking slot index (BookingSlot).
+
+Availability is stored per closer in local date/time; the public calendar needs
+UTC start times minus the booked ones. The index keeps that expansion
+persisted: a week is re-expanded when a closer saves availability, and the
+booked flag follows appointment writes (create, reschedule, cancel) on commit.
+"""
+import pytz
+from datetime import date, datetime, timedelta
+from sqlalchemy import event, inspect, insert, and_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import User, Availability, Appointment, BookingSlot
+from app.stats import get_timezone, day_bounds_utc
+
+def slot_utc(slot_date, start_time, tz):
+    """Naive UTC start of a local availability slot."""
+    return tz.localize(datetime.combine(slot_date, start_time)).astimezone(pytz.UTC).replace(tzinfo=None)
+
+def rebuild_closer_slots(closer_id, start_date, end_date, tz=None):
+    """
+    Re-expands a closer's availability between two local dates (inclusive) into
+    BookingSlot rows, marking the ones that already have an appointment.
+    Does not commit. Returns the number of slots written.
+    """
+    if tz is None:
+        tz = get_timezone(db.session.query(User.timezone).filter(User.id == closer_id).scalar())
+    start_utc = day_bounds_utc(start_date, tz)[0]
+    end_utc = day_bounds_utc(end_date, tz)[1]
+
+    BookingSlot.query.filter(
+        BookingSlot.closer_id == closer_id,
+        BookingSlot.utc_start >= start_utc,
+        BookingSlot.utc_start <= end_utc
+    ).delete(synchronize_session=False)
+
+    availabilities = db.session.query(Availability.date, Availability.start_time).filter(
+        Availability.closer_id == closer_id,
+        Availability.date >= start_date,
+        Availability.date <= end_date
+    ).all()
+    starts = {slot_utc(slot_date, start_time, tz) for slot_date, start_time in availabilities}
+    if not starts:
+        return 0
+
+    booked = {start for (start,) in db.session.query(Appointment.start_time).filter(
+        Appointment.closer_id == closer_id,
+        Appointment.start_time >= start_utc,
+        Appointment.start_time <= end_utc,
+        Appointment.status != 'canceled'
+    )}
+
+    db.session.execute(insert(BookingSlot), [
+        {'closer_id': closer_id, 'utc_start': start, 'is_booked': start in booked}
+        for start in sorted(starts)
+    ])
+    return len(starts)
+
+def rebuild_all_slots(closer_id=None):
+    """Rebuilds the index from yesterday onwards (drops older slots) and commits. Returns slots written."""
+    yesterday = date.today() - timedelta(days=1)
+    BookingSlot.query.filter(
+        BookingSlot.utc_start < datetime.combine(yesterday, datetime.min.time())
+    ).delete(synchronize_session=False)
+
+    query = db.session.query(Availability.closer_id, User.timezone, db.func.max(Availability.date)).join(
+        User, User.id == Availability.closer_id
+    ).filter(Availability.date >= yesterday).group_by(Availability.closer_id, User.timezone)
+    if closer_id:
+        query = query.filter(Availability.closer_id == closer_id)
+
+    count = 0
+    for cid, tz_name, last_date in query.all():
+        count += rebuild_closer_slots(cid, yesterday, last_date, get_timezone(tz_name))
+    db.session.commit()
+    return count
+
+def available_slots(start_utc, end_utc, preferred_closer_id=None):
+    """
+    Free slots of active closers in [start_utc, end_utc], one per start time
+    (the preferred closer wins when several are free). Single range read.
+    Returns a sorted list of {'utc_iso', 'closer_id', 'ts'}.
+    """
+    rows = db.session.query(BookingSlot.utc_start, BookingSlot.closer_id).join(
+        User, User.id == BookingSlot.closer_id
+    ).filter(
+        BookingSlot.is_booked == False,
+        BookingSlot.utc_start >= start_utc,
+        BookingSlot.utc_start <= end_utc,
+        User.role == 'closer' # Exclude admins
+    ).order_by(BookingSlot.utc_start, BookingSlot.closer_id).all()
+
+    unique_slots = {}
+    for utc_start, closer_id in rows:
+        if utc_start not in unique_slots:
+            unique_slots[utc_start] = {
+                'utc_iso': utc_start.isoformat() + 'Z', # Explicit Z for JS
+                'closer_id': closer_id,
+                'ts': utc_start.replace(tzinfo=pytz.UTC).timestamp()
+            }
+        elif preferred_closer_id and closer_id == preferred_closer_id:
+            unique_slots[utc_start]['closer_id'] = closer_id
+    return list(unique_slots.values())
+
+def next_free_slot(start_utc, exclude_closer_id=None, window_days=15):
+    """
+    Earliest free slot at or after start_utc inside the booking window, so the
+    same time with another closer comes first. exclude_closer_id skips the
+    (closer, start_utc) slot that was just lost.
+    Returns {'utc_iso', 'closer_id', 'utc_start'} or None.
+    """
+    query = db.session.query(BookingSlot.utc_start, BookingSlot.closer_id).join(
+        User, User.id == BookingSlot.closer_id
+    ).filter(
+        BookingSlot.is_booked == False,
+        BookingSlot.utc_start >= start_utc,
+        BookingSlot.utc_start <= datetime.utcnow() + timedelta(days=window_days),
+        User.role == 'closer'
+    )
+    if exclude_closer_id:
+        query = query.filter(~and_(BookingSlot.closer_id == exclude_closer_id, BookingSlot.utc_start == start_utc))
+
+    row = query.order_by(BookingSlot.utc_start, BookingSlot.closer_id).first()
+    if not row:
+        return None
+    return {'utc_iso': row.utc_start.isoformat() + 'Z', 'closer_id': row.closer_id, 'utc_start': row.utc_start}
+
+SLOT_INDEX = 'uq_appointments_closer_start_active'
+
+def is_slot_conflict(error):
+    """True if an IntegrityError is a violation of the one-live-appointment-per-slot index."""
+    diag = getattr(error.orig, 'diag', None) # psycopg2
+    if diag is not None and diag.constraint_name:
+        return diag.constraint_name == SLOT_INDEX
+    # SQLite names the columns, not the index
+    return 'appointments.closer_id, appointments.start_time' in str(error.orig)
+
+def claim_slot(closer_id, lead_id, start_utc, event_id=None):
+    """
+    Books a slot atomically: flushes the appointment inside a savepoint, relying
+    on the partial unique index on (closer_id, start_time) for non-canceled
+    appointments, then commits. Returns the Appointment, or None if someone else
+    got it first (only the savepoint is rolled back). Any other integrity error
+    is raised.
+    """
+    appt = Appointment(
+        closer_id=closer_id,
+        lead_id=lead_id,
+        start_time=start_utc, # Stored as UTC
+        status='scheduled',
+        event_id=event_id
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(appt)
+    except IntegrityError as e:
+        if not is_slot_conflict(e):
+            raise
+        return None
+    db.session.commit()
+    return appt
+
+def reserve_slot(closer_id, lead_id, start_utc, event_id=None, attempts=3):
+    """
+    Claims the chosen slot; if it was taken, claims the same time with another
+    free closer. Returns (appointment, None) on success, or (None, suggestion)
+    where suggestion is the next free later slot (or None) to offer the lead.
+    """
+    for _ in range(attempts):
+        appt = claim_slot(closer_id, lead_id, start_utc, event_id)
+        if appt:
+            return appt, None
+
+        suggestion = next_free_slot(start_utc, exclude_closer_id=closer_id)
+        if not suggestion or suggestion['utc_start'] != start_utc:
+            return None, suggestion
+        closer_id = suggestion['closer_id'] # Same time, another closer
+    return None, next_free_slot(start_utc, exclude_closer_id=closer_id)
+
+# --- Appointment events ---
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_booked_slots(session, flush_context, instances):
+    pending = session.info.setdefault('slot_keys', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Appointment):
+            continue
+        state = inspect(obj)
+        fields = ('closer_id', 'start_time', 'status')
+        if obj in session.dirty and not any(state.attrs[f].history.has_changes() for f in fields):
+            continue
+        pending.add((obj.closer_id, obj.start_time))
+        old_closer = state.attrs.closer_id.history.deleted
+        old_start = state.attrs.start_time.history.deleted
+        pending.add((old_closer[0] if old_closer else obj.closer_id, old_start[0] if old_start else obj.start_time))
+
+@event.listens_for(db.session, 'before_commit')
+def _refresh_booked_slots(session):
+    session.flush()
+    pending = session.info.pop('slot_keys', None)
+    if not pending:
+        return
+
+    for closer_id, start_time in pending:
+        if not closer_id or not start_time:
+            continue
+        booked = session.query(Appointment.id).filter(
+            Appointment.closer_id == closer_id,
+            Appointment.start_time == start_time,
+            Appointment.status != 'canceled'
+        ).first() is not None
+        session.query(BookingSlot).filter(
+            BookingSlot.closer_id == closer_id,
+            BookingSlot.utc_start == start_time
+        ).update({'is_booked': booked}, synchronize_session=False)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_booked_slots(session):
+    session.info.pop('slot_keys', None)
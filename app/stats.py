@@ -0,0 +1,203 @@
+"""
+Per-closer daily rollups (CloserDailyStats).
+
+Appointment, Enrollment and Payment writes are collected on flush and, right
+before the commit, only the touched (closer, local day) buckets are recomputed.
+Days are bucketed in the closer's User.timezone, so the numbers match what the
+closer sees in the daily report.
+"""
+import pytz
+from datetime import datetime, time, timedelta
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.models import User, Appointment, Enrollment, Payment, Program, CloserDailyStats
+
+DEFAULT_TIMEZONE = 'America/La_Paz'
+
+# Columns whose change moves numbers between buckets
+TRACKED_FIELDS = {
+    Appointment: ('closer_id', 'start_time', 'status'),
+    Enrollment: ('closer_id', 'enrollment_date', 'status', 'total_agreed'),
+    Payment: ('enrollment_id', 'date', 'amount', 'status'),
+}
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+# Load the previous value on set even when the attribute was expired by a
+# commit, so the bucket the row is leaving gets refreshed too
+for _model, _fields in TRACKED_FIELDS.items():
+    for _field in _fields:
+        event.listen(getattr(_model, _field), 'set', _keep_old_value, active_history=True, retval=True)
+
+def get_timezone(tz_name):
+    try:
+        return pytz.timezone(tz_name or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+def local_day(dt_utc, tz):
+    """Local calendar day of a naive UTC datetime."""
+    return pytz.UTC.localize(dt_utc).astimezone(tz).date()
+
+def day_bounds_utc(day, tz):
+    """Naive UTC [start, end] of a local calendar day."""
+    start_local = tz.localize(datetime.combine(day, time.min))
+    end_local = tz.localize(datetime.combine(day, time.max))
+    return (start_local.astimezone(pytz.UTC).replace(tzinfo=None),
+            end_local.astimezone(pytz.UTC).replace(tzinfo=None))
+
+AUTOMATED_FIELDS = ('calls_scheduled', 'calls_completed', 'calls_no_show', 'calls_canceled',
+                    'sales_count', 'sales_amount', 'cash_collected')
+
+def daily_counters(closer_id, day, tz):
+    """The automated counters of one (closer, local day) bucket, computed from the source tables."""
+    start_utc, end_utc = day_bounds_utc(day, tz)
+
+    calls = dict(db.session.query(Appointment.status, db.func.count(Appointment.id)).filter(
+        Appointment.closer_id == closer_id,
+        Appointment.start_time >= start_utc,
+        Appointment.start_time <= end_utc
+    ).group_by(Appointment.status).all())
+
+    sales_count, sales_amount = db.session.query(
+        db.func.count(Enrollment.id),
+        db.func.coalesce(db.func.sum(db.func.coalesce(Enrollment.total_agreed, Program.price, 0.0)), 0.0)
+    ).join(Program, Enrollment.program_id == Program.id).filter(
+        Enrollment.closer_id == closer_id,
+        Enrollment.enrollment_date >= start_utc,
+        Enrollment.enrollment_date <= end_utc,
+        Enrollment.status != 'dropped'
+    ).one()
+
+    cash_collected = db.session.query(db.func.coalesce(db.func.sum(Payment.amount), 0.0)).join(Enrollment).filter(
+        Enrollment.closer_id == closer_id,
+        Payment.date >= start_utc,
+        Payment.date <= end_utc,
+        Payment.status == 'completed'
+    ).scalar()
+
+    return {
+        'calls_scheduled': sum(calls.values()),
+        'calls_completed': calls.get('completed', 0),
+        'calls_no_show': calls.get('no_show', 0),
+        'calls_canceled': calls.get('canceled', 0),
+        'sales_count': sales_count,
+        'sales_amount': sales_amount,
+        'cash_collected': cash_collected
+    }
+
+def write_daily_stats(closer_id, day, tz):
+    """
+    Recomputes one bucket and writes it with a single INSERT ... ON CONFLICT
+    (closer_id, date) DO UPDATE of the automated counters, so two transactions
+    creating the same day's row don't collide on _closer_date_uc. Manual
+    fields and answers are kept. Does not commit.
+    """
+    counters = daily_counters(closer_id, day, tz)
+    insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    statement = insert(CloserDailyStats).values(closer_id=closer_id, date=day, self_generated_bookings=0, **counters)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['closer_id', 'date'],
+        set_={field: statement.excluded[field] for field in AUTOMATED_FIELDS}
+    ))
+
+def refresh_daily_stats(closer_id, day, tz=None):
+    """
+    Recomputes the automated counters of one (closer, local day) bucket,
+    upserts its CloserDailyStats row and returns it (reloaded, for the report
+    views that set its manual fields). Does not commit.
+    """
+    if tz is None:
+        tz = get_timezone(db.session.query(User.timezone).filter(User.id == closer_id).scalar())
+    write_daily_stats(closer_id, day, tz)
+    return CloserDailyStats.query.filter_by(closer_id=closer_id, date=day).populate_existing().one()
+
+def rebuild_daily_stats(start_date, end_date, closer_id=None):
+    """Rebuilds every bucket in [start_date, end_date] for one or all closers. Returns rows touched."""
+    query = User.query.filter(User.role.in_(['closer', 'admin']))
+    if closer_id:
+        query = query.filter(User.id == closer_id)
+
+    count = 0
+    for closer in query.all():
+        tz = get_timezone(closer.timezone)
+        day = start_date
+        while day <= end_date:
+            write_daily_stats(closer.id, day, tz)
+            count += 1
+            day += timedelta(days=1)
+        db.session.commit()
+    return count
+
+# --- Write events ---
+
+def _closer_for_enrollment(session, enrollment_id):
+    if not enrollment_id:
+        return None
+    enrollment = session.get(Enrollment, enrollment_id)
+    return enrollment.closer_id if enrollment else None
+
+def _bucket_keys(session, obj, state):
+    """(closer_id, utc datetime) pairs the object counts in, before and after the change."""
+    fields = TRACKED_FIELDS[type(obj)]
+    old = {}
+    for field in fields:
+        history = state.attrs[field].history
+        old[field] = history.deleted[0] if history.deleted else getattr(obj, field)
+
+    now = datetime.utcnow() # Column defaults (date/enrollment_date) are applied at insert
+    if isinstance(obj, Appointment):
+        return {(obj.closer_id, obj.start_time), (old['closer_id'], old['start_time'])}
+    if isinstance(obj, Enrollment):
+        return {(obj.closer_id, obj.enrollment_date or now), (old['closer_id'], old['enrollment_date'] or now)}
+    return {
+        (_closer_for_enrollment(session, obj.enrollment_id), obj.date or now),
+        (_closer_for_enrollment(session, old['enrollment_id']), old['date'] or now)
+    }
+
+def queue_stat_refresh(closer_id, dt):
+    """
+    Marks a (closer, utc datetime) bucket for refresh on the next commit, for
+    writes that bypass the ORM (bulk inserts) and so never reach before_flush.
+    """
+    if closer_id and dt:
+        db.session.info.setdefault('stat_buckets', set()).add((closer_id, dt))
+
+@event.listens_for(db.session, 'before_flush')
+def _collect_stat_buckets(session, flush_context, instances):
+    pending = session.info.setdefault('stat_buckets', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        fields = TRACKED_FIELDS.get(type(obj))
+        if not fields:
+            continue
+        state = inspect(obj)
+        if obj in session.dirty and not any(state.attrs[f].history.has_changes() for f in fields):
+            continue
+        for closer_id, dt in _bucket_keys(session, obj, state):
+            if closer_id and dt:
+                pending.add((closer_id, dt))
+
+@event.listens_for(db.session, 'before_commit')
+def _refresh_stat_buckets(session):
+    session.flush()
+    pending = session.info.pop('stat_buckets', None)
+    if not pending:
+        return
+
+    timezones = {}
+    days = set()
+    for closer_id, dt in pending:
+        if closer_id not in timezones:
+            timezones[closer_id] = get_timezone(
+                session.query(User.timezone).filter(User.id == closer_id).scalar()
+            )
+        days.add((closer_id, local_day(dt, timezones[closer_id])))
+
+    for closer_id, day in days:
+        write_daily_stats(closer_id, day, timezones[closer_id])
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_stat_buckets(session):
+    session.info.pop('stat_buckets', None)
@@ -0,0 +1,159 @@
+"""
+Lead status engine (LeadProfile.status).
+
+Statuses are computed for a whole set of users with a few grouped queries
+and written with one UPDATE per status value, instead of the per-user queries
+of User.update_status_based_on_debt. Rules, by priority:
+
+1. pending   - debt (stored outstanding) on active enrollments
+2. renewed   - enrollments, no debt, and a completed renewal payment
+   completed - enrollments, no debt
+3. agenda    - no enrollments but a future scheduled appointment
+4. new       - no enrollments, no payments, no future appointment
+Otherwise (payments but no enrollment) the current status is kept.
+
+'agenda' depends on the clock, so run_status_transitions (scheduled, see
+app/scheduler.py) recomputes the leads whose appointment time has passed.
+"""
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, or_, and_
+from app import db
+from app.models import User, LeadProfile, Enrollment, Payment, Appointment, JobWatermark
+
+RENEWAL_TYPES = ('renewal', 'Renovación', 'Renovacion') # Form value and the import spellings
+
+TRANSITIONS_JOB = 'lead_status_transitions'
+TRANSITIONS_LOOKBACK = timedelta(days=30) # First run: appointments passed in the last 30 days
+
+def _ids(query):
+    return {user_id for (user_id,) in query}
+
+def _current_statuses(user_ids):
+    """{user_id: status} of the users that have a profile."""
+    return dict(db.session.query(LeadProfile.user_id, LeadProfile.status).filter(LeadProfile.user_id.in_(user_ids)).all())
+
+def compute_lead_statuses(user_ids, current=None):
+    """{user_id: status} for the given users, in a handful of grouped queries."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    if current is None:
+        current = _current_statuses(user_ids)
+
+    debt = dict(db.session.query(Enrollment.student_id, db.func.sum(Enrollment.outstanding)).filter(
+        Enrollment.student_id.in_(user_ids),
+        Enrollment.status == 'active'
+    ).group_by(Enrollment.student_id).all())
+    enrolled = _ids(db.session.query(Enrollment.student_id).filter(Enrollment.student_id.in_(user_ids)).distinct())
+    paid = _ids(db.session.query(Enrollment.student_id).join(Payment, Payment.enrollment_id == Enrollment.id).filter(
+        Enrollment.student_id.in_(user_ids),
+        Payment.status == 'completed'
+    ).distinct())
+    renewed = _ids(db.session.query(Enrollment.student_id).join(Payment, Payment.enrollment_id == Enrollment.id).filter(
+        Enrollment.student_id.in_(user_ids),
+        Payment.status == 'completed',
+        or_(*[Payment.payment_type.ilike(t) for t in RENEWAL_TYPES])
+    ).distinct())
+    scheduled = _ids(db.session.query(Appointment.lead_id).filter(
+        Appointment.lead_id.in_(user_ids),
+        Appointment.start_time > datetime.utcnow(), # Stored as UTC
+        Appointment.status == 'scheduled'
+    ).distinct())
+
+    statuses = {}
+    for user_id in user_ids:
+        if (debt.get(user_id) or 0) > 0:
+            status = 'pending'
+        elif user_id in enrolled:
+            status = 'renewed' if user_id in renewed else 'completed'
+        elif user_id in scheduled:
+            status = 'agenda'
+        elif user_id not in paid:
+            status = 'new'
+        else:
+            status = current.get(user_id) or 'new'
+        statuses[user_id] = status
+    return statuses
+
+def apply_lead_statuses(user_ids):
+    """
+    Recomputes and writes the status of the given users (one UPDATE per
+    status value), creating missing profiles. Does not commit.
+    Returns how many statuses changed.
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return 0
+    current = _current_statuses(user_ids)
+
+    by_status = {}
+    missing = []
+    for user_id, status in compute_lead_statuses(user_ids, current).items():
+        if user_id not in current:
+            missing.append({'user_id': user_id, 'status': status})
+        elif current[user_id] != status:
+            by_status.setdefault(status, []).append(user_id)
+
+    for status, ids in by_status.items():
+        LeadProfile.query.filter(LeadProfile.user_id.in_(ids)).update({'status': status})
+    if missing:
+        db.session.execute(insert(LeadProfile), missing)
+    return sum(len(ids) for ids in by_status.values()) + len(missing)
+
+def recompute_statuses(since=None, batch_size=500):
+    """
+    Recomputes leads in batches (committing each). With since, only users with
+    enrollments, payments or appointments on/after that datetime; otherwise
+    every non-staff user. Returns (users checked, statuses changed).
+    """
+    if since:
+        user_ids = _ids(db.session.query(Enrollment.student_id).filter(Enrollment.enrollment_date >= since))
+        user_ids |= _ids(db.session.query(Enrollment.student_id).join(Payment, Payment.enrollment_id == Enrollment.id).filter(Payment.date >= since))
+        user_ids |= _ids(db.session.query(Appointment.lead_id).filter(Appointment.start_time >= since))
+    else:
+        user_ids = _ids(db.session.query(User.id).filter(User.role.notin_(['admin', 'closer'])))
+
+    user_ids = sorted(user_ids)
+    changed = 0
+    for i in range(0, len(user_ids), batch_size):
+        changed += apply_lead_statuses(user_ids[i:i + batch_size])
+        db.session.commit()
+    return len(user_ids), changed
+
+def run_status_transitions(max_seconds=5.0, batch_size=200):
+    """
+    Recomputes the leads of scheduled appointments whose start time passed
+    since the last run, oldest first, in batches. The watermark (start_time,
+    id of the last appointment handled) is committed with each batch, and the
+    run stops after max_seconds; the next one continues from the watermark.
+    Returns (appointments handled, statuses changed).
+    """
+    state = db.session.get(JobWatermark, TRANSITIONS_JOB)
+    if not state:
+        state = JobWatermark(name=TRANSITIONS_JOB)
+        db.session.add(state)
+
+    now = datetime.utcnow()
+    started = time.monotonic()
+    mark_at = state.watermark_at or now - TRANSITIONS_LOOKBACK
+    mark_id = state.watermark_id or 0
+    handled = changed = 0
+
+    while time.monotonic() - started < max_seconds:
+        rows = db.session.query(Appointment.id, Appointment.start_time, Appointment.lead_id).filter(
+            Appointment.status == 'scheduled',
+            Appointment.start_time <= now,
+            or_(Appointment.start_time > mark_at, and_(Appointment.start_time == mark_at, Appointment.id > mark_id))
+        ).order_by(Appointment.start_time, Appointment.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        changed += apply_lead_statuses({row.lead_id for row in rows if row.lead_id})
+        mark_at, mark_id = rows[-1].start_time, rows[-1].id
+        state.watermark_at = mark_at
+        state.watermark_id = mark_id
+        db.session.commit()
+        handled += len(rows)
+
+    return handled, changed
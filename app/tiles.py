@@ -0,0 +1,94 @@
+"""
+Admin dashboard tiles.
+
+tiles_config.json is read once per process. Each tile query is compiled to a
+text() statement with typed :start / :end bind parameters (the selected
+period window), so the same SQL runs on SQLite and PostgreSQL. Values are
+cached per (tile, period window) for DASHBOARD_TILE_TTL seconds and the tiles
+that are not cached run concurrently, each on its own connection.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import text, bindparam
+from app import db
+
+# Old configs filtered with SQLite-only date math; it always meant "start of the period"
+LEGACY_START_EXPR = "DATE('now', 'start of month')"
+
+_tiles = None
+_tiles_lock = threading.Lock()
+_cache = {}
+_cache_lock = threading.Lock()
+
+def compile_tile_query(sql):
+    """text() statement for a tile query. Only :start and :end are supported."""
+    sql = sql.replace(LEGACY_START_EXPR, ':start')
+    stmt = text(sql)
+    unknown = set(stmt._bindparams) - {'start', 'end'}
+    if unknown:
+        raise ValueError(f"Unsupported tile parameters: {', '.join(sorted(unknown))}")
+    params = [bindparam(name, type_=db.DateTime) for name in ('start', 'end') if name in stmt._bindparams]
+    return stmt.bindparams(*params)
+
+def get_tiles():
+    """Loads and compiles tiles_config.json (TILES_CONFIG) once per process."""
+    global _tiles
+    if _tiles is None:
+        with _tiles_lock:
+            if _tiles is None:
+                with open(current_app.config.get('TILES_CONFIG', 'tiles_config.json')) as f:
+                    config = json.load(f)
+                _tiles = [{
+                    'title': tile['title'],
+                    'type': tile.get('type', 'kpi'),
+                    'statement': compile_tile_query(tile['query'])
+                } for tile in config]
+    return _tiles
+
+def _run_tile(engine, statement, params):
+    with engine.connect() as conn:
+        return conn.execute(statement, params).scalar()
+
+def get_tiles_data(start_dt, end_dt):
+    """
+    Values of every tile for the [start_dt, end_dt] window.
+    Returns a list of {'title', 'value'} in config order (value is None if the tile failed).
+    """
+    tiles = get_tiles()
+    ttl = current_app.config.get('DASHBOARD_TILE_TTL', 300)
+    now = time.monotonic()
+    params = {'start': start_dt, 'end': end_dt}
+
+    values = {}
+    with _cache_lock:
+        for index in range(len(tiles)):
+            cached = _cache.get((index, start_dt, end_dt))
+            if cached and cached[0] > now:
+                values[index] = cached[1]
+
+    missing = [index for index in range(len(tiles)) if index not in values]
+    if missing:
+        engine = db.engine # Resolved here, worker threads have no app context
+        workers = min(len(missing), current_app.config.get('DASHBOARD_TILE_WORKERS', 4))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {index: executor.submit(_run_tile, engine, tiles[index]['statement'], params) for index in missing}
+
+        for index, future in futures.items():
+            try:
+                values[index] = future.result()
+            except Exception as e:
+                current_app.logger.error(f"Dashboard tile '{tiles[index]['title']}' failed: {e}")
+                values[index] = None
+                continue
+            with _cache_lock:
+                _cache[(index, start_dt, end_dt)] = (now + ttl, values[index])
+
+        # Drop expired windows so custom ranges don't pile up
+        with _cache_lock:
+            for key in [key for key, (expires, _) in _cache.items() if expires <= now]:
+                del _cache[key]
+
+    return [{'title': tile['title'], 'value': values[index]} for index, tile in enumerate(tiles)]
@@ -17,5 +17,31 @@ class Config:
             "connect_args": {"timeout": 30}
         }
     
+    # Admin dashboard tiles
+    TILES_CONFIG = os.environ.get('TILES_CONFIG') or 'tiles_config.json'
+    DASHBOARD_TILE_TTL = int(os.environ.get('DASHBOARD_TILE_TTL', 300)) # seconds
+    DASHBOARD_TILE_WORKERS = int(os.environ.get('DASHBOARD_TILE_WORKERS', 4))
+    
+    # CSV imports: rows per prefetch/bulk write/commit
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+    IMPORT_JOB_STALE_SECONDS = int(os.environ.get('IMPORT_JOB_STALE_SECONDS', 600)) # No batch for this long = worker died
+    
+    # Scheduled jobs (app/scheduler.py): leads whose appointment passed leave 'agenda'
+    SCHEDULER_TICK = int(os.environ.get('SCHEDULER_TICK', 30)) # seconds between due-job checks
+    STATUS_TRANSITIONS_INTERVAL = int(os.environ.get('STATUS_TRANSITIONS_INTERVAL', 300)) # seconds, 0 = disabled
+    STATUS_TRANSITIONS_MAX_SECONDS = float(os.environ.get('STATUS_TRANSITIONS_MAX_SECONDS', 5)) # per run
+    STATUS_TRANSITIONS_BATCH_SIZE = int(os.environ.get('STATUS_TRANSITIONS_BATCH_SIZE', 200))
+    
+    # Per-request SQL profiler (app/profiler.py), off unless SQL_PROFILER=1
+    SQL_PROFILER = os.environ.get('SQL_PROFILER') == '1'
+    SQL_PROFILER_WINDOW = int(os.environ.get('SQL_PROFILER_WINDOW', 3600)) # seconds of requests kept for the admin page
+    SQL_PROFILER_N_PLUS_ONE = int(os.environ.get('SQL_PROFILER_N_PLUS_ONE', 5)) # runs of one statement shape per request
+    SQL_PROFILER_SLOWEST = int(os.environ.get('SQL_PROFILER_SLOWEST', 5)) # statements kept per request
+    
+    # Google Calendar clients cached per process (LRU)
+    GOOGLE_CLIENT_CACHE_SIZE = int(os.environ.get('GOOGLE_CLIENT_CACHE_SIZE', 64))
+    
     # Webhooks
     VENTAS_WEBHOOK = os.environ.get('VENTAS_WEBHOOK')
+    SALES_WEBHOOK_BATCH_SIZE = int(os.environ.get('SALES_WEBHOOK_BATCH_SIZE', 1)) # >1 sends {"events": [...]}
+    SALES_WEBHOOK_TIMEOUT = float(os.environ.get('SALES_WEBHOOK_TIMEOUT', 5)) # seconds
@@ -0,0 +1,46 @@
+"""add stored balance columns to enrollments
+
+Revision ID: 3f1a9c2e7b10
+Revises: 945674423935
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a9c2e7b10'
+down_revision = '945674423935'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('paid_total', sa.Float(), nullable=True, server_default='0'))
+        batch_op.add_column(sa.Column('agreed_total', sa.Float(), nullable=True, server_default='0'))
+        batch_op.add_column(sa.Column('outstanding', sa.Float(), nullable=True, server_default='0'))
+
+    # Backfill from existing payments (same rules as Enrollment.update_balance)
+    op.execute("""
+        UPDATE enrollments SET
+            paid_total = COALESCE((
+                SELECT SUM(payments.amount) FROM payments
+                WHERE payments.enrollment_id = enrollments.id AND payments.status = 'completed'
+            ), 0),
+            agreed_total = COALESCE(enrollments.total_agreed, (
+                SELECT programs.price FROM programs WHERE programs.id = enrollments.program_id
+            ), 0)
+    """)
+    op.execute("""
+        UPDATE enrollments SET outstanding =
+            CASE WHEN agreed_total > paid_total THEN agreed_total - paid_total ELSE 0 END
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_column('outstanding')
+        batch_op.drop_column('agreed_total')
+        batch_op.drop_column('paid_total')
@@ -0,0 +1,38 @@
+"""add platform fee snapshot to payments
+
+Revision ID: 7c2d4e8a9b31
+Revises: 3f1a9c2e7b10
+Create Date: 2026-10-18 10:02:15.407921
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2d4e8a9b31'
+down_revision = '3f1a9c2e7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('platform_fee', sa.Float(), nullable=True, server_default='0'))
+        batch_op.add_column(sa.Column('cash_collect', sa.Float(), nullable=True, server_default='0'))
+
+    # Backfill with the methods' current fees (same formula as Payment.snapshot_fees)
+    op.execute("""
+        UPDATE payments SET platform_fee = COALESCE((
+            SELECT payments.amount * (COALESCE(payment_methods.commission_percent, 0) / 100.0)
+                   + COALESCE(payment_methods.commission_fixed, 0)
+            FROM payment_methods WHERE payment_methods.id = payments.payment_method_id
+        ), 0)
+    """)
+    op.execute("UPDATE payments SET cash_collect = amount - platform_fee")
+
+
+def downgrade():
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.drop_column('cash_collect')
+        batch_op.drop_column('platform_fee')
@@ -0,0 +1,63 @@
+"""add lead contact keys
+
+Revision ID: a4d8b2f6c913
+Revises: f2c7a9d4e1b6
+Create Date: 2026-10-18 19:12:47.530186
+
+"""
+import re
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d8b2f6c913'
+down_revision = 'f2c7a9d4e1b6'
+branch_labels = None
+depends_on = None
+
+
+# Same rules as app.models.normalize_phone / normalize_instagram
+def _phone(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    return digits[:20] or None
+
+
+def _instagram(handle):
+    handle = (handle or '').strip().lower()
+    if 'instagram.com/' in handle:
+        handle = handle.split('instagram.com/', 1)[1].split('?', 1)[0]
+    return handle.strip('/@ ')[:64] or None
+
+
+def upgrade():
+    with op.batch_alter_table('lead_profiles', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phone_normalized', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('instagram_normalized', sa.String(length=64), nullable=True))
+
+    conn = op.get_bind()
+    result = conn.execute(sa.text(
+        "SELECT id, phone, instagram FROM lead_profiles WHERE phone IS NOT NULL OR instagram IS NOT NULL"
+    ))
+    updates = [
+        {'id': profile_id, 'phone': _phone(phone), 'instagram': _instagram(instagram)}
+        for profile_id, phone, instagram in result
+    ]
+    if updates:
+        conn.execute(sa.text(
+            "UPDATE lead_profiles SET phone_normalized = :phone, instagram_normalized = :instagram WHERE id = :id"
+        ), updates)
+
+    with op.batch_alter_table('lead_profiles', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_lead_profiles_phone_normalized'), ['phone_normalized'], unique=False)
+        batch_op.create_index(batch_op.f('ix_lead_profiles_instagram_normalized'), ['instagram_normalized'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('lead_profiles', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_lead_profiles_instagram_normalized'))
+        batch_op.drop_index(batch_op.f('ix_lead_profiles_phone_normalized'))
+        batch_op.drop_column('instagram_normalized')
+        batch_op.drop_column('phone_normalized')
@@ -0,0 +1,43 @@
+"""add sales webhook events
+
+Revision ID: a7d2e9c4b815
+Revises: f1c8d3e5a724
+Create Date: 2026-10-18 14:05:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d2e9c4b815'
+down_revision = 'f1c8d3e5a724'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sales_webhook_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('payment_id', sa.Integer(), nullable=True),
+    sa.Column('idempotency_key', sa.String(length=100), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['payment_id'], ['payments.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('idempotency_key')
+    )
+    with op.batch_alter_table('sales_webhook_events', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_sales_webhook_events_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sales_webhook_events', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_sales_webhook_events_status'))
+
+    op.drop_table('sales_webhook_events')
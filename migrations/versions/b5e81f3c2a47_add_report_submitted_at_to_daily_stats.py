@@ -0,0 +1,29 @@
+"""add report_submitted_at to closer daily stats
+
+Revision ID: b5e81f3c2a47
+Revises: 7c2d4e8a9b31
+Create Date: 2026-10-18 11:14:52.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e81f3c2a47'
+down_revision = '7c2d4e8a9b31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('closer_daily_stats', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('report_submitted_at', sa.DateTime(), nullable=True))
+
+    # Until now rows were only created by submitting the report
+    op.execute("UPDATE closer_daily_stats SET report_submitted_at = CURRENT_TIMESTAMP")
+
+
+def downgrade():
+    with op.batch_alter_table('closer_daily_stats', schema=None) as batch_op:
+        batch_op.drop_column('report_submitted_at')
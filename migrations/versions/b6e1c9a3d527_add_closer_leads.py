@@ -0,0 +1,65 @@
+"""add closer leads
+
+Revision ID: b6e1c9a3d527
+Revises: a4d8b2f6c913
+Create Date: 2026-10-18 20:21:36.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1c9a3d527'
+down_revision = 'a4d8b2f6c913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('closer_leads',
+    sa.Column('closer_id', sa.Integer(), nullable=False),
+    sa.Column('lead_id', sa.Integer(), nullable=False),
+    sa.Column('reason', sa.String(length=20), nullable=False),
+    sa.Column('first_seen', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['closer_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['lead_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('closer_id', 'lead_id')
+    )
+    with op.batch_alter_table('closer_leads', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_closer_leads_lead_id'), ['lead_id'], unique=False)
+
+    # Backfill, strongest reason first (same rules as app.portfolio.portfolio_pairs,
+    # except first_seen comes from the strongest source only)
+    op.execute("""
+        INSERT INTO closer_leads (closer_id, lead_id, reason, first_seen)
+        SELECT closer_id, student_id, 'enrollment', MIN(enrollment_date)
+        FROM enrollments WHERE closer_id IS NOT NULL
+        GROUP BY closer_id, student_id
+    """)
+    op.execute("""
+        INSERT INTO closer_leads (closer_id, lead_id, reason, first_seen)
+        SELECT closer_id, lead_id, 'appointment', MIN(start_time)
+        FROM appointments
+        WHERE closer_id IS NOT NULL AND lead_id IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM closer_leads
+            WHERE closer_leads.closer_id = appointments.closer_id AND closer_leads.lead_id = appointments.lead_id
+        )
+        GROUP BY closer_id, lead_id
+    """)
+    op.execute("""
+        INSERT INTO closer_leads (closer_id, lead_id, reason, first_seen)
+        SELECT lead_profiles.assigned_closer_id, lead_profiles.user_id, 'assigned', users.created_at
+        FROM lead_profiles JOIN users ON users.id = lead_profiles.user_id
+        WHERE lead_profiles.assigned_closer_id IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM closer_leads
+            WHERE closer_leads.closer_id = lead_profiles.assigned_closer_id AND closer_leads.lead_id = lead_profiles.user_id
+        )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('closer_leads', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_closer_leads_lead_id'))
+
+    op.drop_table('closer_leads')
@@ -0,0 +1,64 @@
+"""add import jobs
+
+Revision ID: c3e9f5a1d204
+Revises: a7d2e9c4b815
+Create Date: 2026-10-18 15:10:27.551093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e9f5a1d204'
+down_revision = 'a7d2e9c4b815'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=True),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('rows_read', sa.Integer(), nullable=True),
+    sa.Column('created', sa.Integer(), nullable=True),
+    sa.Column('updated', sa.Integer(), nullable=True),
+    sa.Column('skipped', sa.Integer(), nullable=True),
+    sa.Column('errors', sa.Integer(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_by_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('import_jobs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_import_jobs_status'), ['status'], unique=False)
+
+    op.create_table('import_job_errors',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job_id', sa.Integer(), nullable=False),
+    sa.Column('row_number', sa.Integer(), nullable=False),
+    sa.Column('reason', sa.String(length=255), nullable=False),
+    sa.Column('row_data', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['job_id'], ['import_jobs.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('import_job_errors', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_import_job_errors_job_id'), ['job_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('import_job_errors', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_import_job_errors_job_id'))
+
+    op.drop_table('import_job_errors')
+    with op.batch_alter_table('import_jobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_import_jobs_status'))
+
+    op.drop_table('import_jobs')
@@ -0,0 +1,61 @@
+"""add hot query indexes
+
+Revision ID: c3f9a1d7e248
+Revises: b6e1c9a3d527
+Create Date: 2026-10-18 21:04:12.318640
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f9a1d7e248'
+down_revision = 'b6e1c9a3d527'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.create_index('ix_appointments_closer_start_status', ['closer_id', 'start_time', 'status'], unique=False)
+        batch_op.create_index(batch_op.f('ix_appointments_lead_id'), ['lead_id'], unique=False)
+
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.create_index('ix_payments_enrollment_status_date', ['enrollment_id', 'status', 'date'], unique=False)
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.create_index('ix_enrollments_closer_status_date', ['closer_id', 'status', 'enrollment_date'], unique=False)
+        batch_op.create_index(batch_op.f('ix_enrollments_student_id'), ['student_id'], unique=False)
+
+    with op.batch_alter_table('availability', schema=None) as batch_op:
+        batch_op.create_index('ix_availability_closer_date', ['closer_id', 'date'], unique=False)
+
+    with op.batch_alter_table('survey_answers', schema=None) as batch_op:
+        batch_op.create_index('ix_survey_answers_lead_question', ['lead_id', 'question_id'], unique=False)
+
+    with op.batch_alter_table('lead_profiles', schema=None) as batch_op:
+        batch_op.create_index('ix_lead_profiles_assigned_closer_status', ['assigned_closer_id', 'status'], unique=False)
+        batch_op.create_index(batch_op.f('ix_lead_profiles_utm_source'), ['utm_source'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('lead_profiles', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_lead_profiles_utm_source'))
+        batch_op.drop_index('ix_lead_profiles_assigned_closer_status')
+
+    with op.batch_alter_table('survey_answers', schema=None) as batch_op:
+        batch_op.drop_index('ix_survey_answers_lead_question')
+
+    with op.batch_alter_table('availability', schema=None) as batch_op:
+        batch_op.drop_index('ix_availability_closer_date')
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_enrollments_student_id'))
+        batch_op.drop_index('ix_enrollments_closer_status_date')
+
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.drop_index('ix_payments_enrollment_status_date')
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_appointments_lead_id'))
+        batch_op.drop_index('ix_appointments_closer_start_status')
@@ -0,0 +1,61 @@
+"""add payment fingerprint
+
+Revision ID: d5a1b7e3f926
+Revises: c3e9f5a1d204
+Create Date: 2026-10-18 15:52:03.184467
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a1b7e3f926'
+down_revision = 'c3e9f5a1d204'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fingerprint', sa.String(length=64), nullable=True))
+
+    # Backfill (same format as app.models.payment_fingerprint). Completed payments that
+    # duplicate an older one get a 'dup-<id>' marker instead (app.models.DUPLICATE_MARKER),
+    # so the index can be created; they are reported here for review instead of being changed.
+    conn = op.get_bind()
+    result = conn.execute(sa.text(
+        "SELECT id, enrollment_id, amount, payment_type, date, status FROM payments ORDER BY id"
+    ).columns(sa.column('id', sa.Integer()), sa.column('enrollment_id', sa.Integer()),
+              sa.column('amount', sa.Float()), sa.column('payment_type', sa.String()),
+              sa.column('date', sa.DateTime()), sa.column('status', sa.String())))
+
+    seen = set()
+    updates = []
+    duplicates = []
+    for payment_id, enrollment_id, amount, payment_type, date, status in result:
+        if date is None:
+            continue
+        fingerprint = f"{enrollment_id}:{int(round((amount or 0) * 100))}:{payment_type or ''}:{date:%Y-%m-%d}"
+        if status == 'completed':
+            if fingerprint in seen:
+                duplicates.append(payment_id)
+                fingerprint = f"dup-{payment_id}"
+            seen.add(fingerprint)
+        updates.append({'id': payment_id, 'fingerprint': fingerprint})
+
+    if updates:
+        conn.execute(sa.text("UPDATE payments SET fingerprint = :fingerprint WHERE id = :id"), updates)
+    if duplicates:
+        print(f"Payments marked dup-<id> (duplicate of an older payment, review and delete): {duplicates}")
+
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.create_index('uq_payments_fingerprint_completed', ['fingerprint'], unique=True,
+                              sqlite_where=sa.text("status = 'completed'"),
+                              postgresql_where=sa.text("status = 'completed'"))
+
+
+def downgrade():
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.drop_index('uq_payments_fingerprint_completed')
+        batch_op.drop_column('fingerprint')
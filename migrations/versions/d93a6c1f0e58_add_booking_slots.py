@@ -0,0 +1,73 @@
+"""add booking slot index
+
+Revision ID: d93a6c1f0e58
+Revises: b5e81f3c2a47
+Create Date: 2026-10-18 12:03:27.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import pytz
+from datetime import date, datetime, timedelta
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93a6c1f0e58'
+down_revision = 'b5e81f3c2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    booking_slots = op.create_table('booking_slots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('closer_id', sa.Integer(), nullable=False),
+    sa.Column('utc_start', sa.DateTime(), nullable=False),
+    sa.Column('is_booked', sa.Boolean(), nullable=False, server_default=sa.false()),
+    sa.ForeignKeyConstraint(['closer_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('closer_id', 'utc_start', name='_closer_slot_uc')
+    )
+    with op.batch_alter_table('booking_slots', schema=None) as batch_op:
+        batch_op.create_index('ix_booking_slots_booked_start', ['is_booked', 'utc_start'], unique=False)
+
+    # Backfill upcoming availability (same expansion as app/slots.py, `flask rebuild-slots` redoes it)
+    conn = op.get_bind()
+    since = date.today() - timedelta(days=1)
+    timezones = {}
+    for user_id, tz_name in conn.execute(sa.text("SELECT id, timezone FROM users")):
+        try:
+            timezones[user_id] = pytz.timezone(tz_name or 'America/La_Paz')
+        except pytz.UnknownTimeZoneError:
+            timezones[user_id] = pytz.timezone('America/La_Paz')
+
+    booked = set()
+    result = conn.execute(sa.text(
+        "SELECT closer_id, start_time FROM appointments WHERE status != 'canceled' AND start_time >= :since"
+    ).columns(sa.column('closer_id', sa.Integer()), sa.column('start_time', sa.DateTime())
+    ).bindparams(sa.bindparam('since', type_=sa.DateTime())), {'since': datetime.combine(since, datetime.min.time())})
+    for closer_id, start_time in result:
+        booked.add((closer_id, start_time))
+
+    rows = {}
+    result = conn.execute(sa.text(
+        "SELECT closer_id, date, start_time FROM availability WHERE date >= :since"
+    ).columns(sa.column('closer_id', sa.Integer()), sa.column('date', sa.Date()), sa.column('start_time', sa.Time())
+    ).bindparams(sa.bindparam('since', type_=sa.Date())), {'since': since})
+    for closer_id, slot_date, start_time in result:
+        tz = timezones.get(closer_id, pytz.timezone('America/La_Paz'))
+        utc_start = tz.localize(datetime.combine(slot_date, start_time)).astimezone(pytz.UTC).replace(tzinfo=None)
+        rows[(closer_id, utc_start)] = {
+            'closer_id': closer_id,
+            'utc_start': utc_start,
+            'is_booked': (closer_id, utc_start) in booked
+        }
+    if rows:
+        op.bulk_insert(booking_slots, list(rows.values()))
+
+
+def downgrade():
+    with op.batch_alter_table('booking_slots', schema=None) as batch_op:
+        batch_op.drop_index('ix_booking_slots_booked_start')
+
+    op.drop_table('booking_slots')
@@ -0,0 +1,40 @@
+"""unique active appointment per closer slot
+
+Revision ID: e4f7a2b9c610
+Revises: d93a6c1f0e58
+Create Date: 2026-10-18 12:41:09.774213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4f7a2b9c610'
+down_revision = 'd93a6c1f0e58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing double bookings would block the index: keep the oldest, cancel the rest
+    op.execute("""
+        UPDATE appointments SET status = 'canceled'
+        WHERE status != 'canceled' AND EXISTS (
+            SELECT 1 FROM appointments AS older
+            WHERE older.closer_id = appointments.closer_id
+              AND older.start_time = appointments.start_time
+              AND older.status != 'canceled'
+              AND older.id < appointments.id
+        )
+    """)
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.create_index('uq_appointments_closer_start_active', ['closer_id', 'start_time'], unique=True,
+                              sqlite_where=sa.text("status != 'canceled'"),
+                              postgresql_where=sa.text("status != 'canceled'"))
+
+
+def downgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index('uq_appointments_closer_start_active')
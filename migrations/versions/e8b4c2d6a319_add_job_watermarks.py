@@ -0,0 +1,31 @@
+"""add job watermarks
+
+Revision ID: e8b4c2d6a319
+Revises: d5a1b7e3f926
+Create Date: 2026-10-18 16:30:44.702318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b4c2d6a319'
+down_revision = 'd5a1b7e3f926'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_watermarks',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('watermark_at', sa.DateTime(), nullable=True),
+    sa.Column('watermark_id', sa.Integer(), nullable=True),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_run_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('job_watermarks')
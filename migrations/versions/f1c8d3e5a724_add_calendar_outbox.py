@@ -0,0 +1,44 @@
+"""add calendar outbox
+
+Revision ID: f1c8d3e5a724
+Revises: e4f7a2b9c610
+Create Date: 2026-10-18 13:22:40.906117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c8d3e5a724'
+down_revision = 'e4f7a2b9c610'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('calendar_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('appointment_id', sa.Integer(), nullable=True),
+    sa.Column('closer_id', sa.Integer(), nullable=False),
+    sa.Column('action', sa.String(length=20), nullable=False),
+    sa.Column('google_event_id', sa.String(length=255), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['appointment_id'], ['appointments.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['closer_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('calendar_outbox', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_calendar_outbox_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('calendar_outbox', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_calendar_outbox_status'))
+
+    op.drop_table('calendar_outbox')
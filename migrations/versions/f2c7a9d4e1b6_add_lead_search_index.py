@@ -0,0 +1,81 @@
+"""add lead search index
+
+Revision ID: f2c7a9d4e1b6
+Revises: e8b4c2d6a319
+Create Date: 2026-10-18 18:05:12.418903
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c7a9d4e1b6'
+down_revision = 'e8b4c2d6a319'
+branch_labels = None
+depends_on = None
+
+# Same objects as app/search.py (kept literal so the migration doesn't change with the app)
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS lead_search USING fts5(username, email, phone, instagram, tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_user_insert AFTER INSERT ON users BEGIN
+        INSERT INTO lead_search (rowid, username, email) VALUES (new.id, new.username, new.email);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_user_update AFTER UPDATE OF username, email ON users BEGIN
+        UPDATE lead_search SET username = new.username, email = new.email WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_user_delete AFTER DELETE ON users BEGIN
+        DELETE FROM lead_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_profile_insert AFTER INSERT ON lead_profiles BEGIN
+        UPDATE lead_search SET phone = new.phone, instagram = new.instagram WHERE rowid = new.user_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_profile_update AFTER UPDATE OF phone, instagram ON lead_profiles BEGIN
+        UPDATE lead_search SET phone = new.phone, instagram = new.instagram WHERE rowid = new.user_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS lead_search_profile_delete AFTER DELETE ON lead_profiles BEGIN
+        UPDATE lead_search SET phone = NULL, instagram = NULL WHERE rowid = old.user_id;
+    END""",
+    # Backfill existing users
+    """INSERT INTO lead_search (rowid, username, email, phone, instagram)
+        SELECT users.id, users.username, users.email, lead_profiles.phone, lead_profiles.instagram
+        FROM users LEFT JOIN lead_profiles ON lead_profiles.user_id = users.id""",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS lead_search_user_insert",
+    "DROP TRIGGER IF EXISTS lead_search_user_update",
+    "DROP TRIGGER IF EXISTS lead_search_user_delete",
+    "DROP TRIGGER IF EXISTS lead_search_profile_insert",
+    "DROP TRIGGER IF EXISTS lead_search_profile_update",
+    "DROP TRIGGER IF EXISTS lead_search_profile_delete",
+    "DROP TABLE IF EXISTS lead_search",
+]
+
+POSTGRES_UPGRADE = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_email_trgm ON users USING gin (email gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_lead_profiles_phone_trgm ON lead_profiles USING gin (phone gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_lead_profiles_instagram_trgm ON lead_profiles USING gin (instagram gin_trgm_ops)",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_users_username_trgm",
+    "DROP INDEX IF EXISTS ix_users_email_trgm",
+    "DROP INDEX IF EXISTS ix_lead_profiles_phone_trgm",
+    "DROP INDEX IF EXISTS ix_lead_profiles_instagram_trgm",
+]
+
+
+def _run(sqlite, postgres):
+    dialect = op.get_bind().dialect.name
+    for statement in {'sqlite': sqlite, 'postgresql': postgres}.get(dialect, []):
+        op.execute(statement)
+
+
+def upgrade():
+    _run(SQLITE_UPGRADE, POSTGRES_UPGRADE)
+
+
+def downgrade():
+    _run(SQLITE_DOWNGRADE, POSTGRES_DOWNGRADE)
@@ -32,5 +32,126 @@ def create_admin(username, password):
     db.session.commit()
     print(f"Admin user {username} created successfully.")
 
+@app.cli.command("set-password")
+@click.argument("username")
+@click.argument("password")
+def set_password_command(username, password):
+    """Gives a user (e.g. an imported lead without a usable password) a login."""
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        print(f"User {username} not found.")
+        return
+    user.set_password(password)
+    db.session.commit()
+    print(f"Password set for {username}.")
+
+@app.cli.command("rebuild-balances")
+@click.option("--dry-run", is_flag=True, help="Only report drift, do not write.")
+def rebuild_balances_command(dry_run):
+    """Rebuilds stored enrollment balances and reports drift."""
+    from app.balances import rebuild_balances
+    drift = rebuild_balances(dry_run=dry_run)
+    for d in drift:
+        print(f"Enrollment {d['enrollment_id']}: {d['field']} stored={d['stored']} computed={d['computed']}")
+    enrollments_affected = len({d['enrollment_id'] for d in drift})
+    if dry_run:
+        print(f"Drift found in {enrollments_affected} enrollments (dry run, nothing written).")
+    else:
+        print(f"Balances rebuilt. {enrollments_affected} enrollments corrected.")
+
+@app.cli.command("rebuild-daily-stats")
+@click.option("--start", required=True, type=click.DateTime(formats=["%Y-%m-%d"]), help="First local day (YYYY-MM-DD).")
+@click.option("--end", required=True, type=click.DateTime(formats=["%Y-%m-%d"]), help="Last local day (YYYY-MM-DD).")
+@click.option("--closer", "closer_id", type=int, default=None, help="Only rebuild this closer.")
+def rebuild_daily_stats_command(start, end, closer_id):
+    """Backfills CloserDailyStats rollups for a date range."""
+    from app.stats import rebuild_daily_stats
+    count = rebuild_daily_stats(start.date(), end.date(), closer_id=closer_id)
+    print(f"Daily stats rebuilt. {count} closer-days processed.")
+
+@app.cli.command("rebuild-slots")
+@click.option("--closer", "closer_id", type=int, default=None, help="Only rebuild this closer.")
+def rebuild_slots_command(closer_id):
+    """Rebuilds the booking slot index from availability (e.g. after a timezone change)."""
+    from app.slots import rebuild_all_slots
+    count = rebuild_all_slots(closer_id=closer_id)
+    print(f"Booking slots rebuilt. {count} slots indexed.")
+
+@app.cli.command("recompute-statuses")
+@click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+              help="Only users with enrollments, payments or appointments since this date (YYYY-MM-DD). Default: all leads.")
+@click.option("--batch-size", default=500, help="Users per batch (one commit each).")
+def recompute_statuses_command(since, batch_size):
+    """Recomputes lead statuses in bulk."""
+    from app.statuses import recompute_statuses
+    checked, changed = recompute_statuses(since=since, batch_size=batch_size)
+    print(f"Lead statuses recomputed. {checked} users checked, {changed} changed.")
+
+@app.cli.command("rebuild-closer-leads")
+def rebuild_closer_leads_command():
+    """Rebuilds the closer portfolios (closer_leads) from enrollments, appointments and assignments."""
+    from app.portfolio import rebuild_closer_leads
+    count = rebuild_closer_leads()
+    print(f"Closer portfolios rebuilt. {count} closer-lead pairs.")
+
+@app.cli.command("status-transitions")
+def status_transitions_command():
+    """Runs the scheduled status transitions now (e.g. from cron when the in-process scheduler is off)."""
+    from app.scheduler import run_due_jobs
+    result = run_due_jobs(app, force=True).get('lead_status_transitions')
+    if result is None:
+        print("Status transitions are already running in another process.")
+    else:
+        print(f"Status transitions: {result[0]} appointments passed, {result[1]} statuses changed.")
+
+@app.cli.command("check-query-plans")
+@click.option("--verbose", is_flag=True, help="Print the full plan of every query.")
+def check_query_plans_command(verbose):
+    """EXPLAINs the hot queries and fails if one falls back to a full table scan."""
+    from app.query_plans import check_query_plans
+    failed = 0
+    for name, lines, regressions in check_query_plans():
+        print(f"{'FAIL' if regressions else 'ok'}  {name}")
+        for line in (lines if verbose else regressions):
+            print(f"      {line}")
+        failed += bool(regressions)
+    if failed:
+        raise click.ClickException(f"{failed} queries regressed to a full table scan.")
+    print("Query plans OK.")
+
+@app.cli.command("calendar-worker")
+@click.option("--interval", default=5.0, help="Seconds to sleep when the outbox is empty.")
+@click.option("--batch-size", default=50, help="Outbox entries per batch.")
+@click.option("--once", is_flag=True, help="Process a single batch and exit.")
+def calendar_worker_command(interval, batch_size, once):
+    """Drains the Google Calendar outbox (run as its own process)."""
+    from app.calendar_sync import run_calendar_worker
+    print("Calendar worker started.", flush=True)
+    settled = run_calendar_worker(interval=interval, batch_size=batch_size, once=once)
+    if once:
+        print(f"Calendar outbox: {settled} entries settled.")
+
+@app.cli.command("sales-webhook-worker")
+@click.option("--interval", default=5.0, help="Seconds to sleep when nothing is due.")
+@click.option("--once", is_flag=True, help="Deliver a single batch and exit.")
+def sales_webhook_worker_command(interval, once):
+    """Delivers queued sales webhooks (run as its own process)."""
+    from app.sales_webhooks import run_sales_webhook_worker
+    print("Sales webhook worker started.", flush=True)
+    result = run_sales_webhook_worker(interval=interval, once=once)
+    if once:
+        print(f"Sales webhooks: {result[0]} sent, {result[1]} failed.")
+
+@app.cli.command("import-worker")
+@click.option("--interval", default=5.0, help="Seconds to sleep when no job is queued.")
+@click.option("--once", is_flag=True, help="Run the next job and exit.")
+def import_worker_command(interval, once):
+    """Runs queued CSV import jobs (run as its own process)."""
+    from app.import_jobs import run_import_worker
+    print("Import worker started.", flush=True)
+    status = run_import_worker(interval=interval, once=once)
+    if once:
+        print(f"Import job: {status}" if status else "No import job queued.")
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,43 @@
+import sys
+import os
+
+# Add parent dir to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from config import Config
+from app import create_app, db
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+
+@pytest.fixture
+def app_factory():
+    """create_app + create_all on the given database (in-memory SQLite by default)."""
+    contexts = []
+
+    def make(uri='sqlite://', **config):
+        settings = dict(config, SQLALCHEMY_DATABASE_URI=uri)
+        app = create_app(type('Config', (TestConfig,), settings))
+        context = app.app_context()
+        context.push()
+        contexts.append(context)
+        db.create_all()
+        return app
+
+    yield make
+    for context in reversed(contexts):
+        db.session.remove()
+        db.drop_all()
+        context.pop()
+
+
+@pytest.fixture
+def app(app_factory):
+    return app_factory()
@@ -0,0 +1,55 @@
+"""Small builders for test rows (flushed, not committed)."""
+from datetime import datetime
+from app import db
+from app.models import User, LeadProfile, Program, Enrollment, Payment, PaymentMethod, Appointment
+
+
+def user(username, role='lead', **fields):
+    row = User(username=username, email=f"{username}@example.com", role=role, **fields)
+    db.session.add(row)
+    db.session.flush()
+    return row
+
+
+def lead(username, **profile):
+    row = user(username)
+    db.session.add(LeadProfile(user_id=row.id, status=profile.pop('status', 'new'), **profile))
+    db.session.flush()
+    return row
+
+
+def program(name='Program', price=1000.0):
+    row = Program(name=name, price=price)
+    db.session.add(row)
+    db.session.flush()
+    return row
+
+
+def method(name='Stripe', percent=0.0, fixed=0.0):
+    row = PaymentMethod(name=name, commission_percent=percent, commission_fixed=fixed)
+    db.session.add(row)
+    db.session.flush()
+    return row
+
+
+def enrollment(student, program, closer=None, **fields):
+    row = Enrollment(student_id=student.id, program_id=program.id, closer_id=closer.id if closer else None, **fields)
+    db.session.add(row)
+    db.session.flush()
+    return row
+
+
+def payment(enrollment, amount, date=None, payment_type='installment', status='completed', method=None):
+    row = Payment(enrollment_id=enrollment.id, amount=amount, date=date or datetime.utcnow(),
+                  payment_type=payment_type, status=status, payment_method_id=method.id if method else None)
+    row.snapshot_fees()
+    db.session.add(row)
+    enrollment.update_balance()
+    return row
+
+
+def appointment(closer, lead, start_time, status='scheduled'):
+    row = Appointment(closer_id=closer.id, lead_id=lead.id, start_time=start_time, status=status)
+    db.session.add(row)
+    db.session.flush()
+    return row
@@ -0,0 +1,77 @@
+"""Stored enrollment balances (Enrollment.update_balance, app/balances.py)."""
+from datetime import datetime
+
+from sqlalchemy import update
+
+import factories
+from app import db
+from app.models import Enrollment, Payment
+from app.balances import rebuild_balances, refresh_balances
+
+
+def balance(enrollment):
+    db.session.expire_all()
+    row = db.session.get(Enrollment, enrollment.id)
+    return row.paid_total, row.agreed_total, row.outstanding
+
+
+def test_payments_update_the_stored_balance(app):
+    program = factories.program(price=1000.0)
+    enrollment = factories.enrollment(factories.lead('lead'), program)
+    factories.payment(enrollment, 300.0)
+    factories.payment(enrollment, 50.0, status='pending') # Not collected yet
+    db.session.commit()
+
+    assert balance(enrollment) == (300.0, 1000.0, 700.0)
+
+
+def test_agreed_total_overrides_the_program_price(app):
+    enrollment = factories.enrollment(factories.lead('lead'), factories.program(price=1000.0), total_agreed=800.0)
+    factories.payment(enrollment, 900.0)
+    db.session.commit()
+
+    assert balance(enrollment) == (900.0, 800.0, 0.0) # Overpaid never goes negative
+
+
+def test_program_price_change_refreshes_enrollments_that_follow_it(app):
+    program = factories.program(price=1000.0)
+    follows = factories.enrollment(factories.lead('follows'), program)
+    fixed = factories.enrollment(factories.lead('fixed'), program, total_agreed=900.0)
+    factories.payment(follows, 200.0)
+    factories.payment(fixed, 200.0)
+    db.session.commit()
+
+    program.price = 1500.0
+    db.session.commit()
+
+    assert balance(follows) == (200.0, 1500.0, 1300.0)
+    assert balance(fixed) == (200.0, 900.0, 700.0)
+
+
+def test_refresh_balances_covers_bulk_inserted_payments(app):
+    enrollment = factories.enrollment(factories.lead('lead'), factories.program(price=1000.0))
+    db.session.commit()
+    db.session.execute(Payment.__table__.insert(), [
+        {'enrollment_id': enrollment.id, 'amount': 100.0, 'status': 'completed', 'date': datetime(2026, 3, 10)},
+        {'enrollment_id': enrollment.id, 'amount': 150.0, 'status': 'completed', 'date': datetime(2026, 3, 11)},
+    ])
+
+    refresh_balances([enrollment.id])
+    db.session.commit()
+
+    assert balance(enrollment) == (250.0, 1000.0, 750.0)
+
+
+def test_rebuild_reports_and_fixes_drift(app):
+    enrollment = factories.enrollment(factories.lead('lead'), factories.program(price=1000.0))
+    factories.payment(enrollment, 400.0)
+    db.session.commit()
+    db.session.execute(update(Enrollment).where(Enrollment.id == enrollment.id).values(paid_total=0.0))
+    db.session.commit()
+
+    assert [d['field'] for d in rebuild_balances(dry_run=True)] == ['paid_total']
+    assert balance(enrollment)[0] == 0.0
+
+    rebuild_balances()
+    assert balance(enrollment) == (400.0, 1000.0, 600.0)
+    assert rebuild_balances(dry_run=True) == []
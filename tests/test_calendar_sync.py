@@ -0,0 +1,139 @@
+"""Calendar outbox: enqueue with the appointment, coalesce, retry (app/calendar_sync.py)."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import factories
+from app import db
+from app.models import Appointment, CalendarOutbox
+from app.calendar_sync import process_calendar_outbox
+import app.closer.utils as closer_utils
+import app.google_auth.utils as google_utils
+
+
+class FakeCalendar:
+    """Stands in for sync_calendar_event: records (appointment_id, calendar, event_id), fails while `down`."""
+    def __init__(self):
+        self.calls = []
+        self.down = False
+
+    def __call__(self, appointment, closer_id, google_event_id=None):
+        if self.down:
+            raise RuntimeError('Google is down')
+        self.calls.append((appointment.id if appointment else None, closer_id, google_event_id))
+        return True
+
+
+@pytest.fixture
+def calendar(app, monkeypatch):
+    fake = FakeCalendar()
+    monkeypatch.setattr(closer_utils, 'sync_calendar_event', fake)
+    monkeypatch.setattr(google_utils, 'evict_calendar_service', lambda closer_id: None)
+    return fake
+
+
+def outbox():
+    db.session.expire_all()
+    return [(e.action, e.closer_id, e.status) for e in CalendarOutbox.query.order_by(CalendarOutbox.id)]
+
+
+def start():
+    return datetime(2026, 3, 10, 15)
+
+
+def test_appointment_write_enqueues_in_the_same_commit(calendar):
+    closer = factories.user('closer', role='closer')
+    factories.appointment(closer, factories.lead('lead'), start())
+    db.session.commit()
+
+    assert outbox() == [('created', closer.id, 'pending')]
+
+
+def test_rolled_back_write_enqueues_nothing(calendar):
+    closer = factories.user('closer', role='closer')
+    factories.appointment(closer, factories.lead('lead'), start())
+    db.session.rollback()
+
+    assert outbox() == []
+
+
+def test_a_new_change_supersedes_the_pending_ones(calendar):
+    closer = factories.user('closer', role='closer')
+    appt = factories.appointment(closer, factories.lead('lead'), start())
+    db.session.commit()
+    appt.start_time = start() + timedelta(hours=1)
+    db.session.commit()
+    appt.status = 'completed'
+    db.session.commit()
+
+    assert outbox() == [
+        ('created', closer.id, 'superseded'),
+        ('rescheduled', closer.id, 'superseded'),
+        ('status_changed', closer.id, 'pending'),
+    ]
+    assert process_calendar_outbox() == 1
+    assert calendar.calls == [(appt.id, closer.id, None)]
+
+
+def test_older_entries_in_a_batch_are_coalesced(calendar):
+    closer = factories.user('closer', role='closer')
+    appt = factories.appointment(closer, factories.lead('lead'), start())
+    db.session.commit()
+    # Queued without the enqueue hook (e.g. rows left from before it superseded)
+    db.session.add(CalendarOutbox(appointment_id=appt.id, closer_id=closer.id, action='rescheduled'))
+    db.session.commit()
+
+    assert process_calendar_outbox() == 2
+    assert calendar.calls == [(appt.id, closer.id, None)]
+    assert outbox() == [('created', closer.id, 'superseded'), ('rescheduled', closer.id, 'done')]
+
+
+def test_moved_appointment_syncs_to_the_new_closer_and_deletes_from_the_old(calendar):
+    old, new = factories.user('old', role='closer'), factories.user('new', role='closer')
+    appt = factories.appointment(old, factories.lead('lead'), start())
+    appt.google_event_id = 'evt-1'
+    db.session.commit()
+    calendar.down = True
+    process_calendar_outbox() # 'created' for the old closer now waits on a retry
+    calendar.down = False
+
+    appt.closer_id = new.id
+    db.session.commit()
+    db.session.query(CalendarOutbox).update({'next_attempt_at': datetime.utcnow()})
+    db.session.commit()
+
+    process_calendar_outbox()
+    assert (None, old.id, 'evt-1') in calendar.calls
+    assert (appt.id, new.id, None) in calendar.calls
+    assert all(closer_id == new.id for appt_id, closer_id, _ in calendar.calls if appt_id)
+
+
+def test_entry_syncs_to_the_closer_the_appointment_has_now(calendar):
+    old, new = factories.user('old', role='closer'), factories.user('new', role='closer')
+    appt = factories.appointment(old, factories.lead('lead'), start())
+    db.session.commit()
+    # Reassigned in bulk, so the pending 'created' entry still names the old closer
+    db.session.query(Appointment).filter_by(id=appt.id).update({'closer_id': new.id})
+    db.session.commit()
+
+    assert process_calendar_outbox() == 1
+    assert calendar.calls == [(appt.id, new.id, None)]
+
+
+def test_failure_backs_off_and_blocks_the_closers_later_entries(calendar, caplog):
+    closer = factories.user('closer', role='closer')
+    first = factories.appointment(closer, factories.lead('first'), start())
+    db.session.commit()
+    factories.appointment(closer, factories.lead('second'), start() + timedelta(hours=1))
+    db.session.commit()
+
+    calendar.down = True
+    assert process_calendar_outbox() == 0
+    entry = CalendarOutbox.query.filter_by(appointment_id=first.id).one()
+    assert entry.attempts == 1 and 'Google is down' in entry.last_error
+    assert entry.next_attempt_at > datetime.utcnow()
+    assert f"Calendar sync failed for outbox {entry.id} (attempt 1)" in caplog.text
+
+    calendar.down = False
+    assert process_calendar_outbox() == 0 # Still backing off, the second entry waits behind it
+    assert calendar.calls == []
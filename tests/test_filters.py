@@ -0,0 +1,126 @@
+"""FilterSpec: the KPIs of a list page agree with its rows (app/filters.py)."""
+from datetime import datetime
+
+import pytest
+
+import factories
+from app import db
+from app.filters import (FilterSpec, LEAD_SORTS, SALE_ORDER, lead_ids_cte, lead_page_query, lead_kpis,
+                         payment_ids_cte, sale_page_query, sale_kpis, COMMISSION_RATE)
+from app.queries import keyset_page
+
+
+@pytest.fixture
+def book(app):
+    """Two closers' portfolios: leads in two programs, fees on one method, a pending payment."""
+    rows = {
+        'closer': factories.user('closer', role='closer'),
+        'other': factories.user('other', role='closer'),
+        'main': factories.program('Main', price=1000.0),
+        'side': factories.program('Side', price=300.0),
+    }
+    stripe = factories.method('Stripe', percent=10.0)
+    sales = [
+        ('ana', 'main', 'closer', [(400.0, datetime(2026, 3, 2)), (100.0, datetime(2026, 3, 20))]),
+        ('bea', 'main', 'closer', [(1000.0, datetime(2026, 3, 5))]),
+        ('carla', 'side', 'closer', [(100.0, datetime(2026, 4, 1))]),
+        ('dani', 'main', 'other', [(250.0, datetime(2026, 3, 8))]),
+    ]
+    for name, program, closer, payments in sales:
+        lead = factories.lead(name)
+        lead.created_at = payments[0][1]
+        enrollment = factories.enrollment(lead, rows[program], closer=rows[closer])
+        for amount, date in payments:
+            factories.payment(enrollment, amount, date=date, method=stripe)
+        rows[name] = enrollment
+    factories.payment(rows['ana'], 50.0, date=datetime(2026, 3, 21), status='pending', method=stripe)
+    factories.lead('eva', status='agenda').created_at = datetime(2026, 3, 15) # No sale, nobody's portfolio
+    db.session.commit() # Fills the portfolios (closer_leads) from the enrollments
+    return rows
+
+
+def pages(query, order):
+    rows, cursor = [], None
+    while True:
+        page, cursor, _ = keyset_page(query, order, 2, cursor)
+        rows += page
+        if not cursor:
+            return rows
+
+
+def lead_page(spec, closer_id=None):
+    base = lead_ids_cte(spec, closer_id)
+    return pages(lead_page_query(base), LEAD_SORTS[spec.sort_by]), lead_kpis(spec, base, closer_id)
+
+
+def sale_page(spec, closer_id=None):
+    base = payment_ids_cte(spec, closer_id)
+    return pages(sale_page_query(base), SALE_ORDER), sale_kpis(spec, base, closer_id)
+
+
+def expected_debt(enrollments):
+    return sum(max(e.program.price - e.paid_total, 0.0) for e in enrollments)
+
+
+@pytest.mark.parametrize('args', [
+    {},
+    {'program': 'main'},
+    {'start_date': '2026-03-01', 'end_date': '2026-03-10'},
+    {'status': 'new', 'sort_by': 'a-z'},
+])
+def test_lead_kpis_add_up_the_rows_on_the_page(book, args):
+    args = {**args, 'program': str(book[args['program']].id)} if 'program' in args else args
+    spec = FilterSpec.from_args(args)
+
+    for closer_id in (None, book['closer'].id):
+        rows, kpis = lead_page(spec, closer_id)
+
+        enrollments = [e for e in (book[u.username] for u in rows if u.username in book)
+                       if (not closer_id or e.closer_id == closer_id)
+                       and (not spec.program_id or e.program_id == spec.program_id)]
+        payments = [p for e in enrollments for p in e.payments if p.status == 'completed']
+        cash = sum(p.cash_collect for p in payments)
+        assert kpis['total'] == len(rows)
+        assert kpis['cash_collected'] == pytest.approx(cash)
+        assert kpis['my_commission'] == pytest.approx(cash * COMMISSION_RATE)
+        assert kpis['debt'] == pytest.approx(expected_debt(enrollments))
+
+
+def test_lead_filters_select_the_expected_rows(book):
+    names = lambda args, closer_id=None: sorted(u.username for u in lead_page(FilterSpec.from_args(args), closer_id)[0])
+
+    assert names({}) == ['ana', 'bea', 'carla', 'dani', 'eva']
+    assert names({}, book['closer'].id) == ['ana', 'bea', 'carla']
+    assert names({'program': str(book['side'].id)}) == ['carla']
+    assert names({'status': 'agenda'}) == ['eva']
+    assert names({'start_date': '2026-03-05', 'end_date': '2026-03-08'}) == ['bea', 'dani'] # End day inclusive
+
+
+@pytest.mark.parametrize('args', [
+    {},
+    {'start_date': '2026-03-01', 'end_date': '2026-03-20'},
+    {'type': 'installment', 'program': 'main'},
+])
+def test_sale_kpis_add_up_the_rows_on_the_page(book, args):
+    args = {**args, 'program': str(book[args['program']].id)} if 'program' in args else args
+    spec = FilterSpec.from_args(args)
+
+    for closer_id in (None, book['closer'].id):
+        rows, kpis = sale_page(spec, closer_id)
+
+        assert kpis['count'] == len(rows)
+        assert kpis['revenue'] == pytest.approx(sum(p.amount for p in rows))
+        assert kpis['cash_collected'] == pytest.approx(sum(p.amount - p.platform_fee for p in rows))
+        assert kpis['my_commission'] == pytest.approx(kpis['cash_collected'] * COMMISSION_RATE)
+        # Debt is the current state of the closer's (program's) clients, whatever the dates
+        owing = [e for e in (book[name] for name in ('ana', 'bea', 'carla', 'dani'))
+                 if (not closer_id or e.closer_id == closer_id)
+                 and (not spec.program_id or e.program_id == spec.program_id)]
+        assert kpis['debt'] == pytest.approx(expected_debt(owing))
+
+
+def test_sale_date_range_is_by_payment_date(book):
+    rows, kpis = sale_page(FilterSpec.from_args({'start_date': '2026-03-20', 'end_date': '2026-03-21'}))
+
+    assert [(p.enrollment.student.username, p.amount) for p in rows] == [('ana', 50.0), ('ana', 100.0)]
+    assert kpis['count'] == 2
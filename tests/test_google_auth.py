@@ -0,0 +1,93 @@
+"""Per-process Google Calendar client cache (app/google_auth/utils.py)."""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from google.oauth2.credentials import Credentials
+
+import factories
+from app import db
+from app.models import GoogleCalendarToken
+import app.google_auth.utils as google_utils
+
+
+@pytest.fixture
+def builds(app, monkeypatch):
+    """Counts client builds; services are plain objects (no discovery, no HTTP)."""
+    built = []
+    def build(document, credentials):
+        built.append(credentials)
+        return object()
+    monkeypatch.setattr(google_utils, 'build_from_document', build)
+    monkeypatch.setattr(google_utils, 'get_calendar_discovery', lambda: {})
+    google_utils._clients.clear()
+    yield built
+    google_utils._clients.clear()
+
+
+def connect(user, token='access-1', expiry=None):
+    data = {'token': token, 'refresh_token': 'refresh', 'token_uri': 'https://oauth2.googleapis.com/token',
+            'client_id': 'id', 'client_secret': 'secret', 'scopes': None,
+            'expiry': (expiry or datetime.utcnow() + timedelta(hours=1)).isoformat()}
+    entry = GoogleCalendarToken.query.filter_by(user_id=user.id).first() or GoogleCalendarToken(user_id=user.id)
+    entry.token_json = json.dumps(data)
+    db.session.add(entry)
+    db.session.commit()
+
+
+def stored_token(user):
+    db.session.expire_all()
+    return json.loads(GoogleCalendarToken.query.filter_by(user_id=user.id).one().token_json)['token']
+
+
+def test_client_is_cached_while_the_token_row_is_unchanged(builds):
+    closer = factories.user('closer', role='closer')
+    connect(closer)
+
+    first = google_utils.get_calendar_service(closer.id)
+    assert google_utils.get_calendar_service(closer.id) is first
+    assert len(builds) == 1
+
+
+def test_token_changed_by_another_process_rebuilds_the_client(builds):
+    closer = factories.user('closer', role='closer')
+    connect(closer)
+    first = google_utils.get_calendar_service(closer.id)
+
+    connect(closer, token='access-2') # Reconnected elsewhere: this process' cache wasn't evicted
+
+    assert google_utils.get_calendar_service(closer.id) is not first
+    assert builds[-1].token == 'access-2'
+
+
+def test_disconnected_token_drops_the_client(builds):
+    closer = factories.user('closer', role='closer')
+    connect(closer)
+    google_utils.get_calendar_service(closer.id)
+
+    GoogleCalendarToken.query.filter_by(user_id=closer.id).delete()
+    db.session.commit()
+
+    assert google_utils.get_calendar_service(closer.id) is None
+    assert closer.id not in google_utils._clients
+
+
+def test_refreshed_token_is_left_for_the_callers_commit(builds, monkeypatch):
+    def refresh(self, request):
+        self.token = 'access-2'
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+    monkeypatch.setattr(Credentials, 'refresh', refresh)
+    closer = factories.user('closer', role='closer')
+    connect(closer, expiry=datetime.utcnow() + timedelta(minutes=1))
+
+    service = google_utils.get_calendar_service(closer.id)
+    db.session.rollback()
+    assert stored_token(closer) == 'access-1' # Not committed behind the caller's back
+
+    google_utils.evict_calendar_service(closer.id)
+    assert google_utils.get_calendar_service(closer.id) is not service
+    db.session.commit()
+    assert stored_token(closer) == 'access-2'
+    # Our own write doesn't make the cached client look stale
+    assert google_utils.get_calendar_service(closer.id) is google_utils._clients[closer.id]['service']
+    assert len(builds) == 2
@@ -0,0 +1,65 @@
+"""Background CSV import jobs: claim, progress, resume (app/import_jobs.py)."""
+import io
+from datetime import datetime, timedelta
+
+from werkzeug.datastructures import FileStorage
+
+from app import db
+from app.models import User, ImportJob
+import app.importer as importer
+from app.import_jobs import enqueue_import, claim_job, run_job, retry_job, error_report, job_status
+
+
+def upload(*rows):
+    data = '\n'.join(['email,username', *rows]).encode('utf-8')
+    return FileStorage(stream=io.BytesIO(data), filename='agendas.csv')
+
+
+def leads(count):
+    return [f"lead{i}@example.com,lead{i}" for i in range(count)]
+
+
+def test_job_runs_to_done_with_counters_and_rejected_rows(app):
+    app.config['IMPORT_BATCH_SIZE'] = 2
+    job = enqueue_import('agendas', upload(*leads(3), ',no-email'))
+
+    run_job(claim_job())
+
+    status = job_status(job)
+    assert (status['status'], status['rows_read'], status['created'], status['errors']) == ('done', 4, 3, 1)
+    assert error_report(job).splitlines() == ['row,reason,email,username', '4,Falta el email,,no-email']
+
+
+def test_failed_job_resumes_after_its_last_committed_batch(app, monkeypatch):
+    app.config['IMPORT_BATCH_SIZE'] = 2
+    job = enqueue_import('agendas', upload(*leads(5)))
+    write_profiles = importer._write_profiles
+    calls = []
+    def flaky(*args):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError('connection lost')
+        write_profiles(*args)
+    monkeypatch.setattr(importer, '_write_profiles', flaky)
+
+    run_job(claim_job())
+    assert (job.status, job.rows_read, job.created) == ('failed', 2, 2)
+    assert 'connection lost' in job.last_error
+    assert User.query.count() == 2 # The failed batch left nothing behind
+
+    retry_job(job)
+    run_job(claim_job())
+    assert (job.status, job.rows_read, job.created) == ('done', 5, 5)
+    assert User.query.count() == 5
+
+
+def test_only_queued_or_abandoned_jobs_are_claimed(app):
+    app.config['IMPORT_JOB_STALE_SECONDS'] = 60
+    job = enqueue_import('agendas', upload(*leads(1)))
+    assert claim_job() == job
+    assert claim_job() is None # Running, heartbeat fresh
+
+    job.heartbeat_at = datetime.utcnow() - timedelta(minutes=5) # Its worker died
+    db.session.commit()
+    assert claim_job() == job
+    assert db.session.get(ImportJob, job.id).status == 'running'
@@ -0,0 +1,104 @@
+"""Streaming CSV import (app/importer.py)."""
+import io
+
+import factories
+from app import db
+from app.models import User, LeadProfile, Enrollment
+from app.importer import import_agendas, import_users, import_payments
+from app.queries import match_leads_by_contact
+
+
+def csv_file(header, *rows):
+    return io.BytesIO('\n'.join([header, *rows]).encode('utf-8'))
+
+
+def lead_with_contact(username, phone=None, instagram=None):
+    user = factories.user(username)
+    db.session.add(LeadProfile(user_id=user.id, phone=phone, instagram=instagram, status='new'))
+    db.session.commit()
+    return user
+
+
+def profile_of(email):
+    return LeadProfile.query.join(User, User.id == LeadProfile.user_id).filter(User.email == email).one()
+
+
+def test_contact_match_creates_a_flagged_lead_instead_of_merging(app):
+    known = lead_with_contact('known', phone='+591 7000-1234')
+
+    result = import_agendas(csv_file('email,username,phone', 'new@example.com,new,59170001234'))
+
+    assert result['created'] == 1
+    profile = profile_of('new@example.com')
+    assert profile.notes == f"Posible duplicado del lead #{known.id} (mismo teléfono o Instagram)."
+    assert db.session.get(User, known.id).email == 'known@example.com'
+
+
+def test_users_import_flags_instagram_matches(app):
+    known = lead_with_contact('known', instagram='@Juan.Perez')
+
+    import_users(csv_file('email,username,role,instagram', 'juan@example.com,juan,lead,instagram.com/juan.perez'))
+
+    assert str(known.id) in profile_of('juan@example.com').notes
+
+
+def test_email_match_updates_the_existing_lead(app):
+    lead_with_contact('known')
+
+    result = import_agendas(csv_file('email,phone', 'KNOWN@example.com,59170001234'))
+
+    assert result['updated'] == 1 and result['created'] == 0
+    assert profile_of('known@example.com').phone == '59170001234'
+    assert User.query.count() == 1
+    assert profile_of('known@example.com').notes is None
+
+
+def test_short_contact_keys_never_match(app):
+    lead_with_contact('known', phone='123', instagram='@ab')
+
+    assert match_leads_by_contact(['123'], ['ab']) == ({}, {})
+
+    import_agendas(csv_file('email,phone,instagram', 'new@example.com,123,ab'))
+    assert profile_of('new@example.com').notes is None
+
+
+def test_chunks_commit_separately_and_report_each(app):
+    reported = []
+    rows = [f"lead{i}@example.com,lead" for i in range(5)] + [',nobody', 'lead0@example.com,lead']
+
+    result = import_agendas(csv_file('email,username', *rows), batch_size=3,
+                            on_chunk=lambda read, counts, rejected: reported.append((read, dict(counts), rejected)))
+
+    assert [read for read, _, _ in reported] == [3, 3, 1]
+    assert reported[1][2][0][:2] == (6, 'Falta el email')
+    assert (result['rows'], result['created'], result['updated'], result['errors']) == (7, 5, 1, 1)
+    # One base username, unique suffixes across chunks
+    assert sorted(u.username for u in User.query) == ['lead', 'lead1', 'lead2', 'lead3', 'lead4']
+
+
+def test_start_row_resumes_after_the_committed_rows(app):
+    data = [f"lead{i}@example.com,lead{i}" for i in range(4)]
+    import_agendas(csv_file('email,username', *data[:2]))
+
+    result = import_agendas(csv_file('email,username', *data), start_row=2, batch_size=10)
+
+    assert (result['rows'], result['created']) == (2, 2)
+    assert User.query.count() == 4
+
+
+def test_payments_import_creates_enrollments_and_skips_repeats(app):
+    lead = factories.lead('lead')
+    factories.program(name='Mentoria', price=1000.0)
+    db.session.commit()
+    rows = ['lead@example.com,Mentoria,300,2026-03-10,down_payment',
+            'lead@example.com,Mentoria,200,2026-03-11,installment',
+            'lead@example.com,Nope,100,2026-03-11,installment']
+    data = csv_file('email,program,amount,date,type', *rows)
+
+    result = import_payments(data, batch_size=2)
+    again = import_payments(csv_file('email,program,amount,date,type', *rows[:2]))
+
+    assert (result['created'], result['enrollments'], result['errors']) == (2, 1, 1)
+    assert (again['created'], again['skipped']) == (0, 2)
+    enrollment = Enrollment.query.filter_by(student_id=lead.id).one()
+    assert (enrollment.paid_total, enrollment.outstanding) == (500.0, 500.0)
@@ -0,0 +1,72 @@
+"""Keyset pagination cursors (app/queries.py keyset_page, app/filters.py orders)."""
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+import factories
+from app import db
+from app.models import User, Payment
+from app.filters import LEAD_SORTS, SALE_ORDER
+from app.queries import keyset_page, _cursor_serializer
+
+
+def all_pages(query, order, per_page):
+    seen, cursor, starts = [], None, []
+    while True:
+        rows, cursor, start = keyset_page(query, order, per_page, cursor)
+        seen += rows
+        starts.append(start)
+        if not cursor:
+            return seen, starts
+        assert len(starts) < 50, 'pagination does not advance'
+
+
+@pytest.fixture
+def leads(app):
+    day = datetime(2026, 3, 10)
+    users = [factories.user(f"lead{i}", created_at=day + timedelta(days=i % 3)) for i in range(7)] # Ties
+    users += [factories.user(f"legacy{i}") for i in range(4)]
+    db.session.flush()
+    User.query.filter(User.username.startswith('legacy')).update({'created_at': None}, synchronize_session=False)
+    db.session.commit()
+    return users
+
+
+@pytest.mark.parametrize('sort', list(LEAD_SORTS))
+def test_every_lead_sort_visits_each_row_once(leads, sort):
+    rows, starts = all_pages(User.query, LEAD_SORTS[sort], per_page=3)
+
+    assert sorted(u.id for u in rows) == sorted(u.id for u in leads)
+    assert starts == [0, 3, 6, 9]
+
+
+def test_users_without_created_at_sort_as_the_oldest(leads):
+    rows, _ = all_pages(User.query, LEAD_SORTS['newest'], per_page=4)
+
+    assert [u.username for u in rows[-4:]] == ['legacy3', 'legacy2', 'legacy1', 'legacy0']
+
+
+def test_sales_order_pages_with_eager_loads(app):
+    lead = factories.lead('lead')
+    enrollment = factories.enrollment(lead, factories.program())
+    for i in range(5):
+        factories.payment(enrollment, 100.0 + i, date=datetime(2026, 3, 10 + i % 2))
+    db.session.commit()
+
+    rows, _ = all_pages(Payment.query, SALE_ORDER, per_page=2)
+
+    assert len({p.id for p in rows}) == 5
+    assert [p.date for p in rows] == sorted((p.date for p in rows), reverse=True)
+
+
+def test_unverified_cursor_is_a_bad_request(leads):
+    with pytest.raises(BadRequest):
+        keyset_page(User.query, LEAD_SORTS['newest'], 3, 'garbage')
+
+
+def test_verified_cursor_that_does_not_decode_is_a_bad_request(leads):
+    cursor = _cursor_serializer().dumps({'v': [1], 'n': 3}) # One key where the order has two
+
+    with pytest.raises(BadRequest):
+        keyset_page(User.query, LEAD_SORTS['newest'], 3, cursor)
@@ -0,0 +1,110 @@
+"""Duplicate payment protection: fingerprint, unique index and the sale forms."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import factories
+from app import db
+from app.models import Payment, DUPLICATE_MARKER
+
+
+@pytest.fixture
+def enrollment(app):
+    row = factories.enrollment(factories.lead('lead'), factories.program(price=1000.0))
+    db.session.commit()
+    return row
+
+
+def test_fingerprint_is_enrollment_amount_type_and_day(enrollment):
+    payment = factories.payment(enrollment, 100.0, date=datetime(2026, 3, 10, 18, 30))
+    db.session.commit()
+
+    assert payment.fingerprint == f"{enrollment.id}:10000:installment:2026-03-10"
+
+
+def test_same_payment_twice_is_rejected_by_the_index(enrollment):
+    factories.payment(enrollment, 100.0, date=datetime(2026, 3, 10, 9))
+    db.session.commit()
+
+    with pytest.raises(IntegrityError):
+        factories.payment(enrollment, 100.0, date=datetime(2026, 3, 10, 17)) # Same day; flushed by update_balance
+
+
+def test_is_duplicate_checks_completed_payments_only(enrollment):
+    factories.payment(enrollment, 100.0, date=datetime(2026, 3, 10))
+    db.session.commit()
+
+    same = Payment(enrollment_id=enrollment.id, amount=100.0, payment_type='installment', date=datetime(2026, 3, 10), status='completed')
+    pending = Payment(enrollment_id=enrollment.id, amount=100.0, payment_type='installment', date=datetime(2026, 3, 10), status='pending')
+    other_day = Payment(enrollment_id=enrollment.id, amount=100.0, payment_type='installment', date=datetime(2026, 3, 11), status='completed')
+
+    assert same.is_duplicate()
+    assert not pending.is_duplicate()
+    assert not other_day.is_duplicate()
+
+
+def test_edited_payment_is_checked_against_the_others_not_itself(enrollment):
+    first = factories.payment(enrollment, 100.0, date=datetime(2026, 3, 10))
+    second = factories.payment(enrollment, 150.0, date=datetime(2026, 3, 10))
+    db.session.commit()
+
+    second.payment_method_id = None
+    assert not second.is_duplicate() # Unchanged key, only its own row has it
+    second.amount = 100.0
+    assert second.is_duplicate()
+    db.session.rollback()
+
+
+def test_legacy_duplicate_keeps_its_marker(enrollment):
+    payment = factories.payment(enrollment, 100.0, date=datetime(2026, 3, 10))
+    db.session.flush()
+    payment.fingerprint = f"{DUPLICATE_MARKER}{payment.id}"
+    db.session.commit()
+
+    payment.amount = 120.0
+    db.session.commit()
+
+    assert payment.fingerprint == f"{DUPLICATE_MARKER}{payment.id}"
+
+
+@pytest.fixture
+def closer_client(app, enrollment):
+    # The layout links to admin pages whose views aren't all in this tree
+    app.url_build_error_handlers.append(lambda error, endpoint, values: '#')
+    closer = factories.user('closer', role='closer')
+    enrollment.closer_id = closer.id
+    factories.method()
+    db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(closer.id)
+        session['_fresh'] = True
+    return client
+
+
+def edit_sale(client, payment, amount):
+    enrollment = payment.enrollment
+    return client.post(f"/closer/sale/edit/{payment.id}", data={
+        'lead_id': enrollment.student_id, 'program_id': enrollment.program_id,
+        'amount': amount, 'payment_type': payment.payment_type, 'payment_method_id': payment.payment_method_id or 1
+    })
+
+
+def test_edit_sale_refuses_to_duplicate_another_payment(closer_client, enrollment):
+    today = datetime.utcnow()
+    first = factories.payment(enrollment, 101.0, date=today)
+    second = factories.payment(enrollment, 151.0, date=today)
+    db.session.commit()
+
+    response = edit_sale(closer_client, second, 101)
+
+    assert 'ya fue registrado' in response.get_data(as_text=True)
+    db.session.expire_all()
+    assert db.session.get(Payment, second.id).amount == 151.0
+
+    response = edit_sale(closer_client, second, 120)
+    assert response.status_code == 302
+    db.session.expire_all()
+    assert db.session.get(Payment, second.id).amount == 120.0
+    assert db.session.get(Payment, first.id).amount == 101.0
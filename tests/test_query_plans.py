@@ -0,0 +1,10 @@
+"""Hot queries use their indexes on a fresh schema (app/query_plans.py)."""
+from app.query_plans import HOT_QUERIES, check_query_plans
+
+
+def test_no_hot_query_scans_an_indexed_table(app):
+    results = check_query_plans()
+
+    assert [name for name, _, _ in results] == list(HOT_QUERIES)
+    regressions = {name: lines for name, lines, scans in results if scans}
+    assert regressions == {}
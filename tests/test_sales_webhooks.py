@@ -0,0 +1,150 @@
+"""
+Sales webhook delivery against a stub HTTP server on localhost: success,
+batching, retry with backoff and dead-lettering (app/sales_webhooks.py).
+
+Run with `pytest tests`.
+"""
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from config import Config
+from app import create_app, db
+from app.models import SalesWebhookEvent
+from app.sales_webhooks import deliver_sales_webhooks, retry_dead_events, MAX_ATTEMPTS
+
+
+class StubWebhook(HTTPServer):
+    """Records every POST; answers with the queued status codes, then 200."""
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.requests = []
+        self.statuses = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/webhook"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append({'body': json.loads(body), 'key': self.headers.get('Idempotency-Key')})
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = StubWebhook()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app(stub):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+        VENTAS_WEBHOOK = stub.url
+        SALES_WEBHOOK_TIMEOUT = 2
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def queue(count):
+    events = [
+        SalesWebhookEvent(idempotency_key=f"payment-{i}", payload=json.dumps({'cliente': f"lead{i}", 'monto': 100.0 * i}))
+        for i in range(1, count + 1)
+    ]
+    db.session.add_all(events)
+    db.session.commit()
+    return events
+
+
+def make_due(events):
+    # Skip the backoff wait, as if the retry time had passed
+    for event in events:
+        event.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+
+
+def test_delivers_each_event_with_its_idempotency_key(app, stub):
+    events = queue(2)
+
+    assert deliver_sales_webhooks() == (2, 0)
+
+    assert [r['key'] for r in stub.requests] == ['payment-1', 'payment-2']
+    assert stub.requests[0]['body'] == {'cliente': 'lead1', 'monto': 100.0}
+    assert all(e.status == 'sent' and e.sent_at for e in events)
+    # Nothing left to send
+    assert deliver_sales_webhooks() == (0, 0)
+    assert len(stub.requests) == 2
+
+
+def test_batches_several_events_per_post(app, stub):
+    app.config['SALES_WEBHOOK_BATCH_SIZE'] = 2
+    queue(3)
+
+    assert deliver_sales_webhooks() == (3, 0)
+
+    assert len(stub.requests) == 2
+    assert [e['cliente'] for e in stub.requests[0]['body']['events']] == ['lead1', 'lead2']
+    assert stub.requests[0]['key'].startswith('batch-')
+    assert stub.requests[1]['body'] == {'cliente': 'lead3', 'monto': 300.0}
+
+
+def test_failed_delivery_backs_off_then_succeeds(app, stub, caplog):
+    stub.statuses = [500]
+    event, = queue(1)
+
+    assert deliver_sales_webhooks() == (0, 1)
+    assert 'Sales webhook failed for 1 event(s)' in caplog.text
+    assert event.status == 'pending'
+    assert event.attempts == 1
+    assert '500' in event.last_error
+    assert event.next_attempt_at > datetime.utcnow()
+    # Not due yet
+    assert deliver_sales_webhooks() == (0, 0)
+
+    make_due([event])
+    assert deliver_sales_webhooks() == (1, 0)
+    assert event.status == 'sent'
+    assert event.last_error is None
+    # Same key on the retry, so the receiver can drop a duplicate
+    assert [r['key'] for r in stub.requests] == ['payment-1', 'payment-1']
+
+
+def test_event_goes_dead_after_max_attempts_and_can_be_retried(app, stub):
+    stub.statuses = [500] * MAX_ATTEMPTS
+    event, = queue(1)
+
+    for _ in range(MAX_ATTEMPTS):
+        make_due([event])
+        deliver_sales_webhooks()
+    assert event.status == 'dead'
+    assert event.attempts == MAX_ATTEMPTS
+    # Dead events are not retried by the worker
+    assert deliver_sales_webhooks() == (0, 0)
+
+    assert retry_dead_events() == 1
+    db.session.expire_all()
+    assert deliver_sales_webhooks() == (1, 0)
+    assert db.session.get(SalesWebhookEvent, event.id).status == 'sent'
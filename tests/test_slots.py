@@ -0,0 +1,102 @@
+"""Atomic slot claims on the partial unique index (app/slots.py)."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+
+import factories
+from app import db
+from app.models import Appointment, BookingSlot
+from app.slots import claim_slot, reserve_slot
+
+
+@pytest.fixture
+def start():
+    return (datetime.utcnow() + timedelta(days=2)).replace(minute=0, second=0, microsecond=0)
+
+
+def slot(closer, start):
+    db.session.add(BookingSlot(closer_id=closer.id, utc_start=start, is_booked=False))
+    db.session.flush()
+
+
+def is_booked(closer, start):
+    return db.session.query(BookingSlot.is_booked).filter_by(closer_id=closer.id, utc_start=start).scalar()
+
+
+def test_claim_books_the_slot(app, start):
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    lead = factories.lead('lead')
+    slot(closer, start)
+    db.session.commit()
+
+    appt = claim_slot(closer.id, lead.id, start)
+
+    assert appt.id and appt.status == 'scheduled'
+    assert is_booked(closer, start)
+
+
+def test_second_claim_of_the_same_slot_loses(app, start):
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    first, second = factories.lead('first'), factories.lead('second')
+    db.session.commit()
+    assert claim_slot(closer.id, first.id, start)
+
+    # Work the caller had pending survives the lost claim (only the savepoint is undone)
+    second.username = 'renamed'
+    assert claim_slot(closer.id, second.id, start) is None
+    db.session.commit()
+
+    assert Appointment.query.filter_by(closer_id=closer.id, start_time=start).count() == 1
+    db.session.expire_all()
+    assert second.username == 'renamed'
+
+
+def test_claim_loses_to_a_row_committed_by_another_connection(app_factory, tmp_path, start):
+    uri = f"sqlite:///{tmp_path / 'slots.db'}"
+    app_factory(uri)
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    first, second = factories.lead('first'), factories.lead('second')
+    db.session.commit()
+
+    other = create_engine(uri)
+    with other.begin() as conn:
+        conn.execute(Appointment.__table__.insert().values(
+            closer_id=closer.id, lead_id=first.id, start_time=start, status='scheduled'
+        ))
+    other.dispose()
+
+    assert claim_slot(closer.id, second.id, start) is None
+
+
+def test_canceled_appointment_frees_the_slot(app, start):
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    factories.appointment(closer, factories.lead('first'), start, status='canceled')
+    second = factories.lead('second')
+    db.session.commit()
+
+    assert claim_slot(closer.id, second.id, start)
+
+
+def test_other_integrity_errors_are_raised(app, start):
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    db.session.commit()
+
+    with pytest.raises(IntegrityError):
+        claim_slot(closer.id, None, start) # lead_id is NOT NULL
+
+
+def test_reserve_falls_back_to_another_closer_at_the_same_time(app, start):
+    taken, free = factories.user('taken', role='closer'), factories.user('free', role='closer')
+    slot(taken, start)
+    slot(free, start)
+    factories.appointment(taken, factories.lead('first'), start)
+    second = factories.lead('second')
+    db.session.commit()
+
+    appt, suggestion = reserve_slot(taken.id, second.id, start)
+
+    assert suggestion is None
+    assert appt.closer_id == free.id
+    assert is_booked(free, start)
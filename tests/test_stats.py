@@ -0,0 +1,103 @@
+"""CloserDailyStats rollups kept current on commit (app/stats.py)."""
+from datetime import datetime, date, timedelta
+
+from sqlalchemy import text
+
+import factories
+from app import db
+from app.models import CloserDailyStats
+from app.stats import rebuild_daily_stats, refresh_daily_stats
+import app.stats as stats
+
+
+def day_stats(closer, day):
+    db.session.expire_all()
+    return CloserDailyStats.query.filter_by(closer_id=closer.id, date=day).one()
+
+
+def test_commit_rolls_up_the_touched_day(app):
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    lead = factories.lead('lead')
+    program = factories.program(price=900.0)
+    start = datetime(2026, 3, 10, 15)
+    factories.appointment(closer, lead, start, status='completed')
+    factories.appointment(closer, factories.lead('other'), start + timedelta(hours=1), status='no_show')
+    enrollment = factories.enrollment(lead, program, closer, enrollment_date=start)
+    factories.payment(enrollment, 300.0, date=start)
+    db.session.commit()
+
+    row = day_stats(closer, date(2026, 3, 10))
+    assert (row.calls_scheduled, row.calls_completed, row.calls_no_show) == (2, 1, 1)
+    assert (row.sales_count, row.sales_amount, row.cash_collected) == (1, 900.0, 300.0)
+
+
+def test_moving_a_write_refreshes_both_days(app):
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    appt = factories.appointment(closer, factories.lead('lead'), datetime(2026, 3, 10, 15))
+    db.session.commit()
+
+    appt.start_time = datetime(2026, 3, 11, 15)
+    db.session.commit()
+
+    assert day_stats(closer, date(2026, 3, 10)).calls_scheduled == 0
+    assert day_stats(closer, date(2026, 3, 11)).calls_scheduled == 1
+
+
+def test_days_follow_the_closer_timezone(app):
+    closer = factories.user('closer', role='closer', timezone='America/La_Paz') # UTC-4
+    factories.appointment(closer, factories.lead('lead'), datetime(2026, 3, 11, 2)) # 22:00 on the 10th, local
+    db.session.commit()
+
+    assert day_stats(closer, date(2026, 3, 10)).calls_scheduled == 1
+
+
+def test_upsert_keeps_the_report_fields(app):
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    row = refresh_daily_stats(closer.id, date(2026, 3, 10))
+    row.self_generated_bookings = 4
+    row.report_submitted_at = datetime(2026, 3, 10, 23)
+    db.session.commit()
+
+    factories.appointment(closer, factories.lead('lead'), datetime(2026, 3, 10, 15))
+    db.session.commit()
+
+    row = day_stats(closer, date(2026, 3, 10))
+    assert row.calls_scheduled == 1
+    assert row.self_generated_bookings == 4
+    assert row.report_submitted_at == datetime(2026, 3, 10, 23)
+
+
+def test_row_created_by_a_concurrent_commit_is_updated_not_duplicated(app, monkeypatch):
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    db.session.commit()
+
+    # Another transaction creates the day's row after this commit computed its
+    # counters (on SQLite, written through the same connection: one writer only)
+    counters = stats.daily_counters
+    def racing_counters(closer_id, day, tz):
+        values = counters(closer_id, day, tz)
+        db.session.execute(text(
+            "INSERT INTO closer_daily_stats (closer_id, date, calls_scheduled, self_generated_bookings) "
+            "VALUES (:closer_id, :day, 0, 2)"
+        ), {'closer_id': closer_id, 'day': day})
+        return values
+    monkeypatch.setattr(stats, 'daily_counters', racing_counters)
+
+    factories.appointment(closer, factories.lead('lead'), datetime(2026, 3, 10, 15))
+    db.session.commit() # Used to fail on _closer_date_uc
+
+    row = day_stats(closer, date(2026, 3, 10))
+    assert row.calls_scheduled == 1
+    assert row.self_generated_bookings == 2
+
+
+def test_rebuild_matches_the_live_rollup(app):
+    closer = factories.user('closer', role='closer', timezone='UTC')
+    factories.appointment(closer, factories.lead('lead'), datetime(2026, 3, 10, 15), status='completed')
+    db.session.commit()
+    CloserDailyStats.query.delete()
+    db.session.commit()
+
+    assert rebuild_daily_stats(date(2026, 3, 9), date(2026, 3, 11), closer_id=closer.id) == 3
+    assert day_stats(closer, date(2026, 3, 10)).calls_completed == 1
+    assert day_stats(closer, date(2026, 3, 9)).calls_scheduled == 0
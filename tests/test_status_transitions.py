@@ -0,0 +1,87 @@
+"""Watermarked 'agenda' transitions and the job lock (app/statuses.py, app/scheduler.py)."""
+from datetime import datetime, timedelta
+
+import pytest
+
+import factories
+from app import db
+from app.models import LeadProfile, JobWatermark
+from app.statuses import run_status_transitions, TRANSITIONS_JOB
+import app.statuses as statuses_module
+from app.scheduler import acquire_job, release_job, run_due_jobs
+
+
+@pytest.fixture
+def closer(app):
+    return factories.user('closer', role='closer')
+
+
+def book(closer, name, start):
+    lead = factories.lead(name, status='agenda')
+    factories.appointment(closer, lead, start)
+    db.session.commit()
+    return lead
+
+
+def statuses(leads):
+    db.session.expire_all()
+    return [db.session.query(LeadProfile.status).filter_by(user_id=lead.id).scalar() for lead in leads]
+
+
+def watermark():
+    db.session.expire_all()
+    return db.session.get(JobWatermark, TRANSITIONS_JOB)
+
+
+def test_passed_appointments_move_their_leads_out_of_agenda(closer):
+    now = datetime.utcnow()
+    passed = [book(closer, f"passed{i}", now - timedelta(hours=1, minutes=i)) for i in range(3)]
+    upcoming = book(closer, 'upcoming', now + timedelta(days=1))
+
+    assert run_status_transitions() == (3, 3)
+
+    assert statuses(passed) == ['new', 'new', 'new']
+    assert statuses([upcoming]) == ['agenda']
+
+
+def test_watermark_resumes_where_the_last_batch_stopped(closer, monkeypatch):
+    start = datetime.utcnow() - timedelta(hours=2)
+    closers = [closer] + [factories.user(f"closer{i}", role='closer') for i in (2, 3)]
+    leads = [book(c, f"lead{i}", start) for i, c in enumerate(closers)] # Same start_time: id breaks the tie
+
+    clock = iter([0, 0, 10]) # Start, first check, out of time after one batch
+    monkeypatch.setattr(statuses_module.time, 'monotonic', lambda: next(clock))
+    assert run_status_transitions(batch_size=2, max_seconds=5) == (2, 2)
+    monkeypatch.undo()
+    assert (watermark().watermark_at, watermark().watermark_id) == (start, 2)
+    assert statuses(leads) == ['new', 'new', 'agenda']
+
+    assert run_status_transitions() == (1, 1)
+    assert statuses(leads) == ['new', 'new', 'new']
+    assert run_status_transitions() == (0, 0) # Nothing passed since
+
+
+def test_first_run_only_looks_back_a_limited_time(closer):
+    ancient = book(closer, 'ancient', datetime.utcnow() - timedelta(days=90))
+
+    assert run_status_transitions() == (0, 0)
+    assert statuses([ancient]) == ['agenda']
+
+
+def test_job_lock_lets_one_process_run_it_per_interval(app):
+    assert acquire_job('job', interval=60, ttl=300)
+    assert not acquire_job('job', interval=60, ttl=300) # Locked by the first run
+
+    release_job('job')
+    assert not acquire_job('job', interval=60, ttl=300) # Ran less than a minute ago
+    assert acquire_job('job', interval=0, ttl=300)
+
+
+def test_run_due_jobs_skips_disabled_jobs_unless_forced(app, closer):
+    lead = book(closer, 'lead', datetime.utcnow() - timedelta(hours=1))
+    app.config['STATUS_TRANSITIONS_INTERVAL'] = 0
+
+    assert run_due_jobs(app) == {}
+    assert run_due_jobs(app, force=True) == {TRANSITIONS_JOB: (1, 1)}
+    assert statuses([lead]) == ['new']
+    assert watermark().locked_until is None
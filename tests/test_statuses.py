@@ -0,0 +1,67 @@
+"""Set-based lead status engine (app/statuses.py)."""
+from datetime import datetime, timedelta
+
+import factories
+from app import db
+from app.models import LeadProfile
+from app.statuses import compute_lead_statuses, apply_lead_statuses, recompute_statuses
+
+
+def status_of(user):
+    db.session.expire_all()
+    return db.session.query(LeadProfile.status).filter_by(user_id=user.id).scalar()
+
+
+def test_rules_by_priority(app):
+    closer = factories.user('closer', role='closer')
+    program = factories.program(price=1000.0)
+    owing = factories.lead('owing')
+    factories.payment(factories.enrollment(owing, program), 400.0)
+    paid = factories.lead('paid')
+    factories.payment(factories.enrollment(paid, program), 1000.0)
+    renewed = factories.lead('renewed')
+    factories.payment(factories.enrollment(renewed, program), 1000.0, payment_type='Renovación') # Import spelling
+    booked = factories.lead('booked')
+    factories.appointment(closer, booked, datetime.utcnow() + timedelta(days=1))
+    past = factories.lead('past')
+    factories.appointment(closer, past, datetime.utcnow() - timedelta(days=1))
+    fresh = factories.lead('fresh')
+    db.session.commit()
+
+    statuses = compute_lead_statuses([u.id for u in (owing, paid, renewed, booked, past, fresh)])
+
+    assert [statuses[u.id] for u in (owing, paid, renewed, booked, past, fresh)] == [
+        'pending', 'completed', 'renewed', 'agenda', 'new', 'new'
+    ]
+
+
+def test_apply_writes_only_changes_and_creates_missing_profiles(app):
+    program = factories.program(price=1000.0)
+    lead = factories.lead('lead', status='new')
+    factories.payment(factories.enrollment(lead, program), 1000.0)
+    without_profile = factories.user('bare')
+    unchanged = factories.lead('unchanged', status='new')
+    db.session.commit()
+
+    assert apply_lead_statuses([lead.id, without_profile.id, unchanged.id, lead.id]) == 2
+    db.session.commit()
+
+    assert status_of(lead) == 'completed'
+    assert status_of(without_profile) == 'new'
+    assert status_of(unchanged) == 'new'
+
+
+def test_recompute_since_only_touches_recent_activity(app):
+    program = factories.program(price=1000.0)
+    recent = factories.lead('recent', status='new')
+    factories.payment(factories.enrollment(recent, program), 100.0, date=datetime.utcnow())
+    old = factories.lead('old', status='new')
+    factories.payment(factories.enrollment(old, program, enrollment_date=datetime(2020, 1, 1)), 100.0,
+                      date=datetime(2020, 1, 1))
+    db.session.commit()
+
+    checked, changed = recompute_statuses(since=datetime.utcnow() - timedelta(days=1))
+
+    assert (checked, changed) == (1, 1)
+    assert status_of(recent) == 'pending'
+    assert status_of(old) == 'new'